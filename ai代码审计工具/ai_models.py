@@ -1,13 +1,100 @@
+import asyncio
+import contextlib
 import logging
 import os
 import json
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 import requests
-from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional, Iterable, Iterator, AsyncIterator, Callable
+from response_cache import ResponseCache
+from rate_limiter import TokenBucket
+from chunker import estimate_tokens
+from tracing import NULL_TRACER
+from router import ProviderRouter, DEFAULT_ROUTING
+
 
 class AIModels:
-    def __init__(self):
+    # 各服务商默认使用的模型
+    DEFAULT_MODEL_NAMES = {
+        'chatgpt': 'gpt-4',
+        'deepseek': 'deepseek-chat',
+        'kimi': 'moonshot-v1-8k',
+        'ollama': 'codellama'
+    }
+
+    # 单个请求中代码内容的默认token预算，需为提示词和模型输出留出上下文空间，可通过token_budget字段覆盖
+    DEFAULT_TOKEN_BUDGETS = {
+        'chatgpt': 6000,
+        'deepseek': 24000,
+        'kimi': 6000,
+        'ollama': 3000
+    }
+
+    # 各服务商默认模型每百万token的估算价格（美元），仅用于统计费用，可在config.json的pricing字段中覆盖
+    DEFAULT_PRICING = {
+        'chatgpt': {'prompt': 30.0, 'completion': 60.0},
+        'deepseek': {'prompt': 0.27, 'completion': 1.10},
+        'kimi': {'prompt': 1.65, 'completion': 1.65},
+        'ollama': {'prompt': 0.0, 'completion': 0.0}
+    }
+
+    # 服务商显示名称
+    DISPLAY_NAMES = {
+        'chatgpt': 'ChatGPT',
+        'deepseek': 'DeepSeek',
+        'kimi': 'Kimi',
+        'ollama': 'Ollama'
+    }
+
+    # 在多个服务商之间对冲和故障转移的虚拟服务商，策略见config.json的auto字段
+    ROUTED_MODEL = 'auto'
+
+    # 审计提示词，同时参与缓存键的计算。Ollama通过system字段传入，使各代码块的提示词前缀保持一致，
+    # 服务端可以复用已处理的前缀
+    SYSTEM_PROMPT = '你是一个专业的代码审计专家，请分析以下代码中的潜在问题和安全漏洞。'
+
+    # 各服务商默认的超时（秒）、重试和连接池策略，可在config.json的http字段中覆盖
+    DEFAULT_HTTP_POLICY = {
+        'connect_timeout': 10,
+        'read_timeout': 300,
+        'max_retries': 3,
+        'backoff_base': 1.0,
+        'backoff_max': 30.0,
+        # 服务端Retry-After的上限（秒），避免代理返回过长的等待时间使单个代码块长时间挂起
+        'retry_after_max': 60.0,
+        'pool_size': 10
+    }
+
+    # 需要重试的HTTP状态码
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    # 各服务商默认的并发和限速策略，可在config.json的limits字段中覆盖，0表示不限速
+    DEFAULT_LIMITS = {
+        'max_concurrency': 4,
+        'requests_per_minute': 0,
+        'tokens_per_minute': 0
+    }
+
+    def __init__(self, cache: Optional[ResponseCache] = None):
         self.logger = logging.getLogger(__name__)
         self.config = self.load_config()
+        self.cache = cache if cache is not None else ResponseCache()
+        self.sessions = {}
+        self.session_lock = threading.Lock()
+        self.buckets = {}
+        self.slots = {}
+        self.router = None
+        self.endpoint_load = {}
+        self.endpoint_served = {}
+        self.tracer = NULL_TRACER
+        # 工作线程当前请求所属批次的取消事件，重试等待期间被设置时立即放弃
+        self.local = threading.local()
         
     def load_config(self) -> Dict[str, Any]:
         """加载API配置"""
@@ -19,7 +106,8 @@ class AIModels:
             'chatgpt': {'api_key': '', 'api_base': 'https://api.openai.com/v1'},
             'deepseek': {'api_key': '', 'api_base': 'https://api.deepseek.com/v1'},
             'kimi': {'api_key': '', 'api_base': 'https://api.moonshot.cn/v1'},
-            'ollama': {'api_base': 'http://localhost:11434'}
+            'ollama': {'api_base': 'http://localhost:11434', 'keep_alive': '30m'},
+            'auto': {'providers': list(DEFAULT_ROUTING['providers'])}
         }
     
     def save_config(self, config: Dict[str, Any]):
@@ -28,28 +116,478 @@ class AIModels:
         with open(config_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=4, ensure_ascii=False)
         self.config = config
+        with self.session_lock:
+            self.router = None
     
-    def analyze(self, code_data: str, model: str = 'chatgpt') -> Dict[str, Any]:
-        """调用AI模型进行代码分析"""
+    def get_model_name(self, model: str) -> str:
+        """获取服务商实际使用的模型名称，可在配置中通过model字段覆盖"""
+        if model == self.ROUTED_MODEL:
+            return '+'.join(self.get_model_name(p) for p in self.get_routed_providers())
+        return self.config.get(model, {}).get('model') or self.DEFAULT_MODEL_NAMES.get(model, model)
+
+    def get_model_version(self, model: str) -> str:
+        """返回用于缓存失效判断的模型版本标识"""
+        if model == self.ROUTED_MODEL:
+            return f'{model}:' + ','.join(self.get_model_version(p) for p in self.get_routed_providers())
+        return f'{model}:{self.get_model_name(model)}'
+
+    def get_token_budget(self, model: str) -> int:
+        """获取单个请求中代码内容的token预算，自动路由时取各服务商中最小的预算"""
+        if model == self.ROUTED_MODEL and 'token_budget' not in self.config.get(model, {}):
+            return min((self.get_token_budget(p) for p in self.get_routed_providers()), default=6000)
+        config = self.config.get(model, {})
+        if model == 'ollama' and not config.get('token_budget') and config.get('num_ctx'):
+            # 为提示词和模型输出留出一半上下文
+            return max(512, int(config['num_ctx']) // 2)
+        return int(self.config.get(model, {}).get('token_budget') or self.DEFAULT_TOKEN_BUDGETS.get(model, 6000))
+
+    def get_system_prompt(self, model: str) -> str:
+        """获取服务商使用的审计提示词"""
+        return self.SYSTEM_PROMPT
+
+    def get_ollama_endpoints(self) -> List[str]:
+        """返回Ollama服务地址列表，配置了endpoints时在多个本地服务之间分发请求"""
+        config = self.config.get('ollama', {})
+        return list(config.get('endpoints') or [config.get('api_base', 'http://localhost:11434')])
+
+    def warm_up(self, model: str):
+        """
+        预先加载本地模型并处理一次公共提示词前缀，避免首批代码块承担冷启动耗时。
+        只对Ollama（含自动路由中的Ollama）生效，可通过ollama配置的warmup字段关闭，失败时只记录警告
+        """
+        providers = self.get_routed_providers() if model == self.ROUTED_MODEL else [model]
+        if 'ollama' not in providers or not self.config.get('ollama', {}).get('warmup', True):
+            return
+
+        def warm(api_base):
+            started = time.monotonic()
+            try:
+                # 只生成1个token，使模型加载到内存并缓存system前缀
+                data = dict(self._ollama_payload(), system=self.SYSTEM_PROMPT, prompt='\n', stream=False)
+                data['options'] = dict(data.get('options', {}), num_predict=1)
+                response = self._post('ollama', f'{api_base}/api/generate', json=data)
+                if response.status_code != 200:
+                    raise Exception(response.text)
+                load = response.json().get('load_duration', 0) / 1e9
+                self.logger.info(f'Ollama at {api_base} warmed up in {time.monotonic() - started:.2f}s '
+                                 f'(model load {load:.2f}s)')
+            except Exception as e:
+                self.logger.warning(f'Ollama warm-up at {api_base} failed: {e}')
+
+        with self.tracer.span('ai.warmup', 'ai', model='ollama'):
+            threads = [threading.Thread(target=warm, args=(api_base,), name='ollama-warmup', daemon=True)
+                       for api_base in self.get_ollama_endpoints()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def estimate_cost(self, model: str, usage: Dict[str, Any]) -> float:
+        """按token用量估算一次请求的费用（美元）"""
+        pricing = dict(self.DEFAULT_PRICING.get(model, {}))
+        pricing.update(self.config.get(model, {}).get('pricing', {}))
+        return (usage.get('prompt_tokens', 0) * pricing.get('prompt', 0.0) +
+                usage.get('completion_tokens', 0) * pricing.get('completion', 0.0)) / 1e6
+
+    def get_routed_providers(self) -> List[str]:
+        """返回自动路由中已配置（有API密钥）的服务商，按优先级排列"""
+        providers = self.config.get(self.ROUTED_MODEL, {}).get('providers', DEFAULT_ROUTING['providers'])
+        return [p for p in providers if p in self.DEFAULT_MODEL_NAMES and p in self.config
+                and (p == 'ollama' or self.config[p].get('api_key'))]
+
+    def get_routing_stats(self) -> Optional[Dict[str, Any]]:
+        """返回自动路由的对冲、故障转移和各服务商延迟统计，未使用自动路由时返回None"""
+        return self.router.get_stats() if self.router is not None else None
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """返回响应缓存的命中统计"""
+        return self.cache.get_stats()
+
+    def analyze(self, code_data: str, model: str = 'chatgpt',
+                on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        调用AI模型进行代码分析，相同代码优先从缓存返回
+        Args:
+            code_data: 需要分析的代码
+            model: 使用的AI服务商
+            on_token: 流式输出回调，提供时以流式方式请求并逐段回传生成的文本
+        Returns:
+            分析结果，包含analysis、model、usage和metrics
+        """
         self.logger.info(f'Starting AI model analysis using {model}...')
-        
-        if model not in self.config:
+        self._check_model(model)
+
+        cache_key = self._cache_key(model, code_data)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.logger.info(f'AI analysis cache hit for {model}')
+            self.tracer.count('ai', cache_hits=1)
+            if on_token is not None:
+                on_token(cached['analysis'])
+            return cached
+
+        time.sleep(self._reserve(model, code_data))
+        return self._request(model, code_data, cache_key, on_token)
+
+    async def analyze_many(self, chunks: Iterable[Dict[str, Any]], model: str = 'chatgpt',
+                           on_token: Optional[Callable[[str, str], None]] = None,
+                           cancel_event: Optional[threading.Event] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        并发分析多个代码块，按完成顺序产出结果
+        Args:
+            chunks: 代码块列表或迭代器，每个代码块至少包含chunk_id和content。
+                    只在有空闲并发槽时才取下一个代码块，因此可以传入按优先级实时产出的（可阻塞的）生成器
+            model: 使用的AI服务商
+            on_token: 流式输出回调，参数为(chunk_id, 文本片段)，会在工作线程中调用
+            cancel_event: 取消事件，被设置后正在等待重试的请求立即结束
+        Returns:
+            异步迭代器，每项包含chunk_id、chunk、result和error，单个代码块失败不影响其他代码块
+        """
+        self._check_model(model)
+        concurrency = self._get_limits(model)['max_concurrency']
+        loop = asyncio.get_running_loop()
+        # 多出的一个线程用于从可能阻塞的输入迭代器中取代码块
+        executor = ThreadPoolExecutor(max_workers=concurrency + 1, thread_name_prefix=f'ai-{model}')
+        iterator = iter(chunks)
+        iterator_lock = asyncio.Lock()
+        results = asyncio.Queue()
+        done = object()
+
+        def request(*args):
+            self.local.cancel_event = cancel_event
+            try:
+                return self._request(*args)
+            finally:
+                self.local.cancel_event = None
+
+        async def run(chunk):
+            chunk_id = chunk['chunk_id']
+            item = {'chunk_id': chunk_id, 'chunk': chunk, 'result': None, 'error': None}
+            chunk_token = None
+            if on_token is not None:
+                chunk_token = lambda text: on_token(chunk_id, text)
+            try:
+                cache_key = self._cache_key(model, chunk['content'])
+                item['result'] = self.cache.get(cache_key)
+                if item['result'] is not None:
+                    self.tracer.count('ai', cache_hits=1)
+                    if chunk_token is not None:
+                        chunk_token(item['result']['analysis'])
+                else:
+                    delay = self._reserve(model, chunk['content'])
+                    if delay > 0:
+                        self.tracer.count('ai', rate_limit_waits=1, rate_limit_wait=delay)
+                    await asyncio.sleep(delay)
+                    item['result'] = await loop.run_in_executor(
+                        executor, request, model, chunk['content'], cache_key, chunk_token)
+            except Exception as e:
+                self.logger.error(f'AI analysis of chunk {chunk["chunk_id"]} failed: {e}')
+                item['error'] = str(e)
+            return item
+
+        async def worker():
+            while True:
+                async with iterator_lock:
+                    chunk = await loop.run_in_executor(executor, next, iterator, None)
+                if chunk is None:
+                    return
+                await results.put(await run(chunk))
+
+        async def supervise():
+            try:
+                await asyncio.gather(*workers)
+            except Exception as e:
+                await results.put(e)
+            await results.put(done)
+
+        self.logger.info(f'Dispatching chunks to {model} with concurrency {concurrency}')
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        supervisor = asyncio.ensure_future(supervise())
+        try:
+            while True:
+                item = await results.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            supervisor.cancel()
+            executor.shutdown(wait=False)
+
+    def analyze_batch(self, chunks: Iterable[Dict[str, Any]], model: str = 'chatgpt',
+                      on_token: Optional[Callable[[str, str], None]] = None,
+                      cancel_event: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """
+        analyze_many的阻塞版本，在后台线程运行事件循环，按完成顺序逐个产出结果。
+        cancel_event被设置或调用方提前结束迭代时取消事件循环中的任务，已发出的HTTP请求的结果被丢弃
+        """
+        self._check_model(model)
+        results = queue.Queue()
+        stop = threading.Event()
+        done = object()
+        running = {}
+
+        async def pump():
+            running['loop'] = asyncio.get_running_loop()
+            running['task'] = asyncio.current_task()
+            agen = self.analyze_many(chunks, model, on_token, stop)
+            try:
+                async for item in agen:
+                    results.put(item)
+                    if stop.is_set():
+                        break
+            finally:
+                await agen.aclose()
+
+        def run():
+            try:
+                asyncio.run(pump())
+            except asyncio.CancelledError:
+                pass
+            except BaseException as e:
+                results.put(e)
+            finally:
+                results.put(done)
+
+        thread = threading.Thread(target=run, name=f'ai-batch-{model}', daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    item = results.get(timeout=0.1)
+                except queue.Empty:
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    continue
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            if 'task' in running:
+                try:
+                    running['loop'].call_soon_threadsafe(running['task'].cancel)
+                except RuntimeError:
+                    # 事件循环已经结束
+                    pass
+
+    def is_cached(self, code_data: str, model: str = 'chatgpt') -> bool:
+        """判断代码的分析结果是否已在缓存中，不计入命中统计"""
+        return self.cache.contains(self._cache_key(model, code_data))
+
+    def _check_model(self, model: str):
+        if model == self.ROUTED_MODEL:
+            if not self.get_routed_providers():
+                raise ValueError('自动路由中没有已配置API密钥的服务商')
+            return
+        if model not in self.DEFAULT_MODEL_NAMES or model not in self.config:
             raise ValueError(f'不支持的AI模型: {model}')
-            
-        if model == 'chatgpt':
-            return self._analyze_with_chatgpt(code_data)
-        elif model == 'deepseek':
-            return self._analyze_with_deepseek(code_data)
-        elif model == 'kimi':
-            return self._analyze_with_kimi(code_data)
-        elif model == 'ollama':
-            return self._analyze_with_ollama(code_data)
-    
-    def _analyze_with_chatgpt(self, code_data: str) -> Dict[str, Any]:
-        """使用ChatGPT进行分析"""
-        config = self.config['chatgpt']
-        if not config['api_key']:
-            raise ValueError('请先配置ChatGPT API密钥')
+        if model != 'ollama' and not self.config[model].get('api_key'):
+            raise ValueError(f'请先配置{self.DISPLAY_NAMES[model]} API密钥')
+
+    def _cache_key(self, model: str, code_data: str) -> str:
+        return ResponseCache.make_key(model, self.get_model_name(model),
+                                      self.get_system_prompt(model), code_data)
+
+    def _get_router(self) -> ProviderRouter:
+        """获取自动路由器，各服务商的延迟和错误统计在多个批次间共享"""
+        with self.session_lock:
+            if self.router is None:
+                config = {k: v for k, v in self.config.get(self.ROUTED_MODEL, {}).items() if k != 'providers'}
+                self.router = ProviderRouter(self, self.get_routed_providers(), config)
+                self.router.tracer = self.tracer
+            return self.router
+
+    def _get_limits(self, model: str) -> Dict[str, Any]:
+        """获取服务商的并发和限速策略"""
+        limits = dict(self.DEFAULT_LIMITS)
+        limits.update(self.config.get(model, {}).get('limits', {}))
+        limits['max_concurrency'] = max(1, int(limits['max_concurrency']))
+        return limits
+
+    def _get_buckets(self, model: str):
+        """获取服务商的请求数和token数令牌桶，多个批次共享同一组桶"""
+        with self.session_lock:
+            buckets = self.buckets.get(model)
+            if buckets is None:
+                limits = self._get_limits(model)
+                buckets = (TokenBucket(limits['requests_per_minute']), TokenBucket(limits['tokens_per_minute']))
+                self.buckets[model] = buckets
+            return buckets
+
+    def share_limits(self, shared: Dict[str, Any], owner: int = 0):
+        """
+        使用多个进程共享的限额代替本进程的令牌桶
+        Args:
+            shared: 服务商 -> (请求数令牌桶, token数令牌桶, 并发名额)，由批量调度器创建，
+                    并发名额（rate_limiter.SharedSlots）限制所有进程合计的进行中请求数
+            owner: 本进程在并发名额中的位置，进程退出后调度器据此归还其占用的名额
+        """
+        with self.session_lock:
+            for model, (request_bucket, token_bucket, slots) in shared.items():
+                slots.bind(owner)
+                self.buckets[model] = (request_bucket, token_bucket)
+                self.slots[model] = slots
+
+    def _slot(self, model: str):
+        """共享并发上限时占用一个进行中请求的名额"""
+        slots = self.slots.get(model)
+        return slots if slots is not None else contextlib.nullcontext()
+
+    def _reserve(self, model: str, code_data: str) -> float:
+        """预约一次请求所需的配额，返回需要等待的秒数"""
+        request_bucket, token_bucket = self._get_buckets(model)
+        tokens = estimate_tokens(self.get_system_prompt(model)) + estimate_tokens(code_data)
+        return max(request_bucket.reserve(1), token_bucket.reserve(tokens))
+
+    def _request(self, model: str, code_data: str, cache_key: str,
+                 on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """实际调用服务商接口，并将结果写入缓存"""
+        if model == self.ROUTED_MODEL:
+            # 各服务商的span、用量和令牌桶在路由器内部的请求中分别记录
+            result = self._get_router().request(code_data, on_token)
+            self.cache.put(cache_key, result)
+            return result
+        with self._slot(model), self.tracer.span('ai.request', 'ai', model=model,
+                                                 stream=on_token is not None) as span:
+            try:
+                if model == 'chatgpt':
+                    result = self._analyze_with_chatgpt(code_data, on_token)
+                elif model == 'deepseek':
+                    result = self._analyze_with_deepseek(code_data, on_token)
+                elif model == 'kimi':
+                    result = self._analyze_with_kimi(code_data, on_token)
+                elif model == 'ollama':
+                    result = self._analyze_with_ollama(code_data, on_token)
+            except Exception:
+                self.tracer.record_request(model, 0, 0, 0.0, error=True)
+                raise
+            usage = result.get('usage') or {}
+            cost = self.estimate_cost(model, usage)
+            span.set(prompt_tokens=usage.get('prompt_tokens', 0), completion_tokens=usage.get('completion_tokens', 0),
+                     cost=cost)
+            self.tracer.record_request(model, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), cost)
+
+        metrics = result['metrics']
+        self.logger.info(f'{model} request finished: ttft={metrics["ttft"]:.2f}s, '
+                         f'{metrics["tokens_per_second"]:.1f} tokens/s')
+
+        # 按接口返回的实际用量修正token桶
+        if usage:
+            estimated = estimate_tokens(self.get_system_prompt(model)) + estimate_tokens(code_data)
+            actual = usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)
+            self._get_buckets(model)[1].adjust(actual - estimated)
+
+        self.cache.put(cache_key, result)
+        return result
+
+    def _get_http_policy(self, model: str) -> Dict[str, Any]:
+        """获取服务商的超时和重试策略，未配置的字段使用默认值"""
+        policy = dict(self.DEFAULT_HTTP_POLICY)
+        policy.update(self.config.get(model, {}).get('http', {}))
+        return policy
+
+    def _get_session(self, model: str) -> requests.Session:
+        """获取服务商的连接池会话，同一服务商的请求复用keep-alive连接"""
+        with self.session_lock:
+            session = self.sessions.get(model)
+            if session is None:
+                policy = self._get_http_policy(model)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=policy['pool_size'], max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[model] = session
+            return session
+
+    def close(self):
+        """关闭所有连接池会话"""
+        with self.session_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析Retry-After响应头，支持秒数和HTTP日期两种格式"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _post(self, model: str, url: str, **kwargs) -> requests.Response:
+        """
+        发送POST请求，对连接错误、超时、429和5xx响应进行带抖动的指数退避重试
+        Args:
+            model: 服务商名称，用于选择会话和重试策略
+            url: 请求地址
+        Returns:
+            最后一次请求的响应
+        """
+        policy = self._get_http_policy(model)
+        session = self._get_session(model)
+        timeout = (policy['connect_timeout'], policy['read_timeout'])
+        attempt = 0
+        while True:
+            try:
+                response = session.post(url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= policy['max_retries']:
+                    raise
+                delay = self._backoff_delay(policy, attempt)
+                self.logger.warning(f'{model} request failed ({e}), retrying in {delay:.1f}s')
+            else:
+                if response.status_code not in self.RETRY_STATUS or attempt >= policy['max_retries']:
+                    return response
+                delay = self._parse_retry_after(response.headers.get('Retry-After'))
+                if delay is None:
+                    delay = self._backoff_delay(policy, attempt)
+                delay = min(delay, policy['retry_after_max'])
+                self.logger.warning(f'{model} returned HTTP {response.status_code}, retrying in {delay:.1f}s')
+                response.close()
+            self.tracer.count('ai', retries=1, retry_wait=delay)
+            cancel_event = getattr(self.local, 'cancel_event', None)
+            if cancel_event is None:
+                time.sleep(delay)
+            elif cancel_event.wait(delay):
+                raise RuntimeError('审计已取消')
+            attempt += 1
+
+    @staticmethod
+    def _backoff_delay(policy: Dict[str, Any], attempt: int) -> float:
+        """计算第attempt次重试的等待时间（full jitter）"""
+        return random.uniform(0, min(policy['backoff_max'], policy['backoff_base'] * (2 ** attempt)))
+
+    @staticmethod
+    def _metrics(started: float, first_token_at: Optional[float], completion_tokens: int) -> Dict[str, float]:
+        """计算单次请求的耗时、首token时间和生成速度"""
+        finished = time.monotonic()
+        if first_token_at is None:
+            first_token_at = finished
+        generation_time = finished - first_token_at
+        return {
+            'latency': finished - started,
+            'ttft': first_token_at - started,
+            'tokens_per_second': completion_tokens / generation_time if generation_time > 0 else 0.0
+        }
+
+    def _chat_completion(self, model: str, display_name: str, code_data: str,
+                         on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """调用OpenAI兼容的chat/completions接口，提供on_token时按SSE流式读取"""
+        config = self.config[model]
+        if not config.get('api_key'):
+            raise ValueError(f'请先配置{display_name} API密钥')
             
         headers = {
             'Authorization': f'Bearer {config["api_key"]}',
@@ -57,66 +595,171 @@ class AIModels:
         }
         
         data = {
-            'model': 'gpt-4',
+            'model': self.get_model_name(model),
             'messages': [
-                {'role': 'system', 'content': '你是一个专业的代码审计专家，请分析以下代码中的潜在问题和安全漏洞。'},
+                {'role': 'system', 'content': self.SYSTEM_PROMPT},
                 {'role': 'user', 'content': code_data}
-            ]
+            ],
+            'stream': on_token is not None
         }
         
-        response = requests.post(
+        started = time.monotonic()
+        response = self._post(
+            model,
             f"{config['api_base']}/chat/completions",
             headers=headers,
-            json=data
+            json=data,
+            stream=on_token is not None
         )
         
-        if response.status_code == 200:
+        if response.status_code != 200:
+            raise Exception(f'{display_name} API调用失败: {response.text}')
+
+        if on_token is None:
             result = response.json()
+            usage = result.get('usage') or {}
+            completion_tokens = usage.get('completion_tokens', 0)
             return {
                 'analysis': result['choices'][0]['message']['content'],
-                'model': 'ChatGPT'
+                'model': display_name,
+                'usage': {
+                    'prompt_tokens': usage.get('prompt_tokens', 0),
+                    'completion_tokens': completion_tokens
+                },
+                'metrics': self._metrics(started, None, completion_tokens)
             }
-        else:
-            raise Exception(f'ChatGPT API调用失败: {response.text}')
+
+        parts = []
+        usage = {}
+        deltas = 0
+        first_token_at = None
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                event = json.loads(payload)
+                usage = event.get('usage') or usage
+                for choice in event.get('choices') or []:
+                    text = (choice.get('delta') or {}).get('content')
+                    if text:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                        deltas += 1
+                        parts.append(text)
+                        on_token(text)
+        # 流式响应通常不带用量统计，按增量事件数估算生成的token数
+        completion_tokens = usage.get('completion_tokens') or deltas
+        return {
+            'analysis': ''.join(parts),
+            'model': display_name,
+            'usage': {
+                'prompt_tokens': usage.get('prompt_tokens', 0),
+                'completion_tokens': completion_tokens
+            },
+            'metrics': self._metrics(started, first_token_at, completion_tokens)
+        }
+
+    def _analyze_with_chatgpt(self, code_data: str, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """使用ChatGPT进行分析"""
+        return self._chat_completion('chatgpt', 'ChatGPT', code_data, on_token)
     
-    def _analyze_with_deepseek(self, code_data: str) -> Dict[str, Any]:
+    def _analyze_with_deepseek(self, code_data: str, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """使用DeepSeek进行分析"""
-        config = self.config['deepseek']
-        if not config['api_key']:
-            raise ValueError('请先配置DeepSeek API密钥')
-            
-        # TODO: 实现DeepSeek API调用
-        return {'analysis': '暂未实现DeepSeek API调用', 'model': 'DeepSeek'}
+        return self._chat_completion('deepseek', 'DeepSeek', code_data, on_token)
     
-    def _analyze_with_kimi(self, code_data: str) -> Dict[str, Any]:
+    def _analyze_with_kimi(self, code_data: str, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """使用Kimi进行分析"""
-        config = self.config['kimi']
-        if not config['api_key']:
-            raise ValueError('请先配置Kimi API密钥')
-            
-        # TODO: 实现Kimi API调用
-        return {'analysis': '暂未实现Kimi API调用', 'model': 'Kimi'}
+        return self._chat_completion('kimi', 'Kimi', code_data, on_token)
     
-    def _analyze_with_ollama(self, code_data: str) -> Dict[str, Any]:
-        """使用Ollama进行分析"""
+    def _ollama_payload(self) -> Dict[str, Any]:
+        """Ollama请求的公共字段：模型、keep_alive和上下文长度，num_ctx需在各请求中保持一致，否则服务端会重新加载模型"""
         config = self.config['ollama']
+        data = {'model': self.get_model_name('ollama')}
+        if config.get('keep_alive') is not None:
+            data['keep_alive'] = config['keep_alive']
+        if config.get('num_ctx'):
+            data['options'] = {'num_ctx': int(config['num_ctx'])}
+        return data
+
+    def _acquire_endpoint(self) -> str:
+        """选择进行中请求最少的Ollama服务，负载相同时轮流选择"""
+        endpoints = self.get_ollama_endpoints()
+        with self.session_lock:
+            api_base = min(endpoints, key=lambda e: (self.endpoint_load.get(e, 0), self.endpoint_served.get(e, 0)))
+            self.endpoint_load[api_base] = self.endpoint_load.get(api_base, 0) + 1
+            self.endpoint_served[api_base] = self.endpoint_served.get(api_base, 0) + 1
+        return api_base
+
+    def _release_endpoint(self, api_base: str):
+        with self.session_lock:
+            self.endpoint_load[api_base] -= 1
+
+    def _analyze_with_ollama(self, code_data: str, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """使用Ollama进行分析，配置了多个服务地址时发往负载最低的一个"""
+        api_base = self._acquire_endpoint()
+        try:
+            return self._ollama_generate(api_base, code_data, on_token)
+        finally:
+            self._release_endpoint(api_base)
+
+    def _ollama_generate(self, api_base: str, code_data: str,
+                         on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """调用Ollama的generate接口，提供on_token时按NDJSON流式读取"""
+        data = dict(self._ollama_payload(), system=self.SYSTEM_PROMPT, prompt=code_data,
+                    stream=on_token is not None)
         
-        data = {
-            'model': 'codellama',
-            'prompt': f'请分析以下代码中的潜在问题和安全漏洞：\n{code_data}',
-            'stream': False
-        }
-        
-        response = requests.post(
-            f"{config['api_base']}/api/generate",
-            json=data
+        started = time.monotonic()
+        response = self._post(
+            'ollama',
+            f"{api_base}/api/generate",
+            json=data,
+            stream=on_token is not None
         )
         
-        if response.status_code == 200:
+        if response.status_code != 200:
+            raise Exception(f'Ollama API调用失败: {response.text}')
+
+        first_token_at = None
+        if on_token is None:
             result = response.json()
-            return {
-                'analysis': result['response'],
-                'model': 'Ollama'
-            }
+            text = result['response']
         else:
-            raise Exception(f'Ollama API调用失败: {response.text}')
\ No newline at end of file
+            parts = []
+            result = {}
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event.get('error'):
+                        raise Exception(f'Ollama API调用失败: {event["error"]}')
+                    piece = event.get('response')
+                    if piece:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                        parts.append(piece)
+                        on_token(piece)
+                    if event.get('done'):
+                        result = event
+                        break
+            text = ''.join(parts)
+        completion_tokens = result.get('eval_count', 0)
+        metrics = self._metrics(started, first_token_at, completion_tokens)
+        if result.get('eval_duration'):
+            # 优先使用服务端统计的生成耗时（纳秒）
+            metrics['tokens_per_second'] = completion_tokens / (result['eval_duration'] / 1e9)
+        if result.get('load_duration', 0) > 1e9:
+            self.logger.warning(f'Ollama at {api_base} spent {result["load_duration"] / 1e9:.1f}s loading the model, '
+                                f'consider a longer keep_alive')
+        return {
+            'analysis': text,
+            'model': 'Ollama',
+            'usage': {
+                'prompt_tokens': result.get('prompt_eval_count', 0),
+                'completion_tokens': completion_tokens
+            },
+            'metrics': metrics
+        }
\ No newline at end of file
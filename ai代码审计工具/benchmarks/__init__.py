@@ -0,0 +1 @@
+# 基准测试：合成代码仓库、本地模拟LLM服务和性能场景
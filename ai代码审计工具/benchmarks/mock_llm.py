@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+# 模拟的审计意见，每个词作为一个流式增量
+REPLY = ('第3行存在可疑的动态代码执行，参数来自用户输入，属于高危问题。'
+         '建议删除该调用或对输入做严格白名单校验。').split('，')
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+    def do_POST(self):
+        server = self.server
+        started = time.monotonic()
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'invalid json'})
+            return
+        if self.path.endswith('/chat/completions'):
+            protocol = 'openai'
+            prompt = ''.join(m.get('content', '') for m in payload.get('messages', []))
+        elif self.path.endswith('/api/generate'):
+            protocol = 'ollama'
+            prompt = payload.get('system', '') + payload.get('prompt', '')
+        else:
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+
+        if server.should_throttle():
+            server.record(protocol, 429, started, 0, 0)
+            self.send_response(429)
+            self.send_header('Retry-After', str(server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion = REPLY * server.reply_repeat
+        # 模拟单台推理机：超过capacity的请求排队等待
+        with server.slots:
+            time.sleep(server.delay())
+            if payload.get('stream'):
+                self._stream(protocol, completion, prompt_tokens)
+            elif protocol == 'openai':
+                self._send_json(200, {
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': '，'.join(completion)}}],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(completion)}
+                })
+            else:
+                self._send_json(200, {'response': '，'.join(completion), 'done': True,
+                                      'prompt_eval_count': prompt_tokens, 'eval_count': len(completion),
+                                      'eval_duration': int(server.token_interval * len(completion) * 1e9)})
+        server.record(protocol, 200, started, prompt_tokens, len(completion))
+
+    def _stream(self, protocol: str, completion: List[str], prompt_tokens: int):
+        server = self.server
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8' if protocol == 'openai'
+                         else 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, text in enumerate(completion):
+            if i:
+                text = '，' + text
+            if server.token_interval:
+                time.sleep(server.token_interval)
+            if protocol == 'openai':
+                self._write_chunk('data: ' + json.dumps({'choices': [{'index': 0, 'delta': {'content': text}}]},
+                                                        ensure_ascii=False) + '\n\n')
+            else:
+                self._write_chunk(json.dumps({'response': text, 'done': False}, ensure_ascii=False) + '\n')
+        if protocol == 'openai':
+            self._write_chunk('data: ' + json.dumps({
+                'choices': [], 'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(completion)}
+            }) + '\n\n')
+            self._write_chunk('data: [DONE]\n\n')
+        else:
+            self._write_chunk(json.dumps({
+                'response': '', 'done': True, 'prompt_eval_count': prompt_tokens, 'eval_count': len(completion),
+                'eval_duration': int(server.token_interval * len(completion) * 1e9)
+            }) + '\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    本地模拟的LLM服务，同时支持OpenAI兼容的chat/completions和Ollama的/api/generate接口，
+    可注入固定延迟、随机抖动、429限流和流式输出速度，用于在不访问真实服务商的情况下测量审计吞吐
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.05, jitter: float = 0.0,
+                 error_rate: float = 0.0, retry_after: float = 0.0, token_interval: float = 0.0,
+                 reply_repeat: int = 1, capacity: int = 0, seed: int = 0):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示由系统分配
+            latency: 每个请求在返回首个token前的固定延迟（秒）
+            jitter: 在固定延迟上叠加的0~jitter秒均匀随机延迟
+            error_rate: 直接返回429的请求比例
+            retry_after: 429响应中Retry-After头的秒数
+            token_interval: 流式输出时相邻增量之间的间隔（秒）
+            reply_repeat: 回复内容重复的次数，用于调节生成长度
+            capacity: 同时处理的请求数上限，0表示不限制，用于模拟单台CPU推理机
+            seed: 抖动和429的随机种子
+        """
+        super().__init__((host, port), MockLLMHandler)
+        self.logger = logging.getLogger(__name__)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.token_interval = token_interval
+        self.reply_repeat = max(1, reply_repeat)
+        self.slots = threading.BoundedSemaphore(capacity) if capacity > 0 else contextlib.nullcontext()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.reset_stats()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockLLMServer':
+        """在后台线程中开始服务"""
+        self.thread = threading.Thread(target=self.serve_forever, name='mock-llm', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self) -> 'MockLLMServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def delay(self) -> float:
+        with self.lock:
+            return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def should_throttle(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'throttled': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                          'by_protocol': {}}
+            self.latencies = []
+
+    def record(self, protocol: str, status: int, started: float, prompt_tokens: int, completion_tokens: int):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['by_protocol'][protocol] = self.stats['by_protocol'].get(protocol, 0) + 1
+            if status == 429:
+                self.stats['throttled'] += 1
+                return
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += completion_tokens
+            self.latencies.append(time.monotonic() - started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回请求数、429次数、token数和成功请求的服务端延迟分位数"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = dict(self.stats, by_protocol=dict(self.stats['by_protocol']))
+        stats['latency_p50'] = percentile(latencies, 0.5)
+        stats['latency_p99'] = percentile(latencies, 0.99)
+        return stats
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """已排序列表的分位数（最近秩法），空列表返回None"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))
+    return round(values[index], 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动本地模拟LLM服务（OpenAI chat/completions和Ollama /api/generate）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回429的请求比例')
+    parser.add_argument('--retry-after', type=float, default=0.0)
+    parser.add_argument('--token-interval', type=float, default=0.0, help='流式输出的增量间隔（秒）')
+    parser.add_argument('--capacity', type=int, default=0, help='同时处理的请求数上限，0表示不限制')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = MockLLMServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                           args.retry_after, args.token_interval, capacity=args.capacity)
+    print(f'Mock LLM listening on {server.url} (OpenAI: {server.url}/v1, Ollama: {server.url})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.get_stats(), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows上没有resource模块，不统计峰值内存
+    resource = None
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PACKAGE_DIR not in sys.path:
+    sys.path.insert(0, PACKAGE_DIR)
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.synthetic_repo import generate_repo, parse_mix, DEFAULT_MIX
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# 场景定义：model为None时只做静态审计，dedup表示启用近似重复去重（其余场景关闭以便对比），
+# server为模拟LLM服务的参数，secondary为自动路由场景中备用服务商（或第二个Ollama服务）的模拟服务参数
+SCENARIOS = {
+    'crawl': {'crawl_only': True},
+    'static': {'model': None},
+    'static-lowmem': {'model': None, 'low_memory': True},
+    'ai-openai': {'model': 'chatgpt', 'server': {'latency': 0.05, 'jitter': 0.05}},
+    'ai-openai-stream': {'model': 'chatgpt', 'stream': True,
+                         'server': {'latency': 0.05, 'jitter': 0.05, 'token_interval': 0.002}},
+    'ai-ollama': {'model': 'ollama', 'stream': True,
+                  'server': {'latency': 0.05, 'jitter': 0.05, 'token_interval': 0.002, 'capacity': 2}},
+    'ai-openai-dedup': {'model': 'chatgpt', 'dedup': True, 'server': {'latency': 0.05, 'jitter': 0.05}},
+    'ai-openai-lowmem': {'model': 'chatgpt', 'low_memory': True, 'server': {'latency': 0.05, 'jitter': 0.05}},
+    'ai-429': {'model': 'chatgpt', 'server': {'latency': 0.05, 'jitter': 0.05, 'error_rate': 0.2}},
+    'ai-ollama-2x': {'model': 'ollama', 'stream': True,
+                     'server': {'latency': 0.05, 'jitter': 0.05, 'token_interval': 0.002, 'capacity': 2},
+                     'secondary': {'latency': 0.05, 'jitter': 0.05, 'token_interval': 0.002, 'capacity': 2}},
+    'ai-auto': {'model': 'auto', 'server': {'latency': 0.05, 'jitter': 0.5, 'error_rate': 0.05},
+                'secondary': {'latency': 0.1, 'jitter': 0.05}},
+}
+
+# 自动路由场景中主、备服务商的顺序
+ROUTED_PROVIDERS = ['deepseek', 'chatgpt']
+
+# 指标变化方向：1表示越大越好，-1表示越小越好
+METRIC_DIRECTIONS = {
+    'files_per_sec': 1,
+    'elapsed': -1,
+    'latency_p50': -1,
+    'latency_p99': -1,
+    'peak_rss_mb': -1,
+}
+
+
+def peak_rss_mb(who: int) -> Optional[float]:
+    """进程的峰值常驻内存（MB），Linux上ru_maxrss单位为KB，macOS上为字节"""
+    if resource is None:
+        return None
+    value = resource.getrusage(who).ru_maxrss
+    return round(value / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_child(scenario: str, repo: str, url: Optional[str], workers: Optional[int],
+              concurrency: int, secondary_url: Optional[str] = None) -> Dict[str, Any]:
+    """在子进程中执行单个场景，保证峰值内存只反映该场景本身"""
+    spec = SCENARIOS[scenario]
+    started = time.monotonic()
+    if spec.get('crawl_only'):
+        from web_crawler import WebCrawler
+        files = sum(1 for _ in WebCrawler().iter_files(repo))
+        return {'files': files, 'elapsed': time.monotonic() - started,
+                'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF) if resource else None}
+
+    from code_audit import CodeAudit
+    from core_engine import CoreEngine
+    from manifest import AuditManifest
+    from tracing import Tracer
+    from similarity import SimilarityIndex
+    model = spec.get('model')
+    ai_models = None
+    if model:
+        from ai_models import AIModels
+        from response_cache import ResponseCache
+        ai_models = AIModels(cache=ResponseCache(None))
+        limits = {'max_concurrency': concurrency, 'requests_per_minute': 0, 'tokens_per_minute': 0}
+        if model == 'auto':
+            targets = dict(zip(ROUTED_PROVIDERS, (url, secondary_url)))
+            ai_models.config[model] = dict(ai_models.config.get(model, {}), providers=ROUTED_PROVIDERS,
+                                           limits=limits, hedge_initial_delay=1.0, hedge_min_delay=0.1)
+        elif model == 'ollama' and secondary_url:
+            ai_models.config[model] = dict(ai_models.config.get(model, {}), endpoints=[url, secondary_url])
+            targets = {model: url}
+        else:
+            targets = {model: url}
+        for provider, target in targets.items():
+            config = dict(ai_models.config.get(provider, {}))
+            config.update({
+                'api_key': 'bench',
+                'api_base': target if provider == 'ollama' else f'{target}/v1',
+                'limits': limits,
+            })
+            config['http'] = dict(config.get('http', {}), max_retries=5, backoff_base=0.05, backoff_max=0.5)
+            ai_models.config[provider] = config
+
+    # 规则编译缓存和污点分析摘要只保存在内存中：每次运行都从冷缓存开始，也不写入用户的缓存文件
+    code_audit = CodeAudit(rules_cache_path=None, workers=workers, taint_cache_path=None)
+    engine = CoreEngine(ai_models=ai_models, code_audit=code_audit,
+                        manifest=AuditManifest(':memory:'), tracer=Tracer(),
+                        low_memory=spec.get('low_memory', False),
+                        similarity_index=SimilarityIndex(':memory:') if spec.get('dedup') else None,
+                        dedup=spec.get('dedup', False))
+    last_event = {}
+
+    def on_progress(event):
+        last_event.update(event)
+
+    on_token = (lambda chunk_id, text: None) if spec.get('stream') else None
+    try:
+        report = engine.run_audit(repo, model, on_token=on_token, on_progress=on_progress)
+    finally:
+        if model:
+            engine.ai_models.close()
+        engine.code_audit.close()
+        engine.manifest.close()
+    elapsed = time.monotonic() - started
+    summary = report['summary']
+    return {
+        'files': summary['files'],
+        'elapsed': elapsed,
+        'findings': summary['findings'],
+        'chunks': last_event.get('chunks_done', 0),
+        'chunks_failed': last_event.get('chunks_failed', 0),
+        'tokens_used': last_event.get('tokens_used', 0),
+        'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        'peak_worker_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        # 各阶段的墙钟时间，便于定位退化发生在哪个阶段
+        'stages': {name: stats['wall'] for name, stats in summary['trace']['stages'].items()},
+        'routing': summary['trace']['counters'].get('router'),
+    }
+
+
+def run_scenario(scenario: str, repo: str, args) -> Dict[str, Any]:
+    """启动模拟服务（AI场景），在子进程中执行场景并汇总客户端和服务端指标"""
+    spec = SCENARIOS[scenario]
+    server = MockLLMServer(**spec['server'], seed=args.seed).start() if 'server' in spec else None
+    secondary = MockLLMServer(**spec['secondary'], seed=args.seed + 1).start() if 'secondary' in spec else None
+    command = [sys.executable, os.path.abspath(__file__), '--child', scenario, '--repo', repo,
+               '--concurrency', str(args.concurrency)]
+    if server is not None:
+        command += ['--url', server.url]
+    if secondary is not None:
+        command += ['--secondary-url', secondary.url]
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    try:
+        completed = subprocess.run(command, cwd=PACKAGE_DIR, capture_output=True, text=True)
+    finally:
+        for mock in (server, secondary):
+            if mock is not None:
+                mock.stop()
+    if completed.returncode != 0:
+        raise RuntimeError(f'场景{scenario}执行失败:\n{completed.stderr}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['files_per_sec'] = round(result['files'] / result['elapsed'], 1) if result['elapsed'] else None
+    result['elapsed'] = round(result['elapsed'], 3)
+    if server is not None:
+        stats = server.get_stats()
+        if secondary is not None:
+            # 两个服务合计请求量，延迟分位数只反映主服务商
+            extra = secondary.get_stats()
+            stats.update({key: stats[key] + extra[key]
+                          for key in ('requests', 'throttled', 'prompt_tokens', 'completion_tokens')})
+        result.update({
+            'requests': stats['requests'],
+            'throttled': stats['throttled'],
+            'prompt_tokens': stats['prompt_tokens'],
+            'completion_tokens': stats['completion_tokens'],
+            'latency_p50': stats['latency_p50'],
+            'latency_p99': stats['latency_p99'],
+        })
+    return result
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """对比两次运行中相同场景的指标，返回超过阈值的退化描述"""
+    regressions = []
+    for scenario, metrics in current['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        for metric, direction in METRIC_DIRECTIONS.items():
+            new, old = metrics.get(metric), previous.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if change * direction < -threshold:
+                regressions.append(f'{scenario}.{metric}: {old} -> {new} ({change:+.0%})')
+    return regressions
+
+
+def latest_result(exclude: Optional[str] = None) -> Optional[str]:
+    """结果目录中最近一次运行的文件"""
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    names = sorted(name for name in os.listdir(RESULTS_DIR) if name.endswith('.json'))
+    paths = [os.path.join(RESULTS_DIR, name) for name in names]
+    paths = [path for path in paths if path != exclude]
+    return paths[-1] if paths else None
+
+
+def print_table(result: Dict[str, Any]):
+    columns = ['files', 'elapsed', 'files_per_sec', 'requests', 'throttled', 'tokens_used',
+               'latency_p50', 'latency_p99', 'peak_rss_mb']
+    print(f"{'scenario':<18}" + ''.join(f'{c:>14}' for c in columns))
+    for scenario, metrics in result['scenarios'].items():
+        cells = ['-' if metrics.get(c) is None else str(metrics[c]) for c in columns]
+        print(f'{scenario:<18}' + ''.join(f'{cell:>14}' for cell in cells))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='对CoreEngine.run_audit运行基准测试，结果保存后可与历史运行对比')
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='要运行的场景，可重复指定，默认运行全部场景')
+    parser.add_argument('--repo', help='使用已有的代码目录，不指定时生成合成仓库')
+    parser.add_argument('--files', type=int, default=2000, help='合成仓库的文件数')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='语言占比，如php=0.5,py=0.3,js=0.2')
+    parser.add_argument('--webshell-ratio', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='AI请求并发数')
+    parser.add_argument('-j', '--workers', type=int, help='静态审计进程数')
+    parser.add_argument('-o', '--output', help='结果文件，默认写入benchmarks/results/<时间>.json')
+    parser.add_argument('--baseline', help='对比的基线结果文件，默认与上一次运行对比')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定为退化的相对变化（默认10%%）')
+    parser.add_argument('--fail-on-regression', action='store_true', help='出现退化时以退出码1结束')
+    # 内部参数：在子进程中执行单个场景
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--secondary-url', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.child:
+        result = run_child(args.child, args.repo, args.url, args.workers, args.concurrency, args.secondary_url)
+        print(json.dumps(result))
+        return 0
+
+    scenarios = args.scenario or list(SCENARIOS)
+    with tempfile.TemporaryDirectory(prefix='audit-bench-') as tmp:
+        repo = args.repo
+        params = {'concurrency': args.concurrency, 'workers': args.workers}
+        if repo is None:
+            repo = os.path.join(tmp, 'repo')
+            info = generate_repo(repo, args.files, args.mix, args.webshell_ratio, seed=args.seed)
+            params.update({'files': info['files'], 'bytes': info['bytes'], 'mix': args.mix,
+                           'webshells': len(info['webshells']), 'seed': args.seed})
+        else:
+            params['repo'] = os.path.abspath(repo)
+        result = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': params,
+            'scenarios': {}
+        }
+        for scenario in scenarios:
+            print(f'Running {scenario}...', file=sys.stderr)
+            result['scenarios'][scenario] = run_scenario(scenario, repo, args)
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print_table(result)
+    print(f'Results saved to {output}')
+
+    baseline_path = args.baseline or latest_result(exclude=os.path.abspath(output))
+    if not baseline_path:
+        return 0
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('params') != result['params']:
+        print(f'Warning: parameters differ from baseline {baseline_path}', file=sys.stderr)
+    regressions = compare(result, baseline, args.threshold)
+    if regressions:
+        print(f'Regressions against {baseline_path}:')
+        for line in regressions:
+            print('  ' + line)
+        return 1 if args.fail_on_regression else 0
+    print(f'No regressions against {baseline_path} (threshold {args.threshold:.0%})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import random
+from typing import Dict, Any, Optional
+
+# 各语言的扩展名和普通代码模板，{n}为序号
+LANGUAGES = {
+    'php': ('.php', [
+        '<?php',
+        'function handler_{n}($request) {{',
+        '    $value = isset($request["id_{n}"]) ? intval($request["id_{n}"]) : 0;',
+        '    $rows = array_map(function ($x) {{ return $x * {n}; }}, range(0, $value));',
+        '    return json_encode(["total" => array_sum($rows), "name" => "item_{n}"]);',
+        '}}',
+    ]),
+    'py': ('.py', [
+        'def handler_{n}(request):',
+        '    value = int(request.get("id_{n}", 0))',
+        '    rows = [x * {n} for x in range(value)]',
+        '    return {{"total": sum(rows), "name": "item_{n}"}}',
+        '',
+    ]),
+    'js': ('.js', [
+        'function handler_{n}(request) {{',
+        '  const value = parseInt(request.query.id_{n} || "0", 10);',
+        '  const rows = Array.from({{ length: value }}, (_, x) => x * {n});',
+        '  return {{ total: rows.reduce((a, b) => a + b, 0), name: "item_{n}" }};',
+        '}}',
+    ]),
+    'java': ('.java', [
+        '    public int handler{n}(java.util.Map<String, String> request) {{',
+        '        int value = Integer.parseInt(request.getOrDefault("id_{n}", "0"));',
+        '        int total = 0;',
+        '        for (int x = 0; x < value; x++) {{ total += x * {n}; }}',
+        '        return total;',
+        '    }}',
+    ]),
+}
+
+# 按语言植入的webshell样本，每条都应被rules.json中的规则命中
+WEBSHELLS = {
+    'php': ['<?php @eval($_POST["cmd"]); ?>',
+            '<?php $f = "assert"; eval(base64_decode($_REQUEST["z"])); ?>',
+            '<?php system($_GET["c"]); ?>'],
+    'py': ['import os\nos.system(request.args.get("cmd"))',
+           'import pickle\ndata = pickle.loads(request.data)'],
+    'js': ['const out = eval(req.query.code);'],
+    'java': ['Process p = Runtime.getRuntime().exec(request.getParameter("cmd"));'],
+}
+
+DEFAULT_MIX = {'php': 0.4, 'py': 0.3, 'js': 0.2, 'java': 0.1}
+
+
+def generate_repo(root: str, files: int = 1000, mix: Optional[Dict[str, float]] = None,
+                  webshell_ratio: float = 0.01, min_lines: int = 20, max_lines: int = 400,
+                  files_per_dir: int = 50, seed: int = 0) -> Dict[str, Any]:
+    """
+    生成合成代码仓库
+    Args:
+        root: 输出目录
+        files: 文件数
+        mix: 各语言文件占比，如{'php': 0.5, 'py': 0.5}
+        webshell_ratio: 植入webshell样本的文件比例
+        min_lines: 单个文件的最少行数
+        max_lines: 单个文件的最多行数
+        files_per_dir: 每个子目录的文件数
+        seed: 随机种子，相同参数和种子生成完全相同的仓库
+    Returns:
+        仓库描述，包含files、bytes、languages和webshells（植入样本的相对路径列表）
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    languages = [lang for lang in mix if lang in LANGUAGES]
+    if not languages:
+        raise ValueError(f'不支持的语言组合: {mix}')
+    weights = [mix[lang] for lang in languages]
+    info = {'files': 0, 'bytes': 0, 'languages': {}, 'webshells': [], 'seed': seed}
+
+    for i in range(files):
+        lang = rng.choices(languages, weights)[0]
+        ext, template = LANGUAGES[lang]
+        rel_path = f'module_{i // files_per_dir:04d}/{lang}_{i:06d}{ext}'
+        target = rng.randint(min_lines, max_lines)
+        lines = []
+        n = 0
+        while len(lines) < target:
+            lines.extend(line.format(n=n) for line in template)
+            n += 1
+        lines = lines[:target]
+        if lang == 'java':
+            lines = [f'public class Handler{i} {{'] + lines + ['}']
+        if rng.random() < webshell_ratio:
+            sample = rng.choice(WEBSHELLS[lang])
+            lines.insert(rng.randint(1, len(lines)), sample)
+            info['webshells'].append(rel_path)
+
+        content = '\n'.join(lines) + '\n'
+        abs_path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        with open(abs_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        info['files'] += 1
+        info['bytes'] += len(content.encode('utf-8'))
+        info['languages'][lang] = info['languages'].get(lang, 0) + 1
+    return info
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """解析php=0.5,py=0.5形式的语言占比"""
+    mix = {}
+    for part in text.split(','):
+        lang, _, weight = part.partition('=')
+        mix[lang.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成用于基准测试的合成代码仓库')
+    parser.add_argument('root', help='输出目录')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='语言占比，如php=0.5,py=0.3,js=0.2')
+    parser.add_argument('--webshell-ratio', type=float, default=0.01)
+    parser.add_argument('--min-lines', type=int, default=20)
+    parser.add_argument('--max-lines', type=int, default=400)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    info = generate_repo(args.root, args.files, args.mix, args.webshell_ratio, args.min_lines, args.max_lines,
+                         seed=args.seed)
+    print(json.dumps({k: v for k, v in info.items() if k != 'webshells'}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+import bisect
+import heapq
+import itertools
+import logging
+import posixpath
+import re
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from web_crawler import read_text, load_content
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：ASCII字符约4个一个token，其他字符按一个token计"""
+    ascii_chars = len(text.encode('ascii', errors='ignore'))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+# 函数/类定义的起始行，作为大文件的优先切分点
+BOUNDARY_PATTERN = re.compile(
+    r'^\s{0,8}(?:'
+    r'(?:async\s+)?def\s|class\s|'                                              # Python
+    r'(?:export\s+)?(?:default\s+)?(?:async\s+)?function\b|'                      # JavaScript/PHP
+    r'(?:(?:public|private|protected|static|final|abstract|internal)\s+)+[\w<>\[\],\s]*[\w>]\s*\(|'  # Java/C#/PHP方法
+    r'(?:public|private|protected|abstract|final)?\s*(?:class|interface|trait|enum|struct)\s|'
+    r'func\s|fn\s|pub\s+fn\s|impl\b|sub\s|module\s'                             # Go/Rust/Perl/Ruby
+    r')'
+)
+
+# 每个文件片段前的标题行
+SEGMENT_HEADER = '### 文件: {path} (第{start}-{end}行)'
+
+
+def split_lines(content: str) -> List[str]:
+    """
+    只按换行符切分行并去掉行尾的回车符，与规则引擎和污点分析的行号一致
+    （str.splitlines还会在换页符、垂直制表符和Unicode行分隔符处断行）
+    """
+    lines = content.split('\n')
+    # 与splitlines相同，末尾的换行符不产生空行
+    if lines[-1] == '':
+        lines.pop()
+    return [line[:-1] if line.endswith('\r') else line for line in lines]
+
+
+def locate(chunk: Dict[str, Any], chunk_line: int) -> Optional[Tuple[str, int]]:
+    """
+    将代码块中的行号映射回源文件
+    Args:
+        chunk: CodeChunker产出的代码块
+        chunk_line: 代码块内容中的行号（从1开始）
+    Returns:
+        (文件路径, 源文件行号)，行号落在标题行或块外时返回None
+    """
+    for segment in chunk['segments']:
+        offset = chunk_line - segment['chunk_start_line']
+        if 0 <= offset <= segment['end_line'] - segment['start_line']:
+            return segment['path'], segment['start_line'] + offset
+    return None
+
+
+class CodeChunker:
+    """
+    位于爬虫和AI模型之间的分块阶段：大文件按函数/类边界切分，小文件装箱合并，
+    使每个请求尽量填满服务商的token预算
+    """
+
+    def __init__(self, token_budget: int = 6000, overlap_lines: int = 5, min_fill: float = 0.5):
+        """
+        Args:
+            token_budget: 单个代码块的token上限
+            overlap_lines: 在非函数边界处硬切时与上一片段重叠的行数
+            min_fill: 按函数边界切分时片段至少达到预算的比例，否则直接硬切
+        """
+        self.logger = logging.getLogger(__name__)
+        self.token_budget = max(256, token_budget)
+        self.overlap_lines = overlap_lines
+        self.min_fill = min_fill
+
+    def chunk_files(self, records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        将文件记录切分、装箱为代码块
+        Args:
+            records: 爬虫产出的文件记录
+        Returns:
+            代码块列表，每个代码块包含chunk_id、content、tokens和segments（文件/行号映射）
+        """
+        pieces = []
+        for record in records:
+            pieces.extend(self.split_file(record['path'], record['content'], record.get('ranges')))
+        chunks = self._pack(pieces)
+        self.logger.info(f'Packed {len(pieces)} segments into {len(chunks)} chunks '
+                         f'(budget {self.token_budget} tokens)')
+        return chunks
+
+    def split_file(self, path: str, content: str,
+                   ranges: Optional[List[Tuple[int, int]]] = None) -> List[Dict[str, Any]]:
+        """
+        将单个文件切分为不超过预算的片段
+        Args:
+            path: 文件路径
+            content: 文件内容
+            ranges: 只切分这些行区间（1起，含两端），None表示整个文件
+        """
+        lines = split_lines(content)
+        if not lines:
+            return []
+        line_tokens = [estimate_tokens(line) + 1 for line in lines]
+        header_tokens = estimate_tokens(SEGMENT_HEADER.format(path=path, start=len(lines), end=len(lines))) + 1
+        pieces = []
+        for first, last in ranges or [(1, len(lines))]:
+            first, last = max(1, first), min(len(lines), last)
+            if first <= last:
+                pieces.extend(self._split_range(path, lines, line_tokens, first - 1, last, header_tokens))
+        return pieces
+
+    def _split_range(self, path: str, lines: List[str], line_tokens: List[int], start: int, stop: int,
+                     header_tokens: int) -> List[Dict[str, Any]]:
+        """切分lines[start:stop]"""
+        budget = self.token_budget - header_tokens
+        if sum(line_tokens[start:stop]) <= budget:
+            return [self._piece(path, lines, start, stop, header_tokens + sum(line_tokens[start:stop]))]
+
+        pieces = []
+        while start < stop:
+            # 单行超出预算（如压缩后的JS）时按字符硬切
+            if line_tokens[start] > budget:
+                pieces.extend(self._split_long_line(path, lines[start], start, budget, header_tokens))
+                start += 1
+                continue
+            end = start
+            used = 0
+            last_boundary = None
+            while end < stop and used + line_tokens[end] <= budget:
+                if end > start and BOUNDARY_PATTERN.match(lines[end]):
+                    last_boundary = end
+                used += line_tokens[end]
+                end += 1
+            if end < stop and last_boundary is not None \
+                    and sum(line_tokens[start:last_boundary]) >= budget * self.min_fill:
+                end = last_boundary
+                next_start = end
+            elif end < stop:
+                # 没有合适的函数边界，硬切并保留少量重叠行以免丢失上下文；
+                # 重叠行连同第end行超出预算时（如下一行是超长行）减少重叠，保证下一个片段越过本片段的末尾
+                next_start = max(start + 1, end - self.overlap_lines)
+                while next_start < end and sum(line_tokens[next_start:end + 1]) > budget:
+                    next_start += 1
+            else:
+                next_start = end
+            pieces.append(self._piece(path, lines, start, end, header_tokens + sum(line_tokens[start:end])))
+            start = next_start
+        return pieces
+
+    def _split_long_line(self, path: str, line: str, index: int, budget: int,
+                         header_tokens: int) -> List[Dict[str, Any]]:
+        pieces = []
+        # 按最坏情况每个字符一个token切分
+        for offset in range(0, len(line), budget):
+            text = line[offset:offset + budget]
+            pieces.append({
+                'path': path,
+                'start_line': index + 1,
+                'end_line': index + 1,
+                'lines': [text],
+                'columns': (offset, offset + len(text)),
+                'tokens': header_tokens + estimate_tokens(text)
+            })
+        return pieces
+
+    @staticmethod
+    def _piece(path: str, lines: List[str], start: int, end: int, tokens: int) -> Dict[str, Any]:
+        return {
+            'path': path,
+            'start_line': start + 1,
+            'end_line': end,
+            'lines': lines[start:end],
+            'tokens': tokens
+        }
+
+    def _pack(self, pieces: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按best-fit decreasing将片段装入代码块"""
+        bins = []
+        # 按剩余容量排序的(剩余容量, 代码块序号)，用二分查找最合适的代码块
+        free = []
+        for piece in sorted(pieces, key=lambda p: p['tokens'], reverse=True):
+            i = bisect.bisect_left(free, (piece['tokens'], -1))
+            if i < len(free):
+                remaining, index = free.pop(i)
+            else:
+                bins.append([])
+                remaining, index = self.token_budget, len(bins) - 1
+            bins[index].append(piece)
+            remaining -= piece['tokens']
+            if remaining > 0:
+                bisect.insort(free, (remaining, index))
+        return [self._build_chunk(n, members) for n, members in enumerate(bins)]
+
+    @staticmethod
+    def _build_chunk(n: int, members: List[Dict[str, Any]]) -> Dict[str, Any]:
+        members.sort(key=lambda p: (p['path'], p['start_line']))
+        parts = []
+        segments = []
+        line_no = 1
+        for piece in members:
+            parts.append(SEGMENT_HEADER.format(path=piece['path'], start=piece['start_line'], end=piece['end_line']))
+            segments.append({
+                'path': piece['path'],
+                'start_line': piece['start_line'],
+                'end_line': piece['end_line'],
+                'chunk_start_line': line_no + 1
+            })
+            parts.extend(piece['lines'])
+            line_no += 1 + len(piece['lines'])
+        return {
+            'chunk_id': f'chunk-{n:05d}',
+            'content': '\n'.join(parts),
+            'tokens': sum(p['tokens'] for p in members),
+            'segments': segments
+        }
+
+
+class PriorityChunkQueue:
+    """
+    线程安全的优先级装箱队列：上游放入文件时即在所在目录内首次适配装箱，装满的代码块按风险分数入队，
+    AI阶段每次取出风险最高的代码块。装箱与AI阶段取块的时机和各目录的爬取先后无关，
+    相同的代码重新审计时得到相同的代码块，可以命中响应缓存
+    """
+
+    def __init__(self, chunker: CodeChunker, hold_until_closed: bool = False, max_open_bins: int = 1024,
+                 lazy: bool = False):
+        """
+        Args:
+            chunker: 用于切分文件的分块器，同时提供token预算
+            hold_until_closed: 为True时等上游全部放入后再出队，保证全局按风险排序（有AI预算时使用）
+            max_open_bins: 未装满的代码块数上限，超出时把最早打开的几个合并入队，限制内存占用
+            lazy: 为True时队列中的片段只保存行号范围，出队组装代码块时再从磁盘读取内容
+        """
+        self.chunker = chunker
+        self.hold_until_closed = hold_until_closed
+        self.max_open_bins = max(1, max_open_bins)
+        self.lazy = lazy
+        self.heap = []
+        # 目录 -> 未装满的代码块列表，每项为[剩余token数, 片段列表]，目录按打开的先后排列
+        self.bins = {}
+        self.open_bins = 0
+        self.tokens = 0
+        self.closed = False
+        self.counter = itertools.count()
+        self.chunk_ids = itertools.count()
+        self.condition = threading.Condition()
+
+    def put_file(self, record: Dict[str, Any], priority: float) -> int:
+        """切分文件并装入所在目录的代码块，返回片段数"""
+        pieces = self.chunker.split_file(record['path'], load_content(record), record.get('ranges'))
+        budget = self.chunker.token_budget
+        directory = posixpath.dirname(record['path'].replace('\\', '/'))
+        with self.condition:
+            for piece in pieces:
+                piece['priority'] = priority
+                # 自带内容的记录（如git历史版本）不能再从磁盘读取
+                if self.lazy and record.get('content') is None:
+                    piece['abs_path'] = record['abs_path']
+                    piece['lines'] = None
+                self.tokens += piece['tokens']
+                bins = self.bins.setdefault(directory, [])
+                target = next((b for b in bins if b[0] >= piece['tokens']), None)
+                if target is None:
+                    # 放不下新片段且已装到八分之七的代码块不再等待凑满，尽早交给AI阶段
+                    for full in [candidate for candidate in bins if candidate[0] * 8 <= budget]:
+                        bins.remove(full)
+                        self.open_bins -= 1
+                        self._push(full[1])
+                    target = [budget, []]
+                    bins.append(target)
+                    self.open_bins += 1
+                target[0] -= piece['tokens']
+                target[1].append(piece)
+                # 剩余容量已放不下常见的小文件时视为装满
+                if target[0] < budget // 16:
+                    bins.remove(target)
+                    self.open_bins -= 1
+                    self._push(target[1])
+                    if not bins:
+                        del self.bins[directory]
+                if self.open_bins > self.max_open_bins:
+                    self._merge(next(iter(self.bins)))
+            self.condition.notify_all()
+        return len(pieces)
+
+    def _merge(self, *directories: str):
+        """把这些目录中未装满的代码块按目录顺序合并装箱后入队，调用方持有condition"""
+        budget = self.chunker.token_budget
+        members, remaining = [], budget
+        for directory in directories:
+            for left, pieces in self.bins.pop(directory):
+                self.open_bins -= 1
+                if members and budget - left > remaining:
+                    self._push(members)
+                    members, remaining = [], budget
+                members.extend(pieces)
+                remaining -= budget - left
+        if members:
+            self._push(members)
+
+    def _push(self, members: List[Dict[str, Any]]):
+        """代码块按其中最高的风险分数入队，调用方持有condition"""
+        priority = max(p['priority'] for p in members)
+        heapq.heappush(self.heap, (-priority, next(self.counter), members))
+
+    def close(self):
+        """上游结束，各目录未装满的代码块按目录名排序合并后入队"""
+        with self.condition:
+            self._merge(*sorted(self.bins))
+            self.closed = True
+            self.condition.notify_all()
+
+    def get_chunk(self) -> Optional[Dict[str, Any]]:
+        """阻塞取出下一个代码块，队列关闭且为空时返回None"""
+        with self.condition:
+            while not self.closed and (self.hold_until_closed or not self.heap):
+                self.condition.wait()
+            if not self.heap:
+                return None
+            priority, _, members = heapq.heappop(self.heap)
+            self.tokens -= sum(p['tokens'] for p in members)
+            n = next(self.chunk_ids)
+        if self.lazy:
+            self._load_lines(members)
+        chunk = CodeChunker._build_chunk(n, members)
+        chunk['priority'] = -priority
+        return chunk
+
+    @staticmethod
+    def _load_lines(members: List[Dict[str, Any]]):
+        """为惰性片段重新读取内容，同一文件的多个片段只读取一次"""
+        files = {}
+        for piece in members:
+            if piece['lines'] is not None:
+                continue
+            lines = files.get(piece['abs_path'])
+            if lines is None:
+                lines = files[piece['abs_path']] = split_lines(read_text(piece['abs_path']))
+            piece['lines'] = lines[piece['start_line'] - 1:piece['end_line']]
+            if 'columns' in piece and piece['lines']:
+                start, end = piece['columns']
+                piece['lines'] = [piece['lines'][0][start:end]]
@@ -0,0 +1,311 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Dict, Any, Optional
+
+# 只导入静态审计需要的模块，AI服务商相关模块（及requests）在指定--model时才由CoreEngine延迟导入
+from core_engine import CoreEngine, AuditInterrupted
+from code_audit import CodeAudit
+from manifest import AuditManifest, DEFAULT_MANIFEST_PATH
+from tracing import Tracer
+from spill import DEFAULT_MAX_IN_MEMORY
+from similarity import SimilarityIndex, DEFAULT_INDEX_PATH
+from git_diff import GitDiffSource, parse_revisions, DEFAULT_CONTEXT_LINES, DEFAULT_MAX_SCOPE_LINES
+
+MODELS = ['chatgpt', 'deepseek', 'kimi', 'ollama', 'auto']
+SEVERITY_ORDER = {'low': 1, 'medium': 2, 'high': 3}
+SARIF_LEVELS = {'high': 'error', 'medium': 'warning', 'low': 'note'}
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+# 可用cProfile剖析的阶段，每个阶段在各自的线程中执行
+PROFILE_STAGES = ['crawl', 'static', 'ai', 'analysis']
+
+
+class JsonLinesWriter:
+    """每个发现输出为一行JSON，产生后立即写出"""
+
+    def __init__(self, stream, root: str):
+        self.stream = stream
+        self.root = root
+        self.lock = threading.Lock()
+
+    def write_finding(self, path: str, finding: Dict[str, Any]):
+        self._write({'type': 'finding', 'path': path, **finding})
+
+    def write_analysis(self, path: str, chunk: Dict[str, Any]):
+        self._write({'type': 'ai_analysis', 'path': path, **chunk})
+
+    def close(self, summary: Dict[str, Any]):
+        self._write({'type': 'summary', 'root': self.root, **summary})
+
+    def _write(self, record: Dict[str, Any]):
+        with self.lock:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.stream.flush()
+
+
+class SarifWriter:
+    """
+    流式输出SARIF 2.1.0：先写出results数组并逐条追加结果，
+    审计结束后再补全tool.driver.rules等只有结束时才能确定的字段
+    """
+
+    def __init__(self, stream, root: str):
+        self.stream = stream
+        self.root = root
+        self.lock = threading.Lock()
+        self.rules = {}
+        self.count = 0
+        self.stream.write(f'{{"$schema": "{SARIF_SCHEMA}", "version": "2.1.0", "runs": [{{"results": [\n')
+        self.stream.flush()
+
+    def write_finding(self, path: str, finding: Dict[str, Any]):
+        rule_id = finding['rule_id']
+        with self.lock:
+            self.rules.setdefault(rule_id, {
+                'id': rule_id,
+                'name': finding.get('name', rule_id),
+                'shortDescription': {'text': finding.get('name', rule_id)},
+                'defaultConfiguration': {'level': SARIF_LEVELS.get(finding.get('severity'), 'warning')}
+            })
+        self._write({
+            'ruleId': rule_id,
+            'level': SARIF_LEVELS.get(finding.get('severity'), 'warning'),
+            'message': {'text': finding.get('description') or finding.get('name', rule_id)},
+            'locations': [self._location(path, finding['line'])],
+            'properties': {'match': finding.get('match', '')}
+        })
+
+    def write_analysis(self, path: str, chunk: Dict[str, Any]):
+        if 'analysis' not in chunk:
+            return
+        with self.lock:
+            self.rules.setdefault('ai-analysis', {
+                'id': 'ai-analysis',
+                'name': 'AI分析',
+                'shortDescription': {'text': 'AI模型的代码审计意见'},
+                'defaultConfiguration': {'level': 'note'}
+            })
+        self._write({
+            'ruleId': 'ai-analysis',
+            'level': 'note',
+            'message': {'text': chunk['analysis']},
+            'locations': [self._location(path, chunk['start_line'], chunk['end_line'])],
+            'properties': {'chunk_id': chunk['chunk_id']}
+        })
+
+    def close(self, summary: Dict[str, Any]):
+        with self.lock:
+            tail = {
+                'tool': {'driver': {'name': 'ai代码审计工具', 'rules': list(self.rules.values())}},
+                'originalUriBaseIds': {'SRCROOT': {'uri': 'file://' + self.root.replace(os.sep, '/') + '/'}},
+                'properties': summary
+            }
+            # 去掉外层花括号，把剩余字段接在results之后
+            self.stream.write('\n], ' + json.dumps(tail, ensure_ascii=False)[1:-1] + '}]}\n')
+            self.stream.flush()
+
+    @staticmethod
+    def _location(path: str, start_line: int, end_line: Optional[int] = None) -> Dict[str, Any]:
+        region = {'startLine': max(1, start_line)}
+        if end_line:
+            region['endLine'] = max(region['startLine'], end_line)
+        return {'physicalLocation': {
+            'artifactLocation': {'uri': path.replace(os.sep, '/'), 'uriBaseId': 'SRCROOT'},
+            'region': region
+        }}
+
+    def _write(self, result: Dict[str, Any]):
+        with self.lock:
+            prefix = ',\n' if self.count else ''
+            self.stream.write(prefix + json.dumps(result, ensure_ascii=False))
+            self.stream.flush()
+            self.count += 1
+
+
+WRITERS = {'jsonl': JsonLinesWriter, 'sarif': SarifWriter}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='AI代码审计工具命令行版本，结果以JSON Lines或SARIF格式流式输出')
+    parser.add_argument('path', help='需要审计的代码目录')
+    parser.add_argument('-m', '--model', choices=MODELS,
+                        help='使用的AI服务商，auto表示按config.json的auto字段在多个服务商间对冲和故障转移，'
+                             '不指定时只做静态审计')
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS), default='jsonl', help='输出格式（默认jsonl）')
+    parser.add_argument('-o', '--output', help='输出文件，默认写到标准输出')
+    parser.add_argument('--report', help='审计结束后写出去重、合并并按风险排序的完整报告（JSON）')
+    parser.add_argument('-c', '--concurrency', type=int, help='AI请求并发数，覆盖配置文件中的max_concurrency')
+    parser.add_argument('-j', '--workers', type=int, help='静态审计进程数，默认等于CPU核数')
+    parser.add_argument('--cache', help='AI响应缓存文件路径')
+    parser.add_argument('--no-cache', action='store_true', help='不使用磁盘上的AI响应缓存')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_PATH, help='增量审计清单文件路径')
+    parser.add_argument('--no-manifest', action='store_true', help='不复用也不保存增量审计结果')
+    parser.add_argument('--similarity-index', default=DEFAULT_INDEX_PATH, help='近似重复代码索引文件路径')
+    parser.add_argument('--similarity-threshold', type=float, default=0.9,
+                        help='判定为近似重复的最低相似度（默认0.9），近似重复的文件沿用代表文件的AI结果')
+    parser.add_argument('--no-dedup', action='store_true', help='不做近似重复去重，每个文件都单独送入AI')
+    parser.add_argument('--max-requests', type=int, help='本次最多发起的AI请求数')
+    parser.add_argument('--max-tokens', type=int, help='本次最多送入AI的token数')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='低内存模式：按需读取文件内容，静态审计结果超过上限后溢出到磁盘，适合超大代码库')
+    parser.add_argument('--max-findings-in-memory', type=int, default=DEFAULT_MAX_IN_MEMORY,
+                        help=f'低内存模式下内存中最多保留的发现条数（默认{DEFAULT_MAX_IN_MEMORY}）')
+    parser.add_argument('--diff', metavar='RANGE',
+                        help='只审计git版本之间的改动：BASE（与工作区比较）、BASE..HEAD或BASE...HEAD（从共同祖先开始，'
+                             '与PR的改动一致），改动扩展到所在的函数/类，路径为仓库中的子目录时只审计其中的改动')
+    parser.add_argument('--diff-context', type=int, default=DEFAULT_CONTEXT_LINES,
+                        help=f'改动不在函数/类中时保留的上下文行数（默认{DEFAULT_CONTEXT_LINES}）')
+    parser.add_argument('--diff-max-scope', type=int, default=DEFAULT_MAX_SCOPE_LINES,
+                        help=f'函数/类超过该行数时只审计改动及其上下文（默认{DEFAULT_MAX_SCOPE_LINES}）')
+    parser.add_argument('--min-risk', type=float, default=0.0, help='风险分数低于该值的文件不送入AI分析')
+    parser.add_argument('--fail-on', choices=['low', 'medium', 'high'],
+                        help='存在该严重程度及以上的发现时以退出码1结束')
+    parser.add_argument('--progress', action='store_true', help='在标准错误输出中显示进度')
+    parser.add_argument('--trace', help='把各阶段的耗时、请求和token统计写入Chrome Trace格式的JSON文件')
+    parser.add_argument('--profile', choices=PROFILE_STAGES,
+                        help='用cProfile剖析单个阶段（只剖析该阶段所在线程，剖析static时建议同时指定-j 1）')
+    parser.add_argument('--profile-output', help='剖析结果文件（pstats格式），默认为<阶段>.prof')
+    parser.add_argument('-v', '--verbose', action='store_true', help='在标准错误输出中打印运行日志')
+    return parser
+
+
+def build_engine(args) -> CoreEngine:
+    ai_models = None
+    if args.model:
+        from ai_models import AIModels
+        from response_cache import ResponseCache
+        if args.no_cache:
+            ai_models = AIModels(cache=ResponseCache(None))
+        elif args.cache:
+            ai_models = AIModels(cache=ResponseCache(args.cache))
+        else:
+            ai_models = AIModels()
+        if args.concurrency:
+            # 只修改本次运行的配置，不写回config.json
+            ai_models.config.setdefault(args.model, {}).setdefault('limits', {})
+            ai_models.config[args.model]['limits']['max_concurrency'] = args.concurrency
+    manifest = AuditManifest(':memory:' if args.no_manifest else args.manifest)
+    similarity_index = None
+    if args.model and not args.no_dedup:
+        similarity_index = SimilarityIndex(args.similarity_index, args.similarity_threshold)
+    tracer = None
+    if args.trace or args.profile:
+        tracer = Tracer(profile_stage=args.profile,
+                        profile_path=args.profile_output or (args.profile and f'{args.profile}.prof'))
+    return CoreEngine(ai_models=ai_models, code_audit=CodeAudit(workers=args.workers), manifest=manifest,
+                      tracer=tracer, low_memory=args.low_memory, max_findings_in_memory=args.max_findings_in_memory,
+                      similarity_index=similarity_index, dedup=not args.no_dedup)
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not os.path.isdir(args.path):
+        print(f'代码路径不存在: {args.path}', file=sys.stderr)
+        return 2
+
+    root = os.path.abspath(args.path)
+    stream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    started = time.monotonic()
+    counts = {'files': 0, 'findings': 0, 'ai_chunks': 0, 'ai_errors': 0}
+    worst = 0
+    exit_code = 0
+    engine = None
+    cancel = threading.Event()
+
+    def on_interrupt(signum, frame):
+        # 第一次Ctrl+C取消审计并输出已完成的结果，第二次立即退出
+        if cancel.is_set():
+            raise KeyboardInterrupt
+        cancel.set()
+        print('正在停止审计，再次按Ctrl+C立即退出', file=sys.stderr)
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGINT, on_interrupt)
+    try:
+        engine = build_engine(args)
+        source = None
+        if args.diff:
+            base, head, merge_base = parse_revisions(args.diff)
+            source = GitDiffSource(root, base, head, merge_base, context=args.diff_context,
+                                   max_scope_lines=args.diff_max_scope, web_crawler=engine.web_crawler)
+            # 路径为仓库中的子目录时只审计其中的改动，结果中的路径相对于仓库根目录
+            subdir = os.path.relpath(os.path.realpath(root), os.path.realpath(source.root))
+            if subdir != '.':
+                source.pathspec = subdir
+            root = source.root
+        writer = WRITERS[args.format](stream, root)
+
+        def on_audit(path, result):
+            nonlocal worst
+            counts['files'] += 1
+            for finding in result['findings']:
+                counts['findings'] += 1
+                worst = max(worst, SEVERITY_ORDER.get(finding['severity'], 0))
+                writer.write_finding(path, finding)
+
+        def on_analysis(path, chunk):
+            counts['ai_errors' if 'error' in chunk else 'ai_chunks'] += 1
+            writer.write_analysis(path, chunk)
+
+        try:
+            report = engine.run_audit(root, args.model, max_requests=args.max_requests,
+                                      max_tokens=args.max_tokens, min_risk=args.min_risk,
+                                      on_audit=on_audit, on_analysis=on_analysis,
+                                      on_progress=print_progress if args.progress else None, cancel_event=cancel,
+                                      source=source)
+        except AuditInterrupted as e:
+            # 取消或失败时仍然输出已完成部分的结果
+            if not e.cancelled:
+                logging.getLogger(__name__).error(str(e))
+            report = e.partial_report
+            exit_code = 130 if e.cancelled else 2
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        if args.trace:
+            engine.tracer.export(args.trace)
+        writer.close({**counts, 'model': args.model, 'elapsed': round(time.monotonic() - started, 3),
+                      'report': report['summary']})
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        logging.getLogger(__name__).error(f'Audit failed: {e}')
+        return 2
+    finally:
+        if engine is not None:
+            if args.model:
+                engine.ai_models.close()
+                if not args.no_dedup:
+                    engine.similarity_index.close()
+            engine.code_audit.close()
+            engine.manifest.close()
+        if stream is not sys.stdout:
+            stream.close()
+    if exit_code:
+        return exit_code
+    if args.fail_on and worst >= SEVERITY_ORDER[args.fail_on]:
+        return 1
+    return 0
+
+
+def print_progress(event: Dict[str, Any]):
+    text = f"扫描 {event['files_scanned']} | 审计 {event['files_audited']}"
+    if event.get('chunks_sent'):
+        text += f" | AI {event['chunks_done']}/{event['chunks_sent']} | tokens {event['tokens_used']}"
+    if event.get('percent') is not None:
+        text += f" | {event['percent']:.0%}"
+    if event.get('eta') is not None:
+        text += f" | 剩余 {event['eta']:.0f}s"
+    end = '\r' if sys.stderr.isatty() and event['stage'] not in ('done', 'cancelled', 'failed') else '\n'
+    print(text.ljust(72), end=end, file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,166 @@
 import logging
-from typing import Dict, Any
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from rule_engine import RuleSet, DEFAULT_RULES_PATH, DEFAULT_RULES_CACHE_PATH
+from obfuscation import ObfuscationAnalyzer
+from taint import TaintAnalyzer, DEFAULT_SUMMARY_CACHE_PATH, TAINT_VERSION
+from tracing import NULL_TRACER
+from web_crawler import read_text, load_content
+
+# 工作进程内的审计实例，由进程池初始化函数创建，规则集在每个进程中只加载一次
+_worker_audit = None
+
+
+def _init_worker(rules_path: str, rules_cache_path: Optional[str], taint_cache_path: Optional[str]):
+    global _worker_audit
+    _worker_audit = CodeAudit(rules_path, rules_cache_path, workers=1, taint_cache_path=taint_cache_path)
+
+
+def _audit_batch(batch):
+    # 附带本批次在工作进程中的起止时间和CPU时间，供父进程的追踪器记录
+    started, cpu_started = time.perf_counter(), time.process_time()
+    # 惰性记录不带内容，在工作进程中读取，父进程不持有文件内容
+    results = [(path, _worker_audit.audit(read_text(abs_path) if content is None else content, path, abs_path))
+               for path, abs_path, content in batch]
+    return results, os.getpid(), started, time.perf_counter() - started, time.process_time() - cpu_started
+
 
 class CodeAudit:
-    def __init__(self):
+    # 由污点分析复核的规则类别：Python文件中这些危险函数的参数只是字面量或不带污点的模块变量时，规则命中标记为taint=clean；
+    # 动态代码执行不在其中，常量参数也可能是解码后的载荷
+    TAINT_CATEGORIES = {'command_exec', 'deserialization', 'sql_injection'}
+    # 每个进程池任务的目标字节数和文件数，按大小均衡分批以免单个任务拖慢整体
+    BATCH_BYTES = 512 * 1024
+    BATCH_FILES = 256
+
+    def __init__(self, rules_path: str = DEFAULT_RULES_PATH, rules_cache_path: Optional[str] = DEFAULT_RULES_CACHE_PATH,
+                 workers: Optional[int] = None, taint_cache_path: Optional[str] = DEFAULT_SUMMARY_CACHE_PATH):
+        """
+        Args:
+            rules_path: 规则文件路径
+            rules_cache_path: 规则编译缓存路径
+            workers: 并行审计的进程数，默认等于CPU核数，1表示在当前进程中审计
+            taint_cache_path: Python污点分析的函数摘要缓存路径，None表示只在内存中缓存
+        """
         self.logger = logging.getLogger(__name__)
+        self.rules_path = rules_path
+        self.rules_cache_path = rules_cache_path
+        self.rule_set = RuleSet.load(rules_path, rules_cache_path)
+        self.obfuscation = ObfuscationAnalyzer()
+        self.taint_cache_path = taint_cache_path
+        # 在首次审计Python文件时创建，进程池的父进程不打开摘要缓存
+        self.taint = None
+        # 审计规则集版本，规则文件、混淆分析可用性或污点分析逻辑变化时随之变化，使审计清单中的旧结果失效
+        self.rules_version = (f'{self.rule_set.rules_version}+obf{int(self.obfuscation.available)}'
+                              f'+taint{TAINT_VERSION}')
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.pool_workers = 0
+        self.tracer = NULL_TRACER
 
-    def audit(self, code_data: str) -> Dict[str, Any]:
+    def audit(self, code_data: str, path: Optional[str] = None, abs_path: Optional[str] = None) -> Dict[str, Any]:
         """
         执行代码审计
         Args:
             code_data: 需要审计的代码数据
+            path: 代码文件路径，用于按语言筛选规则
+            abs_path: 文件在磁盘上的路径，提供时混淆分析直接内存映射文件
         Returns:
-            审计结果字典
+            审计结果字典，findings为命中的规则和混淆检测结果，obfuscation_score为0-1的混淆程度评分
+        """
+        self.logger.debug(f'Auditing {path or "<code>"}...')
+        findings = self.rule_set.scan(code_data, path)
+        if abs_path and os.path.isfile(abs_path):
+            obfuscation = self.obfuscation.analyze_file(abs_path)
+        else:
+            obfuscation = self.obfuscation.analyze_bytes(code_data)
+        findings.extend(obfuscation['findings'])
+        if path and path.endswith(('.py', '.pyw')):
+            findings.extend(self._taint_findings(code_data, path, findings))
+        findings.sort(key=lambda f: f['line'])
+        return {'findings': findings, 'obfuscation_score': obfuscation['score']}
+
+    def _taint_findings(self, code_data: str, path: str, findings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
-        self.logger.info('Starting code audit...')
-        # TODO: 实现语法漏洞和webshell检测逻辑
-        audit_result = {}
-        return audit_result
\ No newline at end of file
+        对Python文件做污点分析
+        Returns:
+            污点发现；参数可确认不来自外部输入的危险函数规则命中就地标记为taint=clean，风险评分时按低危计算
+        """
+        if self.taint is None:
+            self.taint = TaintAnalyzer(self.taint_cache_path)
+        result = self.taint.analyze(code_data, path)
+        clean_lines = set(result['clean_lines'])
+        for finding in findings:
+            if finding.get('category') in self.TAINT_CATEGORIES and finding['line'] in clean_lines:
+                finding['taint'] = 'clean'
+        return result['findings']
+
+    def audit_files(self, records: Iterable[Dict[str, Any]],
+                    workers: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        使用进程池并行审计多个文件，边读取输入边分发，结果按输入顺序产出，
+        下游按放入顺序装箱代码块，顺序固定才能在重新审计时得到相同的代码块
+        Args:
+            records: 文件记录，至少包含path和content，惰性记录需包含abs_path
+            workers: 本次使用的进程数，默认使用构造时的设置
+        Returns:
+            (文件路径, 审计结果)迭代器
+        """
+        workers = workers or self.workers
+        if workers <= 1:
+            for record in records:
+                yield record['path'], self.audit(load_content(record), record['path'], record.get('abs_path'))
+            return
+
+        self.logger.info(f'Starting parallel code audit with {workers} processes...')
+        pool = self._get_pool(workers)
+        in_flight = deque()
+        batch, batch_bytes = [], 0
+        try:
+            for record in records:
+                batch.append((record['path'], record.get('abs_path'), record.get('content')))
+                batch_bytes += record['size'] if 'size' in record else len(record['content'])
+                if batch_bytes < self.BATCH_BYTES and len(batch) < self.BATCH_FILES:
+                    continue
+                in_flight.append(pool.submit(_audit_batch, batch))
+                batch, batch_bytes = [], 0
+                # 输入仍在产生时也及时产出已完成的结果，并限制排队任务数
+                if len(in_flight) >= workers * 2:
+                    yield from self._batch_results(in_flight.popleft().result())
+                while in_flight and in_flight[0].done():
+                    yield from self._batch_results(in_flight.popleft().result())
+            if batch:
+                in_flight.append(pool.submit(_audit_batch, batch))
+            while in_flight:
+                yield from self._batch_results(in_flight.popleft().result())
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _batch_results(self, batch_result) -> List[Tuple[str, Dict[str, Any]]]:
+        """记录工作进程中一个批次的耗时，返回该批次的审计结果"""
+        results, pid, started, wall, cpu = batch_result
+        self.tracer.record('static.batch', 'static', started, wall, cpu, pid=pid, files=len(results))
+        return results
+
+    def _get_pool(self, workers: int) -> ProcessPoolExecutor:
+        """获取进程池，多次审计之间复用已启动的工作进程"""
+        if self.pool is None or self.pool_workers != workers:
+            self.close()
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(self.rules_path, self.rules_cache_path, self.taint_cache_path))
+            self.pool_workers = workers
+        return self.pool
+
+    def close(self):
+        """关闭进程池和污点分析的摘要缓存"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+            self.pool_workers = 0
+        if self.taint is not None:
+            self.taint.close()
+            self.taint = None
\ No newline at end of file
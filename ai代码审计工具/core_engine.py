@@ -1,28 +1,524 @@
 import logging
+import os
+import queue
+import threading
+import time
 from code_audit import CodeAudit
-from ai_models import AIModels
-from web_crawler import WebCrawler
+from web_crawler import WebCrawler, load_content
 from data_analysis import DataAnalysis
+from manifest import AuditManifest
+from chunker import CodeChunker, PriorityChunkQueue
+from tracing import NULL_TRACER, NULL_SPAN
+from spill import SpillDict, DEFAULT_MAX_IN_MEMORY
+from similarity import carry_analysis, make_diff
+from git_diff import filter_audit_result, filter_analysis
+
+class AuditInterrupted(Exception):
+    """审计被取消或中途失败，partial_report为根据已完成部分生成的综合报告"""
+
+    def __init__(self, message, partial_report, cancelled=False):
+        super().__init__(message)
+        self.partial_report = partial_report
+        self.cancelled = cancelled
+
+
+class AuditProgress:
+    """汇总流水线各阶段的进度计数，按固定间隔回调进度事件，剩余时间按已完成部分的速率估算"""
+
+    # 两次进度回调之间的最小间隔（秒）
+    INTERVAL = 0.25
+
+    def __init__(self, callback, with_ai, queued_tokens):
+        """
+        Args:
+            callback: 进度回调，参数为进度事件字典，None表示只计数
+            with_ai: 本次审计是否包含AI阶段
+            queued_tokens: 返回AI队列中尚未发送的token数的函数
+        """
+        self.callback = callback
+        self.with_ai = with_ai
+        self.queued_tokens = queued_tokens
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.ai_started = None
+        self.last_emit = 0.0
+        self.crawl_done = False
+        self.static_done = False
+        self.counters = {'files_scanned': 0, 'files_reused': 0, 'files_audited': 0, 'chunks_sent': 0,
+                         'chunks_done': 0, 'chunks_failed': 0, 'tokens_sent': 0, 'tokens_done': 0,
+                         'tokens_used': 0}
+
+    def add(self, force=False, **deltas):
+        """累加计数，距上次回调超过间隔或force为True时发出进度事件"""
+        with self.lock:
+            for key, delta in deltas.items():
+                self.counters[key] += delta
+            now = time.monotonic()
+            if self.ai_started is None and self.counters['chunks_sent']:
+                self.ai_started = now
+            if self.callback is None or (not force and now - self.last_emit < self.INTERVAL):
+                return
+            self.last_emit = now
+            event = self._snapshot(now)
+        self.callback(event)
+
+    def finish(self, stage):
+        """标记爬取或静态审计阶段结束"""
+        with self.lock:
+            if stage == 'crawl':
+                self.crawl_done = True
+            else:
+                self.static_done = True
+        self.add(force=True)
+
+    def snapshot(self, stage=None):
+        with self.lock:
+            event = self._snapshot(time.monotonic())
+        if stage:
+            event['stage'] = stage
+        return event
+
+    def _snapshot(self, now):
+        c = self.counters
+        elapsed = now - self.started
+        pending_files = c['files_scanned'] - c['files_reused']
+        static_fraction = c['files_audited'] / pending_files if pending_files else 1.0
+        percent = eta = None
+        if self.with_ai:
+            remaining_tokens = self.queued_tokens() + c['tokens_sent'] - c['tokens_done']
+            total_tokens = c['tokens_done'] + remaining_tokens
+            ai_fraction = c['tokens_done'] / total_tokens if total_tokens else float(self.static_done)
+            if self.crawl_done:
+                percent = 0.3 * static_fraction + 0.7 * ai_fraction
+            if self.static_done and c['tokens_done'] and self.ai_started is not None:
+                eta = remaining_tokens / (c['tokens_done'] / max(1e-6, now - self.ai_started))
+        elif self.crawl_done:
+            percent = static_fraction
+            if c['files_audited']:
+                eta = (pending_files - c['files_audited']) / (c['files_audited'] / max(1e-6, elapsed))
+        if c['chunks_sent']:
+            stage = 'ai'
+        elif c['files_audited']:
+            stage = 'static'
+        else:
+            stage = 'crawl'
+        return {**c, 'stage': stage, 'elapsed': round(elapsed, 2),
+                'eta': None if eta is None else round(eta, 1),
+                'percent': None if percent is None else round(min(1.0, percent), 4)}
+
 
 class CoreEngine:
-    def __init__(self):
+    # 爬虫与静态审计之间的队列长度
+    QUEUE_SIZE = 256
+    # 静态审计命中对风险分数的贡献
+    SEVERITY_WEIGHTS = {'high': 1.0, 'medium': 0.5, 'low': 0.2}
+
+    def __init__(self, ai_models=None, code_audit=None, manifest=None, tracer=None, low_memory=False,
+                 max_findings_in_memory=DEFAULT_MAX_IN_MEMORY, similarity_index=None, dedup=True):
+        """
+        Args:
+            ai_models: AI模型模块，None时在首次使用时创建
+            code_audit: 代码审计模块
+            manifest: 增量审计清单
+            tracer: 追踪器（tracing.Tracer），提供时记录各阶段的耗时、读取字节数、请求数和token用量
+            low_memory: 低内存模式，爬虫只产出文件句柄，各阶段按需通过mmap读取内容，
+                        静态审计结果超过max_findings_in_memory条发现后溢出到磁盘
+            max_findings_in_memory: 低内存模式下内存中最多保留的发现条数
+            similarity_index: 近似重复索引（similarity.SimilarityIndex），None时在首次AI分析时打开默认索引
+            dedup: 是否对近似重复的文件只分析一个代表文件，其余沿用其AI结果
+        """
         self.logger = logging.getLogger(__name__)
-        self.code_audit = CodeAudit()
-        self.ai_models = AIModels()
-        self.web_crawler = WebCrawler()
+        self.tracer = tracer or NULL_TRACER
+        self.low_memory = low_memory
+        self.max_findings_in_memory = max_findings_in_memory
+        self.code_audit = code_audit or CodeAudit()
+        self._ai_models = ai_models
+        self.web_crawler = WebCrawler(lazy=low_memory)
         self.data_analysis = DataAnalysis()
+        self.manifest = manifest or AuditManifest()
+        self._similarity_index = similarity_index
+        self.dedup = dedup
+        for component in (self.code_audit, self._ai_models, self.web_crawler, self.data_analysis):
+            if component is not None:
+                component.tracer = self.tracer
+
+    @property
+    def ai_models(self):
+        """AI模型模块及其依赖的requests只在首次使用时导入，只做静态审计时不产生启动开销"""
+        if self._ai_models is None:
+            from ai_models import AIModels
+            self._ai_models = AIModels()
+            self._ai_models.tracer = self.tracer
+        return self._ai_models
 
-    def run_audit(self, code_path):
+    @property
+    def similarity_index(self):
+        """近似重复索引在首次需要时打开"""
+        if self._similarity_index is None:
+            from similarity import SimilarityIndex
+            self._similarity_index = SimilarityIndex()
+        return self._similarity_index
+
+    def run_audit(self, code_path, model='chatgpt', on_token=None, max_requests=None, max_tokens=None,
+                  min_risk=0.0, on_audit=None, on_analysis=None, on_progress=None, cancel_event=None,
+                  source=None):
         """
-        执行代码审计流程
+        执行代码审计流程：爬取、静态审计和AI分析三个阶段通过有界队列流水线并行，
+        静态审计得出的风险分数决定代码块送入AI的先后顺序，未变化的文件直接复用审计清单中的结果
+        Args:
+            code_path: 代码路径
+            model: 使用的AI服务商，None表示只做静态审计
+            on_token: AI流式输出回调，参数为(chunk_id, 文本片段)
+            max_requests: 本次最多发起的AI请求数，None表示不限制
+            max_tokens: 本次最多送入AI的token数，None表示不限制
+            min_risk: 风险分数低于该值的文件不送入AI分析
+            on_audit: 单个文件静态审计完成时的回调，参数为(文件路径, 审计结果)
+            on_analysis: 单个代码块的AI分析返回时的回调，参数为(文件路径, 该文件对应的代码块结果)
+            on_progress: 进度回调，参数为进度事件字典（已扫描/已审计文件数、已发送代码块数、token用量、
+                         预计剩余秒数eta和完成比例percent等）
+            cancel_event: 取消事件（threading.Event），被设置后各阶段尽快停止
+            source: 文件记录来源（如git_diff.GitDiffSource），None时爬取code_path下的全部文件。
+                    记录带有ranges时只审计这些行区间，结果不写入审计清单，也不做近似重复去重
+        Returns:
+            综合报告
+        Raises:
+            AuditInterrupted: 审计被取消或中途失败，异常中带有根据已完成部分生成的报告
         """
         self.logger.info('Starting code audit process...')
-        # 1. 爬取代码
-        code_data = self.web_crawler.crawl(code_path)
-        # 2. 调用AI模型分析
-        analysis_result = self.ai_models.analyze(code_data)
-        # 3. 执行代码审计
-        audit_result = self.code_audit.audit(code_data)
-        # 4. 数据分析
-        final_report = self.data_analysis.analyze(audit_result, analysis_result)
-        return final_report
\ No newline at end of file
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        root = os.path.abspath(code_path)
+        scoped = source is not None
+        rules_version = self.code_audit.rules_version
+        model_version = self.ai_models.get_model_version(model) if model else 'none'
+        audit_result = SpillDict(self.max_findings_in_memory) if self.low_memory else {}
+        analysis_result = {}
+        pending = {}
+        seen = set()
+        # 记录每个文件还有多少个代码块未返回，全部成功后才写入审计清单
+        remaining = {}
+        failed = set()
+        stats = {'chunks': 0, 'tokens': 0, 'budget_skipped': 0, 'low_risk': 0, 'reused': 0, 'near_duplicates': 0}
+        # 近似重复去重：本次审计中正在分析的代表文件id -> 代表文件路径及等待沿用其结果的文件
+        index = self.similarity_index if model and self.dedup and not scoped else None
+        clusters = {}
+        representatives = {}
+        lock = threading.Lock()
+        stop = threading.Event()
+        errors = []
+        records = queue.Queue(maxsize=self.QUEUE_SIZE)
+        finished = object()
+        # 有预算时先收齐全部代码块，保证预算优先花在风险最高的代码上
+        limited = bool(max_requests or max_tokens)
+        token_budget = self.ai_models.get_token_budget(model) if model else 0
+        chunk_queue = PriorityChunkQueue(CodeChunker(token_budget=token_budget), hold_until_closed=limited,
+                                         lazy=self.low_memory)
+        cancel = cancel_event or threading.Event()
+        progress = AuditProgress(on_progress, bool(model), lambda: chunk_queue.tokens)
+        if on_token is not None:
+            stream_callback = on_token
+
+            def on_token(chunk_id, text):
+                # 取消后中断仍在流式接收的请求
+                if cancel.is_set():
+                    raise RuntimeError('审计已取消')
+                stream_callback(chunk_id, text)
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    records.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def remember(record, audit, analysis):
+            # 只审计了部分行的结果不完整，不能写入清单供全量审计复用
+            if not scoped:
+                self.manifest.update(root, record, audit, analysis, rules_version, model_version)
+
+        def carry(path, rep_id, rep_root, rep_path, score, analysis, content=None):
+            # 近似重复的文件沿用代表文件的AI结果，附带两者的差异，调用方持有lock
+            record = pending.pop(path)
+            if content is None:
+                content = load_content(record)
+            duplicate_of = rep_path if rep_root == root else os.path.join(rep_root, rep_path)
+            diff = make_diff(index.get_content(rep_id), content, duplicate_of, path)
+            entry = carry_analysis(analysis, path, content.count('\n') + 1, duplicate_of, score, diff)
+            analysis_result[path] = entry
+            stats['near_duplicates'] += 1
+            self._notify(None, on_analysis, path, None, entry)
+            remember(record, audit_result[path], entry)
+
+        def finish_representative(path, entry):
+            # 代表文件的代码块全部返回后，把结果交给等待中的近似重复文件，调用方持有lock
+            rep_id = representatives.pop(path, None)
+            if rep_id is None:
+                return
+            cluster = clusters.pop(rep_id)
+            if path in failed:
+                index.remove(rep_id)
+                for follower, _ in cluster['followers']:
+                    pending.pop(follower)
+                    analysis_result[follower] = {'chunks': [], 'skipped': 'duplicate_failed'}
+                return
+            # 沿用的是只含代表文件自身条目的结果
+            entry = dict(entry, chunks=cluster['chunks'])
+            index.complete(rep_id, entry)
+            for follower, score in cluster['followers']:
+                carry(follower, rep_id, root, path, score, entry)
+
+        def crawl_stage():
+            # 1. 流式爬取代码，只把新增或修改的文件交给后续阶段
+            try:
+                with self.tracer.span('crawl', 'crawl') as span:
+                    files = source.iter_files(cancel) if scoped else self.web_crawler.iter_files(code_path, cancel)
+                    for record in files:
+                        path = record['path']
+                        cached = self.manifest.lookup(root, record, rules_version, model_version)
+                        if cached is not None and cached[1].get('skipped') == 'low_risk' \
+                                and cached[1].get('risk', 0.0) >= min_risk:
+                            # 上次因风险低于阈值未送入AI，本次阈值更低时重新审计并送入AI
+                            cached = None
+                        if cached is not None and scoped:
+                            # 内容与上次全量审计时相同，只保留审计范围内的结果
+                            cached = (filter_audit_result(cached[0], record['ranges']),
+                                      filter_analysis(cached[1], record['ranges']))
+                        with lock:
+                            seen.add(path)
+                            if cached is not None:
+                                audit_result[path], analysis_result[path] = cached
+                                stats['reused'] += 1
+                                self._notify(on_audit, on_analysis, path, *cached)
+                            else:
+                                pending[path] = record
+                        span.add(files=1, reused=int(cached is not None))
+                        progress.add(files_scanned=1, files_reused=int(cached is not None))
+                        if cached is None and not put(record):
+                            return
+                    progress.finish('crawl')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(finished)
+
+        def queued_records():
+            while not stop.is_set() and not cancel.is_set():
+                try:
+                    record = records.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if record is finished:
+                    return
+                yield record
+
+        def static_stage():
+            # 2. 在进程池中并行执行代码审计，按风险分数把文件放入AI队列
+            try:
+                with self.tracer.span('static', 'static') as span:
+                    for path, result in self.code_audit.audit_files(queued_records()):
+                        if cancel.is_set():
+                            break
+                        if scoped:
+                            result = filter_audit_result(result, pending[path]['ranges'])
+                        risk = self._risk_score(result)
+                        span.add(files=1, findings=len(result['findings']))
+                        with lock:
+                            audit_result[path] = result
+                            if on_audit is not None:
+                                on_audit(path, result)
+                            if model and risk < min_risk:
+                                # 记下风险分数，以更低的阈值再次审计时据此决定是否送入AI
+                                entry = {'chunks': [], 'skipped': 'low_risk', 'risk': risk}
+                                analysis_result[path] = entry
+                                stats['low_risk'] += 1
+                                remember(pending.pop(path), result, entry)
+                                progress.add(files_audited=1)
+                                continue
+                            signature = None
+                            if index is not None:
+                                content = load_content(pending[path])
+                                signature = index.signature(content)
+                                match = index.query(signature, model_version) if signature else None
+                                # 静态风险高于代表文件说明修改中可能引入了新的危险代码，仍单独送入AI
+                                if match is not None and risk <= match['risk']:
+                                    if match['analysis'] is not None:
+                                        carry(path, match['id'], match['root'], match['path'], match['similarity'],
+                                              match['analysis'], content)
+                                        progress.add(files_audited=1)
+                                        continue
+                                    if match['id'] in clusters:
+                                        clusters[match['id']]['followers'].append((path, match['similarity']))
+                                        progress.add(files_audited=1)
+                                        continue
+                            count = chunk_queue.put_file(pending[path], risk) if model else 0
+                            if count:
+                                remaining[path] = count
+                                if signature is not None:
+                                    rep_id = index.add(root, path, signature, content, risk, model_version)
+                                    clusters[rep_id] = {'path': path, 'followers': [], 'chunks': []}
+                                    representatives[path] = rep_id
+                            else:
+                                # 空文件或只做静态审计时不会产生代码块，直接记入清单
+                                entry = {'chunks': []}
+                                if not self.low_memory:
+                                    analysis_result[path] = entry
+                                remember(pending.pop(path), result, entry)
+                        progress.add(files_audited=1)
+                    else:
+                        progress.finish('static')
+            except Exception as e:
+                errors.append(e)
+                # 让阻塞在队列上的爬虫线程退出
+                stop.set()
+            finally:
+                chunk_queue.close()
+
+        def ai_chunks():
+            # 3. 按风险从高到低取出代码块，超出预算的代码块不再发送（已缓存的不计入预算）
+            while True:
+                chunk = chunk_queue.get_chunk()
+                if chunk is None or cancel.is_set():
+                    return
+                counted = not limited or not self.ai_models.is_cached(chunk['content'], model)
+                if limited and counted and ((max_requests and stats['chunks'] >= max_requests) or
+                                            (max_tokens and stats['tokens'] + chunk['tokens'] > max_tokens)):
+                    with lock:
+                        stats['budget_skipped'] += 1
+                        for segment in chunk['segments']:
+                            path = segment['path']
+                            analysis_result.setdefault(path, {'chunks': []})['skipped'] = 'budget'
+                            remaining[path] -= 1
+                            failed.add(path)
+                            if remaining[path] == 0:
+                                del pending[path]
+                                finish_representative(path, None)
+                    continue
+                if counted:
+                    stats['chunks'] += 1
+                    stats['tokens'] += chunk['tokens']
+                progress.add(chunks_sent=1, tokens_sent=chunk['tokens'])
+                yield chunk
+
+        threads = [threading.Thread(target=crawl_stage, name='audit-crawl', daemon=True),
+                   threading.Thread(target=static_stage, name='audit-static', daemon=True)]
+        for thread in threads:
+            thread.start()
+        if model:
+            # 本地模型的加载与爬取、静态审计并行进行，不等待其完成
+            threading.Thread(target=self.ai_models.warm_up, args=(model,), name='audit-warmup', daemon=True).start()
+        interrupted = None
+        try:
+            with self.tracer.span('ai', 'ai', model=model) if model else NULL_SPAN:
+                ai_results = self.ai_models.analyze_batch(ai_chunks(), model, on_token, cancel) if model else ()
+                for item in ai_results:
+                    with lock:
+                        for segment in item['chunk']['segments']:
+                            path = segment['path']
+                            entry = analysis_result.setdefault(path, {'chunks': []})
+                            if item['error'] is not None:
+                                chunk_entry = {'chunk_id': item['chunk_id'], 'error': item['error']}
+                                failed.add(path)
+                            else:
+                                entry['model'] = item['result']['model']
+                                chunk_entry = {
+                                    'chunk_id': item['chunk_id'],
+                                    'start_line': segment['start_line'],
+                                    'end_line': segment['end_line'],
+                                    'chunk_start_line': segment['chunk_start_line'],
+                                    'analysis': item['result']['analysis']
+                                }
+                            entry['chunks'].append(chunk_entry)
+                            if path in representatives and 'analysis' in chunk_entry:
+                                # 合并了其他文件的代码块中，只有定位到代表文件的条目才能沿用给近似重复文件
+                                clusters[representatives[path]]['chunks'].append(dict(
+                                    chunk_entry, analysis=self.data_analysis.filter_analysis(
+                                        chunk_entry['analysis'], item['chunk']['segments'], path)))
+                            if on_analysis is not None:
+                                on_analysis(path, chunk_entry)
+                            remaining[path] -= 1
+                            if remaining[path] == 0:
+                                # 文件的代码块全部返回后释放文件记录
+                                record = pending.pop(path)
+                                if path not in failed:
+                                    remember(record, audit_result[path], entry)
+                                finish_representative(path, entry)
+                    usage = (item['result'] or {}).get('usage') or {}
+                    progress.add(chunks_done=1, chunks_failed=int(item['error'] is not None),
+                                 tokens_done=item['chunk']['tokens'],
+                                 tokens_used=(usage.get('prompt_tokens') or 0) +
+                                 (usage.get('completion_tokens') or 0))
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+            if not cancel.is_set() and not scoped:
+                self.manifest.prune(root, seen)
+        except Exception as e:
+            interrupted = e
+        finally:
+            stop.set()
+            chunk_queue.close()
+            for thread in threads:
+                thread.join()
+            # 中途失败时也保留已完成文件的结果，下次审计可以直接复用
+            with self.tracer.span('manifest.commit', 'manifest'):
+                self.manifest.commit()
+            if index is not None:
+                # 未完成分析的代表文件不保留在索引中
+                for rep_id in clusters:
+                    index.remove(rep_id)
+                index.commit()
+        self.logger.info(f'Reused manifest results for {stats["reused"]}/{len(seen)} files')
+        if model:
+            self.logger.info(f'AI stage: {stats["chunks"]} chunks ({stats["tokens"]} tokens) dispatched, '
+                             f'{stats["budget_skipped"]} chunks over budget, '
+                             f'{stats["low_risk"]} low-risk files skipped, '
+                             f'{stats["near_duplicates"]} near-duplicate files reused a representative\'s analysis')
+            self.logger.info(f'AI response cache: {self.ai_models.get_cache_stats()}')
+            routing = self.ai_models.get_routing_stats()
+            if routing is not None:
+                self.logger.info(f'AI routing: {routing}')
+        # 4. 数据分析，取消或失败时同样根据已完成的部分生成报告
+        with self.tracer.span('analysis', 'analysis'):
+            try:
+                final_report = self.data_analysis.analyze(audit_result, analysis_result)
+            finally:
+                if self.low_memory:
+                    audit_result.close()
+        self.tracer.record('audit', 'audit', started, time.perf_counter() - started,
+                           time.thread_time() - cpu_started, model=model or 'none', files=len(seen))
+        if self.tracer.enabled:
+            final_report['summary']['trace'] = self.tracer.summary()
+        if scoped:
+            final_report['summary']['diff'] = source.describe()
+        if interrupted is not None or cancel.is_set():
+            cancelled = interrupted is None
+            final_report['summary']['status'] = 'cancelled' if cancelled else 'failed'
+            message = '审计已取消' if cancelled else f'审计失败: {interrupted}'
+            self.logger.warning(f'Audit interrupted, returning partial results: {interrupted or "cancelled"}')
+            if on_progress is not None:
+                on_progress(progress.snapshot('cancelled' if cancelled else 'failed'))
+            raise AuditInterrupted(message, final_report, cancelled) from interrupted
+        final_report['summary']['status'] = 'completed'
+        if on_progress is not None:
+            on_progress(progress.snapshot('done'))
+        return final_report
+
+    @staticmethod
+    def _notify(on_audit, on_analysis, path, audit, analysis):
+        """把复用的结果（来自审计清单或近似重复的代表文件）同样交给回调"""
+        if on_audit is not None:
+            on_audit(path, audit)
+        if on_analysis is not None:
+            for chunk_entry in analysis.get('chunks', []):
+                on_analysis(path, chunk_entry)
+
+    @classmethod
+    def _risk_score(cls, result):
+        """根据静态审计结果计算0-1之间的风险分数，多个命中按1-∏(1-w)叠加，污点分析确认参数安全的命中按低危计算"""
+        safe = 1.0
+        for finding in result['findings']:
+            severity = 'low' if finding.get('taint') == 'clean' else finding['severity']
+            safe *= 1.0 - cls.SEVERITY_WEIGHTS.get(severity, 0.2)
+        return max(1.0 - safe, result.get('obfuscation_score', 0.0))
\ No newline at end of file
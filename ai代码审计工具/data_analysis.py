@@ -1,20 +1,419 @@
+import hashlib
 import logging
-from typing import Dict, Any
+import os
+import re
+from bisect import bisect_left, bisect_right
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from chunker import locate
+from tracing import NULL_TRACER
+
+# 严重程度对排序分数的权重
+SEVERITY_WEIGHTS = {'high': 1.0, 'medium': 0.6, 'low': 0.3}
+
+# 各来源单独报告问题时的基础置信度
+RULE_CONFIDENCE = {'high': 0.7, 'medium': 0.5, 'low': 0.3}
+# 污点分析找到了从外部输入到危险函数的完整路径
+TAINT_CONFIDENCE = 0.85
+AI_CONFIDENCE = 0.45
+# AI没有给出行号、只能定位到整个文件片段时的置信度
+AI_BROAD_CONFIDENCE = 0.3
+
+def finding_source(rule_id: str) -> str:
+    """静态审计命中的来源：混淆检测、污点分析或签名规则"""
+    if rule_id.startswith('obfuscation-'):
+        return 'obfuscation'
+    return 'taint' if rule_id.startswith('taint-') else 'rule'
+
+
+# 同一类别的发现相距不超过该行数时视为同一处问题
+LINE_TOLERANCE = 2
+
+# 每条合并后的发现最多保留的证据条数
+MAX_EVIDENCE = 5
+
+# AI文本中的问题类别关键字，按顺序匹配第一个命中的类别
+AI_CATEGORY_KEYWORDS = [
+    ('sql_injection', ['sql注入', 'sql 注入', 'sql injection', 'sqli']),
+    ('command_exec', ['命令执行', '命令注入', 'command injection', 'command execution', 'shell_exec', 'popen']),
+    ('code_exec', ['代码执行', '代码注入', '远程代码', 'code execution', 'code injection', 'rce', 'eval',
+                   'webshell', '一句话', '后门', '木马', 'backdoor']),
+    ('file_include', ['文件包含', 'file inclusion', 'lfi', 'rfi']),
+    ('file_write', ['文件写入', '任意文件写', '文件上传', 'file upload', 'file write']),
+    ('path_traversal', ['路径遍历', '目录遍历', '路径穿越', 'path traversal', 'directory traversal']),
+    ('deserialization', ['反序列化', 'deserialization', 'unserialize', 'pickle']),
+    ('xss', ['xss', '跨站脚本', 'cross-site scripting']),
+    ('ssrf', ['ssrf', '服务端请求伪造', 'server-side request forgery']),
+    ('obfuscation', ['混淆', '加密载荷', '编码载荷', 'obfuscated', 'obfuscation']),
+    ('credentials', ['硬编码', '密钥泄露', '明文密码', 'hardcoded', 'hard-coded', 'credential']),
+]
+
+# AI未标明严重程度时按类别取默认值
+CATEGORY_SEVERITY = {
+    'code_exec': 'high', 'command_exec': 'high', 'sql_injection': 'high', 'file_include': 'high',
+    'deserialization': 'high', 'file_write': 'medium', 'path_traversal': 'medium', 'xss': 'medium',
+    'ssrf': 'medium', 'obfuscation': 'medium', 'credentials': 'medium'
+}
+
+SEVERITY_PATTERNS = [
+    ('high', re.compile(r'严重|高危|高风险|(?<![a-z])(?:critical|high)(?![a-z])', re.IGNORECASE)),
+    ('medium', re.compile(r'中危|中风险|中等风险|(?<![a-z])medium(?![a-z])', re.IGNORECASE)),
+    ('low', re.compile(r'低危|低风险|(?<![a-z])low(?![a-z])', re.IGNORECASE)),
+]
+
+# 第12行、第12-15行、line 12、lines 12-15、L12
+LINE_PATTERN = re.compile(
+    r'第\s*(\d+)\s*(?:[-~～到至]\s*(\d+)\s*)?行|'
+    r'(?<![a-z])lines?\s*(\d+)(?:\s*[-~–]\s*(\d+))?|'
+    r'(?<![a-z])L(\d+)(?:\s*-\s*L?(\d+))?',
+    re.IGNORECASE)
+
+# AI分析中一个问题条目的起始行：编号列表、项目符号或Markdown标题
+ITEM_START = re.compile(r'^\s*(?:\d+\s*[.、)）]|[-*•]\s|#{1,6}\s|\*\*)')
+
+
+def _keyword_pattern(keywords: List[str]):
+    parts = []
+    for keyword in keywords:
+        escaped = re.escape(keyword)
+        # ASCII关键字按单词匹配，避免rce命中source之类的单词
+        parts.append(f'(?<![a-z]){escaped}(?![a-z])' if keyword.isascii() else escaped)
+    return re.compile('|'.join(parts), re.IGNORECASE)
+
+
+AI_CATEGORY_PATTERNS = [(category, _keyword_pattern(keywords)) for category, keywords in AI_CATEGORY_KEYWORDS]
+
+
+class Finding:
+    """归一化的发现记录，使用__slots__以便在数万条记录时节省内存"""
+
+    __slots__ = ('key', 'fingerprint', 'path', 'start_line', 'end_line', 'category', 'severity', 'title',
+                 'description', 'rule_ids', 'source_confidence', 'evidence', 'count', 'broad')
+
+    def __init__(self, key: str, path: str, start_line: int, end_line: int, category: str, severity: str,
+                 title: str, description: str, rule_id: str, source: str, confidence: float,
+                 evidence: Dict[str, Any], broad: bool = False):
+        self.key = key
+        self.fingerprint = None
+        self.path = path
+        self.start_line = start_line
+        self.end_line = max(start_line, end_line)
+        self.category = category
+        self.severity = severity
+        self.title = title
+        self.description = description
+        self.rule_ids = [rule_id]
+        self.source_confidence = {source: confidence}
+        self.evidence = [evidence]
+        self.count = 1
+        self.broad = broad
+
+    @property
+    def confidence(self) -> float:
+        """不同来源相互独立地报告同一问题时按1-∏(1-c)叠加，同一来源的重复报告只取最大值"""
+        doubt = 1.0
+        for confidence in self.source_confidence.values():
+            doubt *= 1.0 - confidence
+        return 1.0 - doubt
+
+    @property
+    def score(self) -> float:
+        return SEVERITY_WEIGHTS.get(self.severity, 0.3) * self.confidence
+
+    def merge(self, other: 'Finding'):
+        """并入另一条描述同一问题的发现"""
+        self.start_line = min(self.start_line, other.start_line)
+        self.end_line = max(self.end_line, other.end_line)
+        if SEVERITY_WEIGHTS.get(other.severity, 0) > SEVERITY_WEIGHTS.get(self.severity, 0):
+            self.severity = other.severity
+        # 规则命中的标题和描述比AI文本更规范，优先保留
+        if 'ai' in self.source_confidence and 'ai' not in other.source_confidence:
+            self.title, self.description = other.title, other.description
+        for rule_id in other.rule_ids:
+            if rule_id not in self.rule_ids:
+                self.rule_ids.append(rule_id)
+        for source, confidence in other.source_confidence.items():
+            self.source_confidence[source] = max(confidence, self.source_confidence.get(source, 0.0))
+        self.evidence.extend(other.evidence[:MAX_EVIDENCE - len(self.evidence)])
+        self.count += other.count
+        self.broad = self.broad and other.broad
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'fingerprint': self.fingerprint,
+            'path': self.path,
+            'start_line': self.start_line,
+            'end_line': self.end_line,
+            'category': self.category,
+            'severity': self.severity,
+            'title': self.title,
+            'description': self.description,
+            'confidence': round(self.confidence, 3),
+            'score': round(self.score, 3),
+            'sources': sorted(self.source_confidence),
+            'rule_ids': list(self.rule_ids),
+            'occurrences': self.count,
+            'evidence': list(self.evidence)
+        }
+
+
+class IntervalIndex:
+    """按(文件, 类别)分组、按起始行排序的区间索引，用二分查找定位与给定行区间重叠的发现"""
+
+    def __init__(self, findings: Iterable[Finding]):
+        groups = {}
+        for finding in findings:
+            groups.setdefault((finding.path, finding.category), []).append(finding)
+        self.groups = {}
+        for key, items in groups.items():
+            items.sort(key=lambda f: f.start_line)
+            # 组内最长区间的跨度，查询时起始行只需回看这么远
+            span = max(f.end_line - f.start_line for f in items)
+            self.groups[key] = ([f.start_line for f in items], items, span)
+
+    def query(self, path: str, category: str, start_line: int, end_line: int) -> List[Finding]:
+        group = self.groups.get((path, category))
+        if group is None:
+            return []
+        starts, items, span = group
+        lo = bisect_left(starts, start_line - span)
+        hi = bisect_right(starts, end_line)
+        return [f for f in items[lo:hi] if f.end_line >= start_line]
+
 
 class DataAnalysis:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        self.tracer = NULL_TRACER
 
     def analyze(self, audit_result: Dict[str, Any], analysis_result: Dict[str, Any]) -> Dict[str, Any]:
         """
-        对审计结果和AI分析结果进行综合分析
+        对审计结果和AI分析结果进行综合分析：归一化为统一的发现记录，按指纹去除重复，
+        按文件和行区间合并静态规则与AI对同一位置的报告，输出按风险排序的报告
         Args:
             audit_result: 代码审计结果
             analysis_result: AI分析结果
         Returns:
-            最终分析报告
+            最终分析报告，包含summary、按分数排序的findings、无法定位到文件的AI意见unlocated
+            和沿用代表文件AI结果的近似重复文件duplicates
         """
         self.logger.info('Starting data analysis...')
-        # TODO: 实现数据分析逻辑
-        final_report = {}
-        return final_report
\ No newline at end of file
+        with self.tracer.span('analysis.normalize', 'analysis') as span:
+            findings = list(self._static_findings(audit_result))
+            ai_findings, unlocated = self._ai_findings(analysis_result)
+            findings.extend(ai_findings)
+            raw_count = len(findings)
+            span.set(findings=raw_count)
+
+        # 1. 按(指纹键, 文件, 行)去除完全相同的发现
+        exact = {}
+        for finding in findings:
+            key = (finding.key, finding.path, finding.start_line)
+            if key in exact:
+                exact[key].merge(finding)
+            else:
+                exact[key] = finding
+
+        # 2. 同一文件同一类别、行区间相邻或重叠的精确发现按起始行扫描合并
+        precise = [f for f in exact.values() if not f.broad]
+        broad = [f for f in exact.values() if f.broad]
+        precise.sort(key=lambda f: (f.path, f.category, f.start_line))
+        merged = []
+        for finding in precise:
+            last = merged[-1] if merged else None
+            if last is not None and last.path == finding.path and last.category == finding.category \
+                    and finding.start_line <= last.end_line + LINE_TOLERANCE:
+                last.merge(finding)
+            else:
+                merged.append(finding)
+
+        # 3. 只定位到整个片段的AI意见不参与扫描合并，避免吞掉片段内的多个独立问题，
+        #    只为区间内同类别的发现提供佐证，没有对应发现时单独保留
+        index = IntervalIndex(merged)
+        for finding in broad:
+            matches = index.query(finding.path, finding.category, finding.start_line, finding.end_line)
+            for match in matches:
+                confidence = finding.source_confidence['ai']
+                match.source_confidence['ai'] = max(confidence, match.source_confidence.get('ai', 0.0))
+                if len(match.evidence) < MAX_EVIDENCE:
+                    match.evidence.append(finding.evidence[0])
+            if not matches:
+                merged.append(finding)
+
+        # 4. 生成稳定指纹并排序
+        ordinals = {}
+        for finding in sorted(merged, key=lambda f: (f.path, f.start_line)):
+            ordinal = ordinals.get(finding.key, 0)
+            ordinals[finding.key] = ordinal + 1
+            finding.fingerprint = hashlib.sha1(f'{finding.key}\0{ordinal}'.encode('utf-8')).hexdigest()[:16]
+        merged.sort(key=lambda f: (-f.score, f.path, f.start_line))
+
+        # 沿用代表文件AI结果的近似重复文件，附带与代表文件的差异以便人工复核
+        duplicates = [{'path': path, 'duplicate_of': entry['duplicate_of']['path'],
+                       'similarity': entry['duplicate_of']['similarity'], 'diff': entry['duplicate_of']['diff']}
+                      for path, entry in analysis_result.items() if entry.get('duplicate_of')]
+        by_severity = {}
+        by_category = {}
+        agreements = 0
+        for finding in merged:
+            by_severity[finding.severity] = by_severity.get(finding.severity, 0) + 1
+            by_category[finding.category] = by_category.get(finding.category, 0) + 1
+            if 'ai' in finding.source_confidence and len(finding.source_confidence) > 1:
+                agreements += 1
+        summary = {
+            'files': len(set(audit_result) | set(analysis_result)),
+            'raw_findings': raw_count,
+            'findings': len(merged),
+            'duplicates_merged': raw_count - len(merged),
+            'agreements': agreements,
+            'by_severity': by_severity,
+            'by_category': by_category,
+            'unlocated': len(unlocated),
+            'skipped_files': sum(1 for entry in analysis_result.values() if entry.get('skipped')),
+            'near_duplicates': len(duplicates)
+        }
+        self.logger.info(f'Merged {raw_count} raw findings into {len(merged)} ({agreements} confirmed by AI)')
+        return {
+            'summary': summary,
+            'findings': [finding.to_dict() for finding in merged],
+            'unlocated': unlocated,
+            'duplicates': duplicates
+        }
+
+    @staticmethod
+    def _static_findings(audit_result: Dict[str, Any]) -> Iterable[Finding]:
+        for path, result in audit_result.items():
+            for item in result.get('findings', []):
+                rule_id = item['rule_id']
+                source = finding_source(rule_id)
+                severity = item.get('severity', 'medium')
+                if source == 'obfuscation':
+                    confidence = 0.3 + 0.5 * item.get('score', 0.0)
+                elif source == 'taint':
+                    confidence = TAINT_CONFIDENCE
+                else:
+                    confidence = RULE_CONFIDENCE.get(severity, 0.3)
+                    # 污点分析确认危险函数的参数不来自外部输入
+                    if item.get('taint') == 'clean':
+                        confidence /= 2
+                match = ' '.join(item.get('match', '').split())
+                key = f'{path}\0{rule_id}\0{match}'
+                yield Finding(key, path, item['line'], item['line'], item.get('category', 'other'), severity,
+                              item.get('name', rule_id), item.get('description', ''), rule_id, source, confidence,
+                              {'source': source, 'line': item['line'], 'text': item.get('match', '')})
+
+    def _ai_findings(self, analysis_result: Dict[str, Any]) -> Tuple[List[Finding], List[Dict[str, Any]]]:
+        """把AI返回的自由文本拆分为问题条目，识别类别、严重程度和行号后映射回源文件"""
+        # 同一代码块的分析文本会出现在块内每个文件的结果中，先按代码块还原一次
+        chunks = {}
+        for path, entry in analysis_result.items():
+            for item in entry.get('chunks', []):
+                if 'analysis' not in item:
+                    continue
+                chunk = chunks.setdefault((item['chunk_id'], item['analysis']), {'segments': []})
+                chunk['segments'].append({
+                    'path': path,
+                    'start_line': item['start_line'],
+                    'end_line': item['end_line'],
+                    'chunk_start_line': item['chunk_start_line']
+                })
+
+        findings = []
+        unlocated = []
+        for (chunk_id, text), chunk in chunks.items():
+            for item in self._split_items(text):
+                category = next((c for c, pattern in AI_CATEGORY_PATTERNS if pattern.search(item)), None)
+                if category is None:
+                    # 没有提到任何安全问题类别的段落（总结、代码风格建议等）不计入发现
+                    continue
+                severity = next((s for s, pattern in SEVERITY_PATTERNS if pattern.search(item)),
+                                CATEGORY_SEVERITY.get(category, 'low'))
+                title = ITEM_START.sub('', item.split('\n', 1)[0]).strip(' *#:：')[:80] or category
+                location = self._locate_item(chunk, item)
+                if location is None:
+                    unlocated.append({'chunk_id': chunk_id, 'paths': [s['path'] for s in chunk['segments']],
+                                      'category': category, 'severity': severity, 'title': title,
+                                      'description': item[:1000]})
+                    continue
+                path, start_line, end_line, broad = location
+                key = f'{path}\0ai:{category}\0{" ".join(title.split())}'
+                findings.append(Finding(
+                    key, path, start_line, end_line, category, severity, title, item[:1000], f'ai:{category}', 'ai',
+                    AI_BROAD_CONFIDENCE if broad else AI_CONFIDENCE,
+                    {'source': 'ai', 'line': start_line, 'chunk_id': chunk_id, 'text': item[:200]}, broad))
+        return findings, unlocated
+
+    @classmethod
+    def filter_analysis(cls, text: str, segments: List[Dict[str, Any]], path: str) -> str:
+        """
+        只保留定位到指定文件的AI条目，近似重复文件沿用代表文件的结果时使用，
+        避免把同一代码块中其他文件的问题也带过去
+        Args:
+            text: 代码块的分析文本
+            segments: 代码块中各文件的片段
+            path: 保留条目的文件
+        """
+        if all(segment['path'] == path for segment in segments):
+            return text
+        chunk = {'segments': segments}
+        return '\n\n'.join(item for item in cls._split_items(text)
+                           if (cls._locate_item(chunk, item) or (None,))[0] == path)
+
+    @staticmethod
+    def _split_items(text: str) -> List[str]:
+        items = []
+        current = []
+        for line in text.splitlines():
+            if ITEM_START.match(line) or (not line.strip() and current):
+                if current:
+                    items.append('\n'.join(current).strip())
+                current = [line] if line.strip() else []
+            elif line.strip():
+                current.append(line)
+        if current:
+            items.append('\n'.join(current).strip())
+        return [item for item in items if item]
+
+    @staticmethod
+    def _locate_item(chunk: Dict[str, Any], item: str) -> Optional[Tuple[str, int, int, bool]]:
+        """
+        确定AI条目对应的文件和行区间
+        Returns:
+            (文件路径, 起始行, 结束行, 是否只定位到整个片段)，无法确定文件时返回None
+        """
+        segments = chunk['segments']
+        lines = []
+        for m in LINE_PATTERN.finditer(item):
+            groups = [g for g in m.groups() if g]
+            start = int(groups[0])
+            lines.append((start, int(groups[1]) if len(groups) > 1 else start))
+
+        # 优先按文本中提到的文件名确定文件
+        candidates = segments
+        if len(segments) > 1:
+            mentioned = []
+            for segment in segments:
+                position = item.find(segment['path'])
+                if position < 0:
+                    position = item.find(os.path.basename(segment['path']))
+                if position >= 0:
+                    mentioned.append((position, segment))
+            if mentioned:
+                mentioned.sort(key=lambda m: m[0])
+                candidates = [m[1] for m in mentioned if m[1]['path'] == mentioned[0][1]['path']]
+
+        for start, end in lines:
+            # 行号可能是标题中给出的源文件行号，也可能是代码块内容中的行号
+            for segment in candidates:
+                if segment['start_line'] <= start <= segment['end_line']:
+                    return segment['path'], start, min(max(start, end), segment['end_line']), False
+            located = locate({'segments': candidates}, start)
+            if located is not None:
+                return located[0], located[1], located[1] + max(0, end - start), False
+
+        paths = {segment['path'] for segment in candidates}
+        if len(paths) != 1:
+            return None
+        path = paths.pop()
+        start_line = min(s['start_line'] for s in candidates)
+        end_line = max(s['end_line'] for s in candidates)
+        return path, start_line, end_line, True
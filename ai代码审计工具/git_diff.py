@@ -0,0 +1,317 @@
+import ast
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from chunker import BOUNDARY_PATTERN, split_lines
+from web_crawler import WebCrawler, is_binary, BINARY_SNIFF_SIZE
+
+HUNK_PATTERN = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+# 改动所在的函数/类超过该行数时不再扩展到整个函数，只保留改动及其上下文
+DEFAULT_MAX_SCOPE_LINES = 400
+# 改动不在任何函数/类中时保留的上下文行数
+DEFAULT_CONTEXT_LINES = 3
+# 向上查找函数边界时最多检查的候选边界数
+MAX_BOUNDARY_CANDIDATES = 20
+
+# git对含特殊字符的路径使用C风格的引号和转义
+_ESCAPES = {b'a': b'\a', b'b': b'\b', b't': b'\t', b'n': b'\n', b'v': b'\v', b'f': b'\f', b'r': b'\r'}
+_QUOTED_PATTERN = re.compile(rb'\\([0-7]{3}|.)')
+
+# 统计花括号时去掉字符串和行注释，避免其中的括号干扰匹配
+_STRIP_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`[^`]*`|//.*$|#.*$')
+
+
+def unquote_path(text: str) -> str:
+    """
+    还原diff头部中的路径：含引号、反斜杠或控制字符的路径被git加上引号并转义，
+    含空格的路径末尾带有一个制表符
+    """
+    if not text.startswith('"'):
+        return text[:-1] if text.endswith('\t') else text
+
+    def replace(m):
+        code = m.group(1)
+        # 八进制转义表示单个字节，多字节UTF-8字符会拆成连续的几个转义，按字节还原后再统一解码
+        return bytes([int(code, 8)]) if len(code) == 3 else _ESCAPES.get(code, code)
+
+    raw = _QUOTED_PATTERN.sub(replace, text[1:text.rindex('"')].encode('utf-8'))
+    return raw.decode('utf-8', errors='replace')
+
+
+def parse_revisions(text: str) -> Tuple[str, Optional[str], bool]:
+    """
+    解析版本范围
+    Args:
+        text: BASE（与工作区比较）、BASE..HEAD，或BASE...HEAD（从两者的共同祖先开始比较，与PR的改动一致）
+    Returns:
+        (base, head, 是否使用共同祖先)，head为None表示工作区
+    """
+    if '...' in text:
+        base, head = text.split('...', 1)
+        return base, head or 'HEAD', True
+    if '..' in text:
+        base, head = text.split('..', 1)
+        return base, head or 'HEAD', False
+    return text, None, False
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """合并重叠或相邻的行区间"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def in_ranges(line: int, ranges: List[Tuple[int, int]]) -> bool:
+    return any(start <= line <= end for start, end in ranges)
+
+
+def filter_audit_result(result: Dict[str, Any], ranges: List[Tuple[int, int]]) -> Dict[str, Any]:
+    """只保留落在审计范围内的静态审计发现"""
+    return dict(result, findings=[f for f in result.get('findings', []) if in_ranges(f.get('line', 0), ranges)])
+
+
+def filter_analysis(entry: Dict[str, Any], ranges: List[Tuple[int, int]]) -> Dict[str, Any]:
+    """只保留与审计范围有重叠的AI分析结果"""
+    chunks = [c for c in entry.get('chunks', [])
+              if 'start_line' in c and any(c['start_line'] <= end and start <= c['end_line'] for start, end in ranges)]
+    return dict(entry, chunks=chunks)
+
+
+def _python_scopes(content: str) -> Optional[List[Tuple[int, int]]]:
+    """Python文件中所有函数和类的行区间（含装饰器），语法错误时返回None"""
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return None
+    scopes = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            scopes.append((start, node.end_lineno))
+    return scopes
+
+
+def _brace_end(lines: List[str], start: int, limit: int) -> Optional[int]:
+    """从start行（0起）开始匹配花括号，返回作用域结束的行号（1起），在limit行内没有闭合时返回None"""
+    depth = 0
+    opened = False
+    for i in range(start, min(len(lines), start + limit)):
+        text = _STRIP_PATTERN.sub('', lines[i])
+        for c in text:
+            if c == '{':
+                depth += 1
+                opened = True
+            elif c == '}':
+                depth -= 1
+                if opened and depth <= 0:
+                    return i + 1
+        if not opened and text.rstrip().endswith(';'):
+            # 函数声明（接口、抽象方法）没有函数体
+            return i + 1
+    return None
+
+
+def _enclosing(lines: List[str], line: int, scopes: Optional[List[Tuple[int, int]]],
+               max_lines: int) -> Optional[Tuple[int, int]]:
+    """返回包含该行（1起）的最内层函数/类区间，超过max_lines行的区间不采用"""
+    if scopes is not None:
+        containing = [s for s in scopes if s[0] <= line <= s[1] and s[1] - s[0] < max_lines]
+        return min(containing, key=lambda s: s[1] - s[0]) if containing else None
+    # 其他语言：向上查找函数/类的起始行，再按花括号确定结束行
+    checked = 0
+    for i in range(line - 1, max(-1, line - 1 - max_lines), -1):
+        if not BOUNDARY_PATTERN.match(lines[i]):
+            continue
+        end = _brace_end(lines, i, max_lines)
+        if end is not None and end >= line:
+            return i + 1, end
+        checked += 1
+        if checked >= MAX_BOUNDARY_CANDIDATES:
+            break
+    return None
+
+
+def expand_hunks(path: str, content: str, hunks: List[Tuple[int, int]],
+                 context: int = DEFAULT_CONTEXT_LINES,
+                 max_lines: int = DEFAULT_MAX_SCOPE_LINES) -> List[Tuple[int, int]]:
+    """
+    把改动的行区间扩展到所在的函数/类，使AI能看到完整的上下文
+    Args:
+        path: 文件路径，用于判断语言
+        content: 新版本的文件内容
+        hunks: 改动的行区间（1起，含两端）
+        context: 改动不在函数/类中时向两侧扩展的行数
+        max_lines: 函数/类超过该行数时只扩展context行
+    Returns:
+        合并后的行区间
+    """
+    lines = split_lines(content)
+    if not lines:
+        return []
+    scopes = _python_scopes(content) if path.endswith('.py') else None
+    ranges = []
+    for start, end in hunks:
+        start, end = max(1, min(start, len(lines))), max(1, min(end, len(lines)))
+        # 起止行分别扩展，改动跨越多个函数时覆盖首尾两个函数之间的全部代码
+        first = _enclosing(lines, start, scopes, max_lines)
+        last = first if end == start else _enclosing(lines, end, scopes, max_lines)
+        ranges.append((first[0] if first else max(1, start - context),
+                       last[1] if last else min(len(lines), end + context)))
+    return merge_ranges(ranges)
+
+
+class GitDiffSource:
+    """
+    基于本地git仓库两个版本之间的差异产出待审计的文件记录，格式与WebCrawler相同，
+    另外带有ranges（扩展到函数/类的审计范围）和hunks（实际改动的行区间）。
+    通过diff-tree/diff-index和cat-file读取，不检出工作区，也不遍历未改动的文件
+    """
+
+    def __init__(self, repo: str, base: str, head: Optional[str] = None, merge_base: bool = False,
+                 pathspec: Optional[str] = None, context: int = DEFAULT_CONTEXT_LINES,
+                 max_scope_lines: int = DEFAULT_MAX_SCOPE_LINES, web_crawler: Optional[WebCrawler] = None):
+        """
+        Args:
+            repo: 仓库中的任意路径
+            base: 基准版本
+            head: 目标版本，None表示工作区（只包含已跟踪的文件）
+            merge_base: 为True时从base与head的共同祖先开始比较
+            pathspec: 只审计该路径下的改动，None表示整个仓库
+            context: 改动不在函数/类中时保留的上下文行数
+            max_scope_lines: 扩展到函数/类的最大行数
+            web_crawler: 用于按扩展名、排除规则和大小上限过滤文件
+        """
+        self.logger = logging.getLogger(__name__)
+        self.root = self._git(['rev-parse', '--show-toplevel'], cwd=repo).strip()
+        self.head = self._git(['rev-parse', '--verify', f'{head}^{{commit}}']).strip() if head else None
+        base = self._git(['rev-parse', '--verify', f'{base}^{{commit}}']).strip()
+        if merge_base:
+            base = self._git(['merge-base', base, self.head or 'HEAD']).strip()
+        self.base = base
+        self.pathspec = pathspec
+        self.context = context
+        self.max_scope_lines = max_scope_lines
+        self.web_crawler = web_crawler or WebCrawler()
+        self.stats = {}
+
+    def _git(self, args: List[str], cwd: Optional[str] = None, input_data: Optional[bytes] = None) -> str:
+        completed = subprocess.run(['git', '-c', 'core.quotepath=off'] + args, cwd=cwd or self.root,
+                                   input=input_data, capture_output=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f'git {" ".join(args)} 执行失败: {completed.stderr.decode("utf-8", "replace").strip()}')
+        return completed.stdout.decode('utf-8', errors='replace')
+
+    def describe(self) -> Dict[str, Any]:
+        """返回比较的版本和改动统计，写入报告摘要"""
+        return {'base': self.base, 'head': self.head or 'worktree', **self.stats}
+
+    def changed_hunks(self) -> Dict[str, List[Tuple[int, int]]]:
+        """返回新版本中每个改动文件的改动行区间，删除的文件不包含在内"""
+        args = ['-p', '-U0', '-M', '--no-color', '--no-ext-diff', self.base]
+        if self.head:
+            args = ['diff-tree', '-r'] + args + [self.head]
+        else:
+            args = ['diff-index'] + args
+        if self.pathspec:
+            args += ['--', self.pathspec]
+        hunks = {}
+        path = None
+        # 只按换行切分，splitlines会把路径中的其他分隔字符也当作换行
+        for line in self._git(args).split('\n'):
+            if line.startswith('diff --git '):
+                path = None
+            elif line.startswith('+++ '):
+                target = unquote_path(line[4:])
+                path = target[2:] if target.startswith('b/') else None
+                if path is not None:
+                    hunks.setdefault(path, [])
+            elif path is not None and line.startswith('@@'):
+                m = HUNK_PATTERN.match(line)
+                if m is None:
+                    continue
+                start, count = int(m.group(1)), int(m.group(2) if m.group(2) is not None else 1)
+                # 纯删除的位置记为删除点前后两行，删除的校验逻辑同样需要审计
+                hunks[path].append((start, start + count - 1) if count else (max(1, start), start + 1))
+        return {path: ranges for path, ranges in hunks.items() if ranges}
+
+    def iter_files(self, cancel_event: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """
+        产出改动文件的记录
+        Returns:
+            文件记录迭代器，每条记录包含path、abs_path（非工作区版本为None）、size、mtime、hash、content、ranges和hunks
+        """
+        hunks = self.changed_hunks()
+        self.stats = {'files': 0, 'changed_lines': 0, 'scoped_lines': 0, 'skipped': 0}
+        paths = []
+        for path in sorted(hunks):
+            if self.web_crawler.ignore_rules.is_ignored(path) or (
+                    self.web_crawler.extensions and
+                    os.path.splitext(path)[1].lower() not in self.web_crawler.extensions):
+                self.stats['skipped'] += 1
+                continue
+            paths.append(path)
+        self.logger.info(f'{len(paths)} changed files between {self.base[:12]} and {self.head or "worktree"}')
+        for path, data in self._read_blobs(paths):
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            if data is None or is_binary(data[:BINARY_SNIFF_SIZE]) or (
+                    self.web_crawler.max_file_size and len(data) > self.web_crawler.max_file_size):
+                self.stats['skipped'] += 1
+                continue
+            content = data.decode('utf-8', errors='replace')
+            ranges = expand_hunks(path, content, hunks[path], self.context, self.max_scope_lines)
+            self.stats['files'] += 1
+            self.stats['changed_lines'] += sum(end - start + 1 for start, end in hunks[path])
+            self.stats['scoped_lines'] += sum(end - start + 1 for start, end in ranges)
+            # 历史版本的内容来自git对象，工作区中的文件可能已不同，不能交给按路径读取的混淆分析和惰性加载
+            abs_path = os.path.join(self.root, path) if self.head is None else None
+            yield {
+                'path': path,
+                'abs_path': abs_path,
+                'size': len(data),
+                'mtime': os.path.getmtime(abs_path) if abs_path else 0.0,
+                'hash': hashlib.sha256(data).hexdigest(),
+                'content': content,
+                'ranges': ranges,
+                'hunks': merge_ranges(hunks[path])
+            }
+        self.logger.info(f'Diff scope: {self.stats}')
+
+    def _read_blobs(self, paths: List[str]) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """读取目标版本中的文件内容，工作区直接读文件，其他版本通过cat-file --batch逐个读取"""
+        if self.head is None:
+            for path in paths:
+                try:
+                    with open(os.path.join(self.root, path), 'rb') as f:
+                        yield path, f.read()
+                except OSError as e:
+                    self.logger.warning(f'Cannot read {path}: {e}')
+                    yield path, None
+            return
+        process = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=self.root,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            for path in paths:
+                process.stdin.write(f'{self.head}:{path}\n'.encode('utf-8'))
+                process.stdin.flush()
+                header = process.stdout.readline().decode('utf-8', errors='replace').split()
+                if len(header) != 3 or header[1] != 'blob':
+                    # 子模块等不是普通文件的条目
+                    yield path, None
+                    continue
+                data = process.stdout.read(int(header[2]))
+                process.stdout.read(1)
+                yield path, data
+        finally:
+            process.stdin.close()
+            process.wait()
@@ -1,44 +1,100 @@
 import sys
+import os
 import logging
+import threading
+import time
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QTextEdit, QLabel, QFileDialog, QComboBox,
                              QTabWidget, QGroupBox, QFormLayout, QMessageBox, QSplitter,
-                             QDialog, QDialogButtonBox, QLineEdit)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+                             QDialog, QDialogButtonBox, QLineEdit, QTableView, QHeaderView,
+                             QAbstractItemView, QProgressBar, QSpinBox)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont, QTextCursor
+from result_model import FindingTableModel, FindingFilterProxy, JobTableModel, finding_to_row, render_detail
 
 # 导入核心引擎和相关模块
 try:
-    from core_engine import CoreEngine
+    from core_engine import CoreEngine, AuditInterrupted
+    from job_queue import JobQueue
+    from scheduler import AuditScheduler
 except ImportError:
     # 如果导入失败，尝试其他导入路径
     import os
     import sys
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from core_engine import CoreEngine
+    from core_engine import CoreEngine, AuditInterrupted
+    from job_queue import JobQueue
+    from scheduler import AuditScheduler
 
 class AuditThread(QThread):
     """审计线程，用于在后台执行代码审计任务"""
     audit_complete = pyqtSignal(dict)
     audit_error = pyqtSignal(str)
+    # 审计被取消或中途失败：(已完成部分的报告, 提示信息, 是否为用户取消)
+    audit_interrupted = pyqtSignal(dict, str, bool)
+    # 进度事件
+    progress = pyqtSignal(dict)
+    # AI流式输出的文本片段：(chunk_id, 文本)
+    ai_partial = pyqtSignal(str, str)
+    # 一批静态审计发现（表格行）
+    findings_batch = pyqtSignal(list)
+
+    # 攒够多少条或间隔多久向界面发送一批发现
+    BATCH_SIZE = 200
+    BATCH_INTERVAL = 0.2
     
-    def __init__(self, core_engine, code_path):
+    def __init__(self, core_engine, code_path, model='chatgpt'):
         super().__init__()
         self.core_engine = core_engine
         self.code_path = code_path
+        self.model = model
+        self.pending_rows = []
+        self.pending_lock = threading.Lock()
+        self.last_emit = time.monotonic()
+        self.cancel_event = threading.Event()
         
     def run(self):
         try:
-            result = self.core_engine.run_audit(self.code_path)
+            result = self.core_engine.run_audit(self.code_path, self.model, on_token=self.ai_partial.emit,
+                                                on_audit=self.collect_findings, on_progress=self.progress.emit,
+                                                cancel_event=self.cancel_event)
+            self.flush_findings()
             self.audit_complete.emit(result)
+        except AuditInterrupted as e:
+            self.flush_findings()
+            self.audit_interrupted.emit(e.partial_report, str(e), e.cancelled)
         except Exception as e:
+            self.flush_findings()
             self.audit_error.emit(str(e))
 
+    def cancel(self):
+        """请求停止审计，各阶段在处理完当前工作后退出"""
+        self.cancel_event.set()
+
+    def collect_findings(self, path, result):
+        """在审计工作线程中收集发现，按批发送，避免每条发现都触发一次界面更新"""
+        rows = [finding_to_row(path, finding) for finding in result['findings']]
+        with self.pending_lock:
+            self.pending_rows.extend(rows)
+            due = len(self.pending_rows) >= self.BATCH_SIZE or \
+                time.monotonic() - self.last_emit >= self.BATCH_INTERVAL
+        if due:
+            self.flush_findings()
+
+    def flush_findings(self):
+        with self.pending_lock:
+            rows, self.pending_rows = self.pending_rows, []
+            self.last_emit = time.monotonic()
+        if rows:
+            self.findings_batch.emit(rows)
+
 class CodeAuditGUI(QMainWindow):
     """代码审计工具的主窗口类"""
     def __init__(self):
         super().__init__()
         self.core_engine = CoreEngine()
+        self.job_queue = JobQueue()
+        self.scheduler = None
         self.init_ui()
         self.setup_logging()
         
@@ -77,7 +133,7 @@ class CodeAuditGUI(QMainWindow):
         model_group = QGroupBox('AI模型配置')
         model_layout = QFormLayout()
         self.model_combo = QComboBox()
-        self.model_combo.addItems(['ChatGPT', 'DeepSeek', 'Kimi', 'Ollama'])
+        self.model_combo.addItems(['ChatGPT', 'DeepSeek', 'Kimi', 'Ollama', 'Auto'])
         model_layout.addRow('选择模型:', self.model_combo)
         
         # API配置按钮
@@ -93,6 +149,12 @@ class CodeAuditGUI(QMainWindow):
         self.audit_btn.clicked.connect(self.start_audit)
         self.audit_btn.setMinimumHeight(40)
         
+        # 停止审计按钮
+        self.cancel_btn = QPushButton('停止审计')
+        self.cancel_btn.clicked.connect(self.cancel_audit)
+        self.cancel_btn.setMinimumHeight(40)
+        self.cancel_btn.setEnabled(False)
+        
         # 赞助作者按钮
         sponsor_btn = QPushButton('赞助作者')
         sponsor_btn.clicked.connect(self.show_sponsor)
@@ -103,6 +165,7 @@ class CodeAuditGUI(QMainWindow):
         control_layout.addWidget(browse_btn, 1)
         control_layout.addWidget(model_group, 1)
         control_layout.addWidget(self.audit_btn, 1)
+        control_layout.addWidget(self.cancel_btn, 1)
         control_layout.addWidget(sponsor_btn, 1)
         control_group.setLayout(control_layout)
         
@@ -112,27 +175,48 @@ class CodeAuditGUI(QMainWindow):
         # 创建结果显示区域
         results_tabs = QTabWidget()
         
-        # 审计结果标签页
-        self.audit_result_text = QTextEdit()
-        self.audit_result_text.setReadOnly(True)
-        results_tabs.addTab(self.audit_result_text, '审计结果')
+        # 审计结果标签页：审计过程中逐批追加的静态审计发现
+        self.audit_model = FindingTableModel(self)
+        results_tabs.addTab(self.create_finding_view(self.audit_model), '审计结果')
         
         # AI分析结果标签页
         self.ai_analysis_text = QTextEdit()
         self.ai_analysis_text.setReadOnly(True)
         results_tabs.addTab(self.ai_analysis_text, 'AI分析')
         
-        # 综合报告标签页
-        self.final_report_text = QTextEdit()
-        self.final_report_text.setReadOnly(True)
-        results_tabs.addTab(self.final_report_text, '综合报告')
+        # 综合报告标签页：去重合并并按风险排序后的发现
+        self.report_model = FindingTableModel(self)
+        self.report_summary = QLabel()
+        self.report_summary.setWordWrap(True)
+        report_widget = QWidget()
+        report_layout = QVBoxLayout(report_widget)
+        report_layout.setContentsMargins(0, 0, 0, 0)
+        report_layout.addWidget(self.report_summary)
+        report_layout.addWidget(self.create_finding_view(self.report_model))
+        results_tabs.addTab(report_widget, '综合报告')
+        self.results_tabs = results_tabs
+        self.report_tab = report_widget
+
+        # 批量任务标签页：多个代码目录排队，由工作进程并行审计
+        results_tabs.addTab(self.create_job_view(), '批量任务')
         
         # 日志显示区域
         log_group = QGroupBox('日志')
         log_layout = QVBoxLayout()
         self.log_text = QTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.document().setMaximumBlockCount(5000)
         log_layout.addWidget(self.log_text)
+        # 日志先写入缓冲区，由定时器批量刷新到界面
+        self.log_buffer = []
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(200)
+        self.log_timer.timeout.connect(self.flush_log)
+        # AI流式输出同样按代码块缓冲，由同一个定时器刷新
+        self.partial_buffers = {}
+        self.partial_cursors = {}
+        self.log_timer.timeout.connect(self.flush_ai_partial)
+        self.log_timer.start()
         log_group.setLayout(log_layout)
         
         # 添加到分割器
@@ -146,7 +230,194 @@ class CodeAuditGUI(QMainWindow):
         
         # 设置状态栏
         self.statusBar().showMessage('就绪')
-        
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(240)
+        self.progress_bar.setVisible(False)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
+    def create_finding_view(self, model):
+        """创建带过滤栏、可排序表格和详情面板的发现视图"""
+        proxy = FindingFilterProxy(self)
+        proxy.setSourceModel(model)
+
+        filter_edit = QLineEdit()
+        filter_edit.setPlaceholderText('按文件、类别或标题过滤')
+        filter_edit.textChanged.connect(proxy.set_text)
+        severity_combo = QComboBox()
+        severities = [('全部', None), ('低危及以上', 'low'), ('中危及以上', 'medium'), ('仅高危', 'high')]
+        for label, severity in severities:
+            severity_combo.addItem(label, severity)
+        severity_combo.currentIndexChanged.connect(
+            lambda i: proxy.set_min_severity(severity_combo.itemData(i)))
+        count_label = QLabel()
+
+        def update_count(*args):
+            count_label.setText(f'{proxy.rowCount()}/{model.rowCount()} 条')
+        for signal in (proxy.rowsInserted, proxy.rowsRemoved, proxy.modelReset, proxy.layoutChanged):
+            signal.connect(update_count)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(filter_edit, 3)
+        filter_layout.addWidget(severity_combo, 1)
+        filter_layout.addWidget(count_label)
+
+        view = QTableView()
+        view.setModel(proxy)
+        # 默认按审计产出顺序显示，点击表头时才排序
+        view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        view.setSortingEnabled(True)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        view.setSelectionMode(QAbstractItemView.SingleSelection)
+        view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        view.verticalHeader().setVisible(False)
+        # 固定行高，避免按内容逐行计算尺寸
+        view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        view.verticalHeader().setDefaultSectionSize(22)
+        view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        view.horizontalHeader().setStretchLastSection(True)
+
+        detail = QTextEdit()
+        detail.setReadOnly(True)
+
+        def show_detail(current, previous):
+            # 详情只在选中时渲染
+            if current.isValid():
+                detail.setHtml(render_detail(model.row_data(proxy.mapToSource(current).row())))
+            else:
+                detail.clear()
+        view.selectionModel().currentRowChanged.connect(show_detail)
+
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(view)
+        splitter.addWidget(detail)
+        splitter.setSizes([400, 150])
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(filter_layout)
+        layout.addWidget(splitter)
+        update_count()
+        return widget
+        
+    def create_job_view(self):
+        """创建批量任务视图：把控制面板中的代码路径（每行一个）提交到任务队列，启动工作进程并查看队列状态"""
+        self.job_priority = QSpinBox()
+        self.job_priority.setRange(-100, 100)
+        submit_btn = QPushButton('加入队列')
+        submit_btn.clicked.connect(self.submit_jobs)
+        self.job_workers = QSpinBox()
+        # AI分析以等待网络为主，工作进程数可以超过CPU核数
+        self.job_workers.setRange(1, 64)
+        self.job_workers.setValue(2)
+        self.scheduler_btn = QPushButton('启动调度器')
+        self.scheduler_btn.clicked.connect(self.toggle_scheduler)
+        cancel_btn = QPushButton('取消选中任务')
+        cancel_btn.clicked.connect(self.cancel_jobs)
+
+        toolbar = QHBoxLayout()
+        toolbar.addWidget(QLabel('优先级:'))
+        toolbar.addWidget(self.job_priority)
+        toolbar.addWidget(submit_btn)
+        toolbar.addSpacing(20)
+        toolbar.addWidget(QLabel('工作进程:'))
+        toolbar.addWidget(self.job_workers)
+        toolbar.addWidget(self.scheduler_btn)
+        toolbar.addWidget(cancel_btn)
+        toolbar.addStretch(1)
+
+        self.job_stats = QLabel()
+        self.job_model = JobTableModel(self)
+        self.job_table = QTableView()
+        self.job_table.setModel(self.job_model)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.job_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.job_table.verticalHeader().setVisible(False)
+        self.job_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.job_table.horizontalHeader().setStretchLastSection(True)
+        # 双击已结束的任务在综合报告中查看其结果
+        self.job_table.doubleClicked.connect(self.open_job_report)
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(toolbar)
+        layout.addWidget(self.job_stats)
+        layout.addWidget(self.job_table)
+
+        self.job_timer = QTimer(self)
+        self.job_timer.setInterval(1000)
+        self.job_timer.timeout.connect(self.refresh_jobs)
+        self.job_timer.start()
+        self.refresh_jobs()
+        return widget
+
+    def submit_jobs(self):
+        """把控制面板中的每个代码路径作为一个任务加入队列"""
+        paths = [line.strip() for line in self.path_edit.toPlainText().splitlines() if line.strip()]
+        missing = [path for path in paths if not os.path.isdir(path)]
+        if not paths or missing:
+            QMessageBox.warning(self, '警告', f"代码路径不存在: {', '.join(missing)}" if missing else '请先选择代码路径')
+            return
+        model = self.model_combo.currentText().lower()
+        for path in paths:
+            job_id = self.job_queue.submit(path, model, self.job_priority.value())
+            self.log_message(f'已加入队列: #{job_id} {path}（{model}，优先级{self.job_priority.value()}）')
+        self.refresh_jobs()
+
+    def toggle_scheduler(self):
+        """启动或停止本机的工作进程，停止时运行中的任务放回队列"""
+        if self.scheduler is not None:
+            self.scheduler.close()
+            self.scheduler = None
+            self.scheduler_btn.setText('启动调度器')
+            self.job_workers.setEnabled(True)
+            self.log_message('调度器已停止，未完成的任务已放回队列')
+            return
+        self.scheduler = AuditScheduler(workers=self.job_workers.value())
+        self.scheduler.start()
+        self.scheduler_btn.setText('停止调度器')
+        self.job_workers.setEnabled(False)
+        self.log_message(f'调度器已启动，{self.job_workers.value()}个工作进程')
+
+    def cancel_jobs(self):
+        for index in self.job_table.selectionModel().selectedRows():
+            self.job_queue.cancel(self.job_model.row_data(index.row())['id'])
+        self.refresh_jobs()
+
+    def refresh_jobs(self):
+        """按任务队列的最新状态刷新表格和吞吐量统计，保持选中的任务"""
+        if self.scheduler is not None:
+            self.scheduler.check()
+        selected = {self.job_model.row_data(index.row())['id']
+                    for index in self.job_table.selectionModel().selectedRows()}
+        self.job_model.set_rows(self.job_queue.list_jobs())
+        for row, job in enumerate(self.job_model.rows):
+            if job['id'] in selected:
+                self.job_table.selectRow(row)
+        stats = self.scheduler.stats() if self.scheduler is not None else self.job_queue.stats()
+        text = (f"排队{stats['queued']}，运行中{stats['running']}，完成{stats['done']}，失败{stats['failed']}；"
+                f"最近5分钟 {stats['jobs_per_minute']}个任务/分钟，{stats['files_per_second']}个文件/秒")
+        if self.scheduler is not None:
+            text += f"；工作进程{stats['workers']}个"
+        self.job_stats.setText(text)
+
+    def open_job_report(self, index):
+        job = self.job_model.row_data(index.row())
+        report = self.job_queue.get_report(job['id'])
+        if report is None:
+            self.statusBar().showMessage(f"任务#{job['id']}尚未完成")
+            return
+        self.display_final_report(report)
+        self.results_tabs.setCurrentWidget(self.report_tab)
+        self.statusBar().showMessage(f"任务#{job['id']}：{job['target']}")
+
+    def closeEvent(self, event):
+        """退出时停止工作进程，运行中的任务放回队列"""
+        if self.scheduler is not None:
+            self.scheduler.close()
+        super().closeEvent(event)
+
     def browse_code_path(self):
         """打开文件对话框选择代码路径"""
         options = QFileDialog.Options()
@@ -171,37 +442,103 @@ class CodeAuditGUI(QMainWindow):
         # 更新状态
         self.statusBar().showMessage('正在审计...')
         self.audit_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(True)
         self.log_message(f'开始审计，使用模型: {selected_model}')
         
         # 清空结果区域
-        self.audit_result_text.clear()
+        self.audit_model.clear()
         self.ai_analysis_text.clear()
-        self.final_report_text.clear()
+        self.report_model.clear()
+        self.report_summary.clear()
+        self.partial_buffers = {}
+        self.partial_cursors = {}
         
         # 创建并启动审计线程
-        self.audit_thread = AuditThread(self.core_engine, code_path)
+        self.audit_thread = AuditThread(self.core_engine, code_path, selected_model.lower())
+        self.audit_thread.ai_partial.connect(self.handle_ai_partial)
+        self.audit_thread.findings_batch.connect(self.audit_model.append_rows)
         self.audit_thread.audit_complete.connect(self.handle_audit_complete)
         self.audit_thread.audit_error.connect(self.handle_audit_error)
+        self.audit_thread.audit_interrupted.connect(self.handle_audit_interrupted)
+        self.audit_thread.progress.connect(self.handle_progress)
         self.audit_thread.start()
     
     def handle_audit_complete(self, result):
-        """处理审计完成信号"""
-        # 在实际应用中，这里需要根据result的结构来展示结果
+        """处理审计完成信号，result为数据分析模块生成的综合报告"""
         self.log_message('审计完成')
-        
-        # 示例：假设result包含audit_result、analysis_result和final_report
-        if 'audit_result' in result:
-            self.display_audit_result(result['audit_result'])
-        
-        if 'analysis_result' in result:
-            self.display_ai_analysis(result['analysis_result'])
-        
-        if 'final_report' in result:
-            self.display_final_report(result['final_report'])
+        self.display_final_report(result)
         
         # 恢复状态
         self.statusBar().showMessage('审计完成')
+        self.reset_audit_controls()
+
+    def cancel_audit(self):
+        """请求停止正在进行的审计"""
+        self.cancel_btn.setEnabled(False)
+        self.statusBar().showMessage('正在停止审计...')
+        self.log_message('正在停止审计，已完成的结果会保留')
+        self.audit_thread.cancel()
+
+    def handle_audit_interrupted(self, partial_report, message, cancelled):
+        """审计被取消或中途失败时仍然显示已完成部分的结果"""
+        self.display_final_report(partial_report)
+        summary = partial_report.get('summary', {})
+        self.log_message(f"{message}，已保留{summary.get('files', 0)}个文件的结果")
+        self.statusBar().showMessage('审计已取消' if cancelled else '审计失败（已保留部分结果）')
+        self.reset_audit_controls()
+        if not cancelled:
+            QMessageBox.critical(self, '错误', f'审计过程中发生错误:\n{message}\n\n已完成部分的结果已显示在综合报告中')
+
+    def handle_progress(self, event):
+        """显示各阶段进度"""
+        percent = event.get('percent')
+        if percent is None:
+            self.progress_bar.setRange(0, 0)
+        else:
+            self.progress_bar.setRange(0, 1000)
+            self.progress_bar.setValue(int(percent * 1000))
+        text = f"已扫描{event['files_scanned']}个文件（复用{event['files_reused']}），已审计{event['files_audited']}个"
+        if event.get('chunks_sent'):
+            text += f"；AI代码块 {event['chunks_done']}/{event['chunks_sent']}，已用{event['tokens_used']} tokens"
+        if event.get('eta') is not None:
+            minutes, seconds = divmod(int(event['eta']), 60)
+            text += f'；预计剩余 {minutes}:{seconds:02d}'
+        if not self.audit_thread.cancel_event.is_set():
+            # 停止过程中保留“正在停止审计”的提示
+            self.statusBar().showMessage(text)
+
+    def reset_audit_controls(self):
         self.audit_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
+        self.progress_bar.setVisible(False)
+    
+    def handle_ai_partial(self, chunk_id, text):
+        """处理AI流式输出，按代码块缓冲，实际显示由定时器批量刷新"""
+        if not self.partial_buffers and not self.partial_cursors:
+            self.statusBar().showMessage('正在接收AI分析...')
+        self.partial_buffers.setdefault(chunk_id, []).append(text)
+
+    def flush_ai_partial(self):
+        """把缓冲的流式输出追加到各代码块自己的段落，多个代码块并发输出时互不穿插"""
+        if not self.partial_buffers:
+            return
+        buffers, self.partial_buffers = self.partial_buffers, {}
+        document = self.ai_analysis_text.document()
+        for chunk_id, texts in buffers.items():
+            cursor = self.partial_cursors.get(chunk_id)
+            if cursor is None:
+                # 新代码块的段落加在末尾：标题、正文插入点和段落结尾的空行。
+                # 插入点之后保留空行，后续段落的标题插在空行之后，不会移动本段落的插入点
+                cursor = QTextCursor(document)
+                cursor.movePosition(QTextCursor.End)
+                cursor.insertText(f'===== {chunk_id} =====\n')
+                position = cursor.position()
+                cursor.insertText('\n\n')
+                cursor.setPosition(position)
+                self.partial_cursors[chunk_id] = cursor
+            cursor.insertText(''.join(texts))
     
     def handle_audit_error(self, error_msg):
         """处理审计错误信号"""
@@ -210,47 +547,32 @@ class CodeAuditGUI(QMainWindow):
         
         # 恢复状态
         self.statusBar().showMessage('审计失败')
-        self.audit_btn.setEnabled(True)
-    
-    def display_audit_result(self, audit_result):
-        """显示代码审计结果"""
-        # 这里需要根据实际的audit_result结构来格式化显示
-        self.audit_result_text.setHtml(self.format_result_as_html(audit_result, '代码审计结果'))
-    
-    def display_ai_analysis(self, analysis_result):
-        """显示AI分析结果"""
-        # 这里需要根据实际的analysis_result结构来格式化显示
-        self.ai_analysis_text.setHtml(self.format_result_as_html(analysis_result, 'AI分析结果'))
+        self.reset_audit_controls()
     
     def display_final_report(self, final_report):
         """显示综合报告"""
-        # 这里需要根据实际的final_report结构来格式化显示
-        self.final_report_text.setHtml(self.format_result_as_html(final_report, '综合分析报告'))
-    
-    def format_result_as_html(self, result, title):
-        """将结果格式化为HTML显示"""
-        html = f"<h2>{title}</h2>"
-        
-        if not result:  # 如果结果为空
-            return html + "<p>无数据</p>"
-        
-        # 这里需要根据实际的result结构来格式化
-        # 示例实现
-        html += "<table border='1' cellspacing='0' cellpadding='5' width='100%'>"
-        
-        for key, value in result.items():
-            html += f"<tr><td><b>{key}</b></td><td>{value}</td></tr>"
-        
-        html += "</table>"
-        return html
+        summary = final_report.get('summary', {})
+        severities = summary.get('by_severity', {})
+        self.report_summary.setText(
+            f"共{summary.get('files', 0)}个文件，原始发现{summary.get('raw_findings', 0)}条，"
+            f"去重合并后{summary.get('findings', 0)}条（高危{severities.get('high', 0)}、"
+            f"中危{severities.get('medium', 0)}、低危{severities.get('low', 0)}），"
+            f"其中{summary.get('agreements', 0)}条同时被静态规则和AI发现；"
+            f"{summary.get('unlocated', 0)}条AI意见无法定位到文件")
+        self.report_model.set_rows(final_report.get('findings', []))
     
     def log_message(self, message):
-        """在日志区域添加消息"""
-        self.log_text.append(message)
-        # 滚动到底部
-        cursor = self.log_text.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        self.log_text.setTextCursor(cursor)
+        """在日志区域添加消息，实际显示由定时器批量刷新"""
+        self.log_buffer.append(message)
+
+    def flush_log(self):
+        """把缓冲的日志一次性追加到日志区域并滚动到底部"""
+        if not self.log_buffer:
+            return
+        lines, self.log_buffer = self.log_buffer, []
+        self.log_text.append('\n'.join(lines))
+        scroll_bar = self.log_text.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
 
     def show_api_config(self):
         """显示API配置对话框"""
@@ -336,8 +658,9 @@ class CodeAuditGUI(QMainWindow):
         self.ollama_base.setText(ollama_config.get('api_base', 'http://localhost:11434'))
     
     def save_api_config(self, dialog):
-        """保存API配置"""
-        config = {
+        """保存API配置，保留配置文件中的超时、重试等其他字段"""
+        config = dict(self.core_engine.ai_models.config)
+        updates = {
             'chatgpt': {
                 'api_key': self.chatgpt_key.text(),
                 'api_base': self.chatgpt_base.text()
@@ -354,6 +677,8 @@ class CodeAuditGUI(QMainWindow):
                 'api_base': self.ollama_base.text()
             }
         }
+        for model, values in updates.items():
+            config[model] = {**config.get(model, {}), **values}
         
         self.core_engine.ai_models.save_config(config)
         self.log_message('API配置已保存')
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Any, List, Optional
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.dirname(__file__), 'audit_jobs.db')
+
+# 任务状态：排队、运行中、完成、失败、已取消
+JOB_STATUSES = ['queued', 'running', 'done', 'failed', 'cancelled']
+# 工作进程意外退出后任务最多重新排队的次数
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class JobQueue:
+    """
+    基于SQLite的审计任务队列，多个进程各自打开同一个数据库文件：
+    领取任务在IMMEDIATE事务中完成，同一任务只会被一个工作进程领取；
+    运行中的任务定期写入心跳，心跳超时（工作进程崩溃）的任务重新排队，由其他进程继续审计
+    """
+
+    def __init__(self, db_path: str = DEFAULT_QUEUE_PATH, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        """
+        Args:
+            db_path: 队列文件路径
+            max_attempts: 任务因工作进程退出而中断的最多次数，超过后标记为失败
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # 自动提交模式，领取任务时显式开启IMMEDIATE事务
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                target TEXT NOT NULL,
+                model TEXT,
+                options TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                progress TEXT,
+                summary TEXT,
+                report BLOB,
+                error TEXT,
+                files INTEGER NOT NULL DEFAULT 0,
+                submitted_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+
+    def submit(self, target: str, model: Optional[str] = None, priority: int = 0,
+               options: Optional[Dict[str, Any]] = None) -> int:
+        """
+        提交审计任务
+        Args:
+            target: 代码目录
+            model: AI服务商，None表示只做静态审计
+            priority: 优先级，数值大的先审计，相同优先级按提交顺序
+            options: 传给CoreEngine.run_audit的其他参数（max_requests、max_tokens、min_risk）及diff（版本范围）
+        Returns:
+            任务id
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT INTO jobs (target, model, options, priority, status, submitted_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(target), model, json.dumps(options or {}, ensure_ascii=False), priority,
+                 'queued', time.time())
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """领取优先级最高的排队任务，没有时返回None"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY priority DESC, id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ?, "
+                        "progress = NULL, error = NULL WHERE id = ?",
+                        (worker, now, now, row[0])
+                    )
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def heartbeat(self, job_id: int, progress: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        更新运行中任务的心跳和进度
+        Returns:
+            任务是否被请求取消
+        """
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET heartbeat_at = ?, progress = COALESCE(?, progress) WHERE id = ? AND status = 'running'",
+                (time.time(), json.dumps(progress, ensure_ascii=False) if progress else None, job_id)
+            )
+            row = self.conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, job_id: int, report: Dict[str, Any], status: str = 'done', error: Optional[str] = None):
+        """
+        保存任务结果
+        Args:
+            job_id: 任务id
+            report: 综合报告（取消或失败时为已完成部分的报告）
+            status: done、failed或cancelled
+            error: 失败原因
+        """
+        summary = report.get('summary', {})
+        with self.lock:
+            self.conn.execute(
+                'UPDATE jobs SET status = ?, summary = ?, report = ?, error = ?, files = ?, finished_at = ? '
+                'WHERE id = ?',
+                (status, json.dumps(summary, ensure_ascii=False),
+                 zlib.compress(json.dumps(report, ensure_ascii=False).encode('utf-8')), error,
+                 summary.get('files', 0), time.time(), job_id)
+            )
+
+    def fail(self, job_id: int, error: str):
+        """任务在生成报告前失败"""
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                              (error, time.time(), job_id))
+
+    def release(self, job_id: int):
+        """调度器停止时把未完成的任务放回队列，下次启动后继续审计（已完成的文件由审计清单复用）"""
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE id = ? AND status = 'running'",
+                              (job_id,))
+
+    def cancel(self, job_id: int) -> bool:
+        """取消任务：排队中的直接取消，运行中的由工作进程在下次心跳时停止，返回任务是否仍未结束"""
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                              (time.time(), job_id))
+            cursor = self.conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                                       (job_id,))
+        return cursor.rowcount > 0
+
+    def recover(self, stale_after: float = 60.0, worker: Optional[str] = None) -> int:
+        """
+        重新排队工作进程已退出的任务
+        Args:
+            stale_after: 心跳超过该秒数的运行中任务视为工作进程已退出
+            worker: 指定时只处理该工作进程的任务（调度器发现其进程已退出），不检查心跳
+        Returns:
+            重新排队的任务数
+        """
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                if worker is not None:
+                    rows = self.conn.execute("SELECT id, attempts FROM jobs WHERE status = 'running' AND worker = ?",
+                                             (worker,)).fetchall()
+                else:
+                    rows = self.conn.execute("SELECT id, attempts FROM jobs WHERE status = 'running' AND "
+                                             "heartbeat_at < ?", (time.time() - stale_after,)).fetchall()
+                for job_id, attempts in rows:
+                    if attempts + 1 >= self.max_attempts:
+                        self.conn.execute("UPDATE jobs SET status = 'failed', attempts = ?, finished_at = ?, "
+                                          "error = ? WHERE id = ?",
+                                          (attempts + 1, time.time(), '工作进程多次意外退出', job_id))
+                    else:
+                        self.conn.execute("UPDATE jobs SET status = 'queued', attempts = ?, worker = NULL "
+                                          "WHERE id = ?", (attempts + 1, job_id))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        if rows:
+            self.logger.warning(f'Recovered {len(rows)} interrupted jobs')
+        return len(rows)
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """读取任务信息（不含报告）"""
+        rows = self._select('WHERE id = ?', (job_id,))
+        return rows[0] if rows else None
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+        """按状态列出任务，运行中和排队的任务在前"""
+        where, params = ('WHERE status = ?', (status,)) if status else ('', ())
+        order = ("ORDER BY CASE status WHEN 'running' THEN 0 WHEN 'queued' THEN 1 ELSE 2 END, "
+                 "CASE WHEN status = 'queued' THEN -priority ELSE 0 END, id DESC")
+        return self._select(f'{where} {order} LIMIT ?', params + (limit,))
+
+    def get_report(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """读取任务的综合报告，尚未完成时返回None"""
+        with self.lock:
+            row = self.conn.execute('SELECT report FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row and row[0] else None
+
+    def stats(self, window: float = 300.0) -> Dict[str, Any]:
+        """
+        队列统计，用于评估机器规模
+        Args:
+            window: 吞吐量的统计窗口（秒）
+        Returns:
+            各状态的任务数、队列深度（排队+运行中），以及窗口内完成的任务数、每分钟任务数、每秒文件数
+            和任务的平均等待、运行秒数
+        """
+        since = time.time() - window
+        with self.lock:
+            counts = dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            finished, files, wait, run = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(files), 0), AVG(started_at - submitted_at), "
+                "AVG(finished_at - started_at) FROM jobs WHERE status = 'done' AND finished_at >= ?", (since,)
+            ).fetchone()
+        stats = {status: counts.get(status, 0) for status in JOB_STATUSES}
+        stats.update({
+            'depth': stats['queued'] + stats['running'],
+            'window': window,
+            'finished': finished,
+            'jobs_per_minute': round(finished * 60.0 / window, 2),
+            'files_per_second': round(files / window, 2),
+            'avg_wait': round(wait or 0.0, 2),
+            'avg_run': round(run or 0.0, 2)
+        })
+        return stats
+
+    def _select(self, clause: str, params: tuple) -> List[Dict[str, Any]]:
+        columns = ['id', 'target', 'model', 'options', 'priority', 'status', 'attempts', 'cancel_requested',
+                   'worker', 'progress', 'summary', 'error', 'files', 'submitted_at', 'started_at',
+                   'heartbeat_at', 'finished_at']
+        with self.lock:
+            rows = self.conn.execute(f'SELECT {", ".join(columns)} FROM jobs {clause}', params).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(zip(columns, row))
+            for key in ('options', 'progress', 'summary'):
+                job[key] = json.loads(job[key]) if job[key] else ({} if key == 'options' else None)
+            job['cancel_requested'] = bool(job['cancel_requested'])
+            jobs.append(job)
+        return jobs
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(__file__), 'audit_manifest.db')
+
+# 累积多少条写入后提交一次事务
+COMMIT_INTERVAL = 200
+
+
+def content_hash(content) -> str:
+    """计算文件内容的SHA-256"""
+    if isinstance(content, str):
+        content = content.encode('utf-8', errors='replace')
+    return hashlib.sha256(content).hexdigest()
+
+
+class AuditManifest:
+    """
+    基于SQLite的审计清单，记录每个文件的大小、修改时间、内容哈希及其审计结果，
+    重复审计时未变化的文件直接复用已保存的结果
+    """
+
+    def __init__(self, db_path: str = DEFAULT_MANIFEST_PATH, commit_interval: int = COMMIT_INTERVAL):
+        """
+        Args:
+            db_path: 清单文件路径
+            commit_interval: 每写入多少个文件提交一次；多个进程共用清单时设为1，避免长时间占用写锁
+        """
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path
+        self.commit_interval = max(1, commit_interval)
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT NOT NULL,
+                rules_version TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                audit_result TEXT,
+                analysis_result TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (root, path)
+            )
+        ''')
+        self.conn.commit()
+
+    def lookup(self, root: str, record: Dict[str, Any], rules_version: str,
+               model_version: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        查找文件的已保存结果
+        Args:
+            root: 代码根目录
+            record: 爬虫产出的文件记录
+            rules_version: 当前规则集版本
+            model_version: 当前AI模型版本
+        Returns:
+            未变化时返回(audit_result, analysis_result)，否则返回None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT size, mtime, hash, rules_version, model_version, audit_result, analysis_result '
+                'FROM files WHERE root = ? AND path = ?',
+                (root, record['path'])
+            ).fetchone()
+        if row is None:
+            return None
+        size, mtime, stored_hash, stored_rules, stored_model, audit_json, analysis_json = row
+        if stored_rules != rules_version or stored_model != model_version:
+            return None
+        if size != record['size']:
+            return None
+        current_hash = record.get('hash')
+        if current_hash is None:
+            # 大小和修改时间都未变化时信任旧哈希，避免重新计算
+            if mtime == record['mtime']:
+                current_hash = stored_hash
+            else:
+                current_hash = content_hash(record['content'])
+        if current_hash != stored_hash:
+            return None
+        return json.loads(audit_json), json.loads(analysis_json)
+
+    def update(self, root: str, record: Dict[str, Any], audit_result: Dict[str, Any],
+               analysis_result: Dict[str, Any], rules_version: str, model_version: str):
+        """保存文件的最新审计结果"""
+        file_hash = record.get('hash') or content_hash(record['content'])
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (root, record['path'], record['size'], record['mtime'], file_hash,
+                 rules_version, model_version,
+                 json.dumps(audit_result, ensure_ascii=False),
+                 json.dumps(analysis_result, ensure_ascii=False),
+                 time.time())
+            )
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_interval:
+                self.conn.commit()
+                self.pending_writes = 0
+
+    def prune(self, root: str, seen_paths: Iterable[str]) -> int:
+        """删除本次遍历中已不存在的文件记录"""
+        seen = set(seen_paths)
+        with self.lock:
+            stale = [(root, path) for (path,) in
+                     self.conn.execute('SELECT path FROM files WHERE root = ?', (root,))
+                     if path not in seen]
+            self.conn.executemany('DELETE FROM files WHERE root = ? AND path = ?', stale)
+            self.conn.commit()
+            self.pending_writes = 0
+        return len(stale)
+
+    def invalidate(self, root: Optional[str] = None, rules_version: Optional[str] = None,
+                   model_version: Optional[str] = None) -> int:
+        """
+        使清单记录失效
+        Args:
+            root: 只处理该代码根目录，None表示全部
+            rules_version: 删除规则集版本与之不同的记录
+            model_version: 删除AI模型版本与之不同的记录
+        Returns:
+            删除的记录数；版本参数都为None时删除范围内的全部记录
+        """
+        clauses, params = [], []
+        if root is not None:
+            clauses.append('root = ?')
+            params.append(root)
+        mismatch = []
+        if rules_version is not None:
+            mismatch.append('rules_version != ?')
+            params.append(rules_version)
+        if model_version is not None:
+            mismatch.append('model_version != ?')
+            params.append(model_version)
+        if mismatch:
+            clauses.append('(' + ' OR '.join(mismatch) + ')')
+        sql = 'DELETE FROM files'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        with self.lock:
+            deleted = self.conn.execute(sql, params).rowcount
+            self.conn.commit()
+            self.pending_writes = 0
+        self.logger.info(f'Invalidated {deleted} manifest entries')
+        return deleted
+
+    def commit(self):
+        """提交尚未写入磁盘的记录"""
+        with self.lock:
+            self.conn.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
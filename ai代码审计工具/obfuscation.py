@@ -0,0 +1,206 @@
+import importlib.util
+import logging
+import os
+from typing import Dict, Any, List
+
+# numpy为可选依赖，缺失时跳过混淆分析；导入耗时较长，只在第一次分析时导入，不拖慢启动
+np = None
+
+# 熵值按block_size字节分块统计，窗口由相邻的两个分块组成
+BLOCK_SIZE = 128
+WINDOW_SIZE = BLOCK_SIZE * 2
+
+# 每次处理的分块数，限制直方图矩阵占用的内存
+BLOCKS_PER_SEGMENT = 4096
+
+# 字符类别
+CLASS_BASE64 = 0
+CLASS_HEX = 1
+CLASS_WHITESPACE = 2
+CLASS_BINARY = 3
+CLASS_OTHER = 4
+NUM_CLASSES = 5
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def _build_tables():
+    base64 = np.zeros(256, dtype=bool)
+    for c in b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=':
+        base64[c] = True
+    hex_digits = np.zeros(256, dtype=bool)
+    for c in b'0123456789abcdefABCDEF':
+        hex_digits[c] = True
+    classes = np.full(256, CLASS_OTHER, dtype=np.uint8)
+    classes[base64] = CLASS_BASE64
+    classes[hex_digits] = CLASS_HEX
+    for c in b' \t\r\n':
+        classes[c] = CLASS_WHITESPACE
+    for c in list(range(0, 9)) + [11, 12] + list(range(14, 32)) + [127]:
+        classes[c] = CLASS_BINARY
+    return base64, hex_digits, classes
+
+
+class ObfuscationAnalyzer:
+    """
+    基于NumPy的混淆和加密载荷检测：对内存映射的文件字节批量计算滑动窗口香农熵、
+    字符类别分布和行长统计，定位高熵区域、超长行和base64/十六进制长串
+    """
+
+    def __init__(self, entropy_threshold: float = 5.5, min_region: int = 512, min_encoded_run: int = 256,
+                 long_line: int = 2000, min_size: int = 1024):
+        """
+        Args:
+            entropy_threshold: 高熵窗口的阈值（比特/字节），普通源码通常在4.5-5.0之间
+            min_region: 高熵区域的最小长度（字节）
+            min_encoded_run: base64/十六进制连续串的最小长度
+            long_line: 超长行的判定长度
+            min_size: 小于该大小的文件不做分析
+        """
+        self.logger = logging.getLogger(__name__)
+        self.entropy_threshold = entropy_threshold
+        self.min_region = min_region
+        self.min_encoded_run = min_encoded_run
+        self.long_line = long_line
+        self.min_size = min_size
+        self.available = importlib.util.find_spec('numpy') is not None
+        self.class_table = None
+        if not self.available:
+            self.logger.warning('numpy is not installed, obfuscation analysis is disabled')
+
+    def _prepare(self):
+        """第一次分析时导入numpy并构造字符类别表"""
+        if self.class_table is None:
+            _import_numpy()
+            self.base64_table, self.hex_table, self.class_table = _build_tables()
+
+    def analyze_file(self, abs_path: str) -> Dict[str, Any]:
+        """通过内存映射分析文件，避免把大文件整体读入Python对象"""
+        if not self.available or os.path.getsize(abs_path) < self.min_size:
+            return {'findings': [], 'score': 0.0}
+        self._prepare()
+        data = np.memmap(abs_path, dtype=np.uint8, mode='r')
+        try:
+            return self._analyze(data)
+        finally:
+            del data
+
+    def analyze_bytes(self, content) -> Dict[str, Any]:
+        """分析内存中的文件内容"""
+        if isinstance(content, str):
+            content = content.encode('utf-8', errors='replace')
+        if not self.available or len(content) < self.min_size:
+            return {'findings': [], 'score': 0.0}
+        self._prepare()
+        return self._analyze(np.frombuffer(content, dtype=np.uint8))
+
+    def _analyze(self, data) -> Dict[str, Any]:
+        newlines = np.flatnonzero(data == 10)
+        findings = []
+
+        # 1. 滑动窗口熵和字符类别分布
+        entropy, class_ratio = self._window_stats(data)
+        high = entropy >= self.entropy_threshold
+        for start, end in self._runs(high):
+            offset = start * BLOCK_SIZE
+            length = min(len(data), end * BLOCK_SIZE + BLOCK_SIZE) - offset
+            if length < self.min_region:
+                continue
+            region_entropy = float(entropy[start:end].mean())
+            binary = float(class_ratio[start:end, CLASS_BINARY].mean())
+            findings.append(self._finding(
+                'obfuscation-high-entropy', '高熵数据区域', 'medium',
+                f'平均熵{region_entropy:.2f}比特/字节，疑似加密、压缩或打包的载荷'
+                + ('，包含较多不可打印字符' if binary > 0.05 else ''),
+                data, newlines, offset, length, region_entropy / 8.0))
+
+        # 2. base64和十六进制长串，十六进制字符是base64字符的子集，纯十六进制的串只按十六进制报告
+        for table, rule_id, name in ((self.base64_table, 'obfuscation-base64-run', 'base64长串'),
+                                     (self.hex_table, 'obfuscation-hex-run', '十六进制长串')):
+            for start, end in self._runs(table[data]):
+                if end - start < self.min_encoded_run:
+                    continue
+                if table is self.base64_table and self.hex_table[data[start:end]].all():
+                    continue
+                findings.append(self._finding(
+                    rule_id, name, 'medium', f'连续{end - start}个编码字符，疑似内嵌的编码载荷',
+                    data, newlines, int(start), int(end - start), min(1.0, (end - start) / 4096)))
+
+        # 3. 行长统计
+        bounds = np.concatenate(([-1], newlines, [len(data)]))
+        line_lengths = np.diff(bounds) - 1
+        long_lines = np.flatnonzero(line_lengths >= self.long_line)
+        for index in long_lines[:20]:
+            offset = int(bounds[index] + 1)
+            length = int(line_lengths[index])
+            findings.append(self._finding(
+                'obfuscation-long-line', '超长代码行', 'low', f'单行长度{length}字符，可能是压缩或混淆后的代码',
+                data, newlines, offset, length, min(1.0, length / 20000)))
+
+        findings.sort(key=lambda f: (f['offset'], -f['score']))
+        stats = {
+            'max_entropy': float(entropy.max()) if len(entropy) else 0.0,
+            'high_entropy_ratio': float(high.mean()) if len(high) else 0.0,
+            'max_line_length': int(line_lengths.max()) if len(line_lengths) else 0,
+            'long_lines': int(len(long_lines))
+        }
+        score = max([f['score'] for f in findings], default=0.0)
+        return {'findings': findings, 'score': round(score, 3), 'stats': stats}
+
+    def _window_stats(self, data):
+        """按分块统计字节直方图，相邻两块相加得到窗口直方图，再计算熵和字符类别占比"""
+        num_blocks = len(data) // BLOCK_SIZE
+        if num_blocks < 2:
+            return np.zeros(0), np.zeros((0, NUM_CLASSES))
+        entropies = []
+        ratios = []
+        # 分段处理时每段多带一个分块，保证窗口跨段连续
+        for first in range(0, num_blocks - 1, BLOCKS_PER_SEGMENT):
+            last = min(num_blocks, first + BLOCKS_PER_SEGMENT + 1)
+            blocks = np.asarray(data[first * BLOCK_SIZE:last * BLOCK_SIZE]).reshape(-1, BLOCK_SIZE)
+            rows = np.repeat(np.arange(len(blocks)), BLOCK_SIZE)
+
+            counts = np.bincount(rows * 256 + blocks.ravel(), minlength=len(blocks) * 256)
+            counts = counts.reshape(len(blocks), 256)
+            window = counts[:-1] + counts[1:]
+            p = window / WINDOW_SIZE
+            with np.errstate(divide='ignore', invalid='ignore'):
+                entropies.append(-np.where(window > 0, p * np.log2(p), 0.0).sum(axis=1))
+
+            classes = self.class_table[blocks.ravel()]
+            class_counts = np.bincount(rows * NUM_CLASSES + classes, minlength=len(blocks) * NUM_CLASSES)
+            class_counts = class_counts.reshape(len(blocks), NUM_CLASSES)
+            ratios.append((class_counts[:-1] + class_counts[1:]) / WINDOW_SIZE)
+        return np.concatenate(entropies), np.concatenate(ratios)
+
+    @staticmethod
+    def _runs(mask) -> List[tuple]:
+        """返回布尔序列中连续True区间的(起点, 终点)列表"""
+        if len(mask) == 0:
+            return []
+        padded = np.concatenate(([False], np.asarray(mask, dtype=bool), [False]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+    @staticmethod
+    def _finding(rule_id: str, name: str, severity: str, description: str, data, newlines,
+                 offset: int, length: int, score: float) -> Dict[str, Any]:
+        line = int(np.searchsorted(newlines, offset)) + 1
+        snippet = bytes(data[offset:offset + 80]).decode('utf-8', errors='replace')
+        return {
+            'rule_id': rule_id,
+            'name': name,
+            'severity': severity,
+            'category': 'obfuscation',
+            'description': description,
+            'line': line,
+            'offset': int(offset),
+            'length': int(length),
+            'score': round(float(score), 3),
+            'match': snippet
+        }
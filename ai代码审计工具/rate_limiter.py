@@ -0,0 +1,131 @@
+import multiprocessing
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    令牌桶限速器，按预约方式工作：reserve立即扣除令牌并返回需要等待的秒数，
+    同步代码用time.sleep等待，异步代码用asyncio.sleep等待，两者可以共享同一个桶
+    """
+
+    def __init__(self, rate_per_minute: Optional[float], capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_minute: 每分钟补充的令牌数，0或None表示不限速
+            capacity: 桶容量，默认等于一分钟的补充量
+        """
+        self.rate = (rate_per_minute or 0) / 60.0
+        self.capacity = capacity if capacity is not None else (rate_per_minute or 0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def reserve(self, amount: float = 1) -> float:
+        """预约amount个令牌，返回调用方需要等待的秒数"""
+        if self.unlimited:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def adjust(self, delta: float):
+        """按实际用量修正预约量，delta为正表示多用了令牌"""
+        if self.unlimited or not delta:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    跨进程共享的令牌桶，令牌数和更新时间保存在共享内存中。
+    由父进程创建后作为参数传给工作进程，多个进程的请求共同受同一个服务商限额约束
+    """
+
+    def __init__(self, rate_per_minute: Optional[float], capacity: Optional[float] = None, context=None):
+        """
+        Args:
+            rate_per_minute: 每分钟补充的令牌数，0或None表示不限速
+            capacity: 桶容量，默认等于一分钟的补充量
+            context: multiprocessing上下文，需与创建工作进程的上下文一致
+        """
+        self.state = (context or multiprocessing).Array('d', 2)
+        super().__init__(rate_per_minute, capacity)
+        # 使用共享内存自带的进程锁；time.monotonic在同一台机器的不同进程间可比
+        self.lock = self.state.get_lock()
+
+    @property
+    def tokens(self) -> float:
+        return self.state[0]
+
+    @tokens.setter
+    def tokens(self, value: float):
+        self.state[0] = value
+
+    @property
+    def updated_at(self) -> float:
+        return self.state[1]
+
+    @updated_at.setter
+    def updated_at(self, value: float):
+        self.state[1] = value
+
+
+class SharedSlots:
+    """
+    跨进程共享的并发名额（进行中请求数上限），按工作进程记录各自占用的名额数。
+    工作进程崩溃或被终止时不会释放名额，调度器回收该进程后调用reclaim归还，避免总并发逐渐降为0
+    """
+
+    def __init__(self, limit: int, owners: int, context=None):
+        """
+        Args:
+            limit: 所有进程合计的进行中请求数上限
+            owners: 工作进程数，每个进程占用数组中的一个位置
+            context: multiprocessing上下文，需与创建工作进程的上下文一致
+        """
+        context = context or multiprocessing
+        self.limit = limit
+        self.held = context.Array('i', owners)
+        self.condition = context.Condition(self.held.get_lock())
+        # 本进程在held中的位置，由工作进程通过bind设置
+        self.owner = 0
+
+    def bind(self, owner: int):
+        self.owner = owner
+
+    def __enter__(self):
+        with self.condition:
+            while sum(self.held.get_obj()) >= self.limit:
+                self.condition.wait()
+            self.held[self.owner] += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.condition:
+            self.held[self.owner] -= 1
+            self.condition.notify()
+
+    def reclaim(self, owner: int) -> int:
+        """归还已退出的工作进程占用的名额，返回归还的名额数"""
+        with self.condition:
+            count = self.held[owner]
+            self.held[owner] = 0
+            self.condition.notify_all()
+        return count
@@ -0,0 +1,187 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'response_cache.db')
+
+
+def normalize_code(code: str) -> str:
+    """统一换行符并去掉行尾空白，避免无意义的格式差异导致缓存未命中"""
+    code = code.replace('\r\n', '\n').replace('\r', '\n')
+    return '\n'.join(line.rstrip() for line in code.split('\n')).strip('\n')
+
+
+class ResponseCache:
+    """
+    AI分析结果的两级缓存：内存LRU + 带容量上限和过期时间的SQLite磁盘存储
+    """
+
+    def __init__(self, db_path: Optional[str] = DEFAULT_CACHE_PATH, memory_entries: int = 512,
+                 max_disk_bytes: int = 256 * 1024 * 1024, ttl: float = 30 * 24 * 3600):
+        """
+        Args:
+            db_path: 磁盘缓存文件路径，None表示只使用内存缓存
+            memory_entries: 内存LRU的最大条目数
+            max_disk_bytes: 磁盘缓存的容量上限（字节）
+            ttl: 缓存有效期（秒），0表示永不过期
+        """
+        self.logger = logging.getLogger(__name__)
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self.conn = None
+        self.disk_bytes = 0
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)')
+            self.conn.commit()
+            self.disk_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def make_key(provider: str, model_name: str, system_prompt: str, code: str) -> str:
+        """根据服务商、模型、系统提示词和规范化后的代码哈希生成缓存键"""
+        code_hash = hashlib.sha256(normalize_code(code).encode('utf-8')).hexdigest()
+        raw = json.dumps([provider, model_name, system_prompt, code_hash], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，依次查找内存和磁盘"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return copy.deepcopy(value)
+                del self.memory[key]
+
+            if self.conn is not None:
+                row = self.conn.execute(
+                    'SELECT value, size, created_at FROM responses WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    text, size, created_at = row
+                    if self._expired(created_at, now):
+                        self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                        self.conn.commit()
+                        self.disk_bytes -= size
+                    else:
+                        self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+                        self.conn.commit()
+                        value = json.loads(text)
+                        self._remember(key, value, created_at)
+                        self.stats['disk_hits'] += 1
+                        return copy.deepcopy(value)
+
+            self.stats['misses'] += 1
+            return None
+
+    def contains(self, key: str) -> bool:
+        """判断缓存中是否有未过期的条目，不更新命中统计和访问时间"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and not self._expired(entry[1], now):
+                return True
+            if self.conn is None:
+                return False
+            row = self.conn.execute('SELECT created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            return row is not None and not self._expired(row[0], now)
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """写入缓存，磁盘超出容量时按最久未访问淘汰"""
+        now = time.time()
+        value = copy.deepcopy(value)
+        with self.lock:
+            self._remember(key, value, now)
+            self.stats['stores'] += 1
+            if self.conn is None:
+                return
+            text = json.dumps(value, ensure_ascii=False)
+            size = len(text.encode('utf-8'))
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self.disk_bytes -= old[0]
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                              (key, text, size, now, now))
+            self.disk_bytes += size
+            self._evict_disk()
+            self.conn.commit()
+
+    def clear(self):
+        """清空全部缓存"""
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                self.conn.execute('DELETE FROM responses')
+                self.conn.commit()
+                self.disk_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回命中统计"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self.memory)
+            stats['disk_bytes'] = self.disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - created_at > self.ttl
+
+    def _remember(self, key: str, value: Dict[str, Any], created_at: float):
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        if not self.max_disk_bytes or self.disk_bytes <= self.max_disk_bytes:
+            return
+        if self.ttl:
+            cutoff = time.time() - self.ttl
+            expired_bytes, expired_count = self.conn.execute(
+                'SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses WHERE created_at < ?', (cutoff,)
+            ).fetchone()
+            self.conn.execute('DELETE FROM responses WHERE created_at < ?', (cutoff,))
+            self.disk_bytes -= expired_bytes
+            self.stats['evictions'] += expired_count
+        while self.disk_bytes > self.max_disk_bytes:
+            rows = self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64').fetchall()
+            if not rows:
+                self.disk_bytes = 0
+                break
+            for key, size in rows:
+                if self.disk_bytes <= self.max_disk_bytes:
+                    break
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.disk_bytes -= size
+                self.stats['evictions'] += 1
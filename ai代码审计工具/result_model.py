@@ -0,0 +1,260 @@
+import html
+from typing import Dict, Any, List, Optional
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+from PyQt5.QtGui import QColor
+from data_analysis import finding_source
+
+SEVERITY_LABELS = {'high': '高危', 'medium': '中危', 'low': '低危'}
+SEVERITY_RANK = {'high': 3, 'medium': 2, 'low': 1}
+SEVERITY_COLORS = {'high': QColor(200, 30, 30), 'medium': QColor(200, 120, 0), 'low': QColor(90, 90, 90)}
+SOURCE_LABELS = {'rule': '规则', 'obfuscation': '混淆检测', 'taint': '污点分析', 'ai': 'AI'}
+
+
+class FindingTableModel(QAbstractTableModel):
+    """
+    审计发现的表格模型：行数据保持为原始字典，显示文本在视图请求可见单元格时才生成，
+    审计线程产出的结果按批追加，不会重建整个视图
+    """
+
+    COLUMNS = [
+        ('severity', '严重程度'),
+        ('confidence', '置信度'),
+        ('category', '类别'),
+        ('path', '文件'),
+        ('line', '行'),
+        ('title', '标题'),
+        ('sources', '来源')
+    ]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.sort_column = None
+        self.sort_order = Qt.AscendingOrder
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section][1]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        column = self.COLUMNS[index.column()][0]
+        if role == Qt.DisplayRole:
+            return self._display(row, column)
+        if role == Qt.ForegroundRole and column == 'severity':
+            return SEVERITY_COLORS.get(row.get('severity'))
+        if role == Qt.TextAlignmentRole and column in ('confidence', 'line'):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """
+        在模型内用Python的key排序，比代理模型逐对调用data()比较快两个数量级；
+        排序后更新持久索引，保持当前选中行不变
+        """
+        if column < 0:
+            return
+        self.sort_column, self.sort_order = column, order
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        persistent_rows = [self.rows[index.row()] for index in persistent]
+        name = self.COLUMNS[column][0]
+        self.rows.sort(key=lambda row: self._sort_key(row, name), reverse=order == Qt.DescendingOrder)
+        if persistent:
+            position = {id(row): i for i, row in enumerate(self.rows)}
+            self.changePersistentIndexList(
+                persistent, [self.index(position[id(row)], index.column())
+                             for row, index in zip(persistent_rows, persistent)])
+        self.layoutChanged.emit()
+
+    def append_rows(self, rows: List[Dict[str, Any]]):
+        """追加一批发现，已按某列排序时重新排序（新数据只在末尾，Timsort接近线性）"""
+        if not rows:
+            return
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+        if self.sort_column is not None:
+            self.sort(self.sort_column, self.sort_order)
+
+    def set_rows(self, rows: List[Dict[str, Any]]):
+        """整体替换数据"""
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.endResetModel()
+        if self.sort_column is not None:
+            self.sort(self.sort_column, self.sort_order)
+
+    def clear(self):
+        self.set_rows([])
+
+    def row_data(self, row: int) -> Dict[str, Any]:
+        return self.rows[row]
+
+    @staticmethod
+    def _display(row: Dict[str, Any], column: str) -> str:
+        if column == 'severity':
+            return SEVERITY_LABELS.get(row.get('severity'), row.get('severity', ''))
+        if column == 'confidence':
+            confidence = row.get('confidence')
+            return '' if confidence is None else f'{confidence:.0%}'
+        if column == 'line':
+            start, end = row.get('start_line', 0), row.get('end_line', 0)
+            return str(start) if end <= start else f'{start}-{end}'
+        if column == 'sources':
+            return ', '.join(SOURCE_LABELS.get(s, s) for s in row.get('sources', []))
+        return str(row.get(column, ''))
+
+    @staticmethod
+    def _sort_key(row: Dict[str, Any], column: str):
+        if column == 'severity':
+            return SEVERITY_RANK.get(row.get('severity'), 0)
+        if column == 'confidence':
+            return row.get('confidence') or 0.0
+        if column == 'line':
+            return row.get('start_line', 0)
+        if column == 'sources':
+            return len(row.get('sources', []))
+        return str(row.get(column, ''))
+
+
+class FindingFilterProxy(QSortFilterProxyModel):
+    """按严重程度和关键字（匹配文件、类别、标题）过滤发现，排序由源模型完成"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.text = ''
+        self.min_severity = 0
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        # 排序交给源模型，代理只负责过滤并保持源模型的顺序
+        self.sourceModel().sort(column, order)
+
+    def set_text(self, text: str):
+        self.text = text.strip().lower()
+        self.invalidateFilter()
+
+    def set_min_severity(self, severity: Optional[str]):
+        self.min_severity = SEVERITY_RANK.get(severity, 0)
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        row = self.sourceModel().row_data(source_row)
+        if SEVERITY_RANK.get(row.get('severity'), 0) < self.min_severity:
+            return False
+        if not self.text:
+            return True
+        return any(self.text in str(row.get(key, '')).lower() for key in ('path', 'category', 'title'))
+
+
+def finding_to_row(path: str, finding: Dict[str, Any]) -> Dict[str, Any]:
+    """把单个文件的静态审计命中转换为表格行，字段与综合报告中的发现一致"""
+    source = finding_source(finding['rule_id'])
+    return {
+        'path': path,
+        'start_line': finding['line'],
+        'end_line': finding['line'],
+        'category': finding.get('category', ''),
+        'severity': finding.get('severity', ''),
+        'title': finding.get('name', finding['rule_id']),
+        'description': finding.get('description', ''),
+        'sources': [source],
+        'rule_ids': [finding['rule_id']],
+        'evidence': [{'source': source, 'line': finding['line'], 'text': finding.get('match', '')}]
+    }
+
+
+def render_detail(row: Dict[str, Any]) -> str:
+    """只为当前选中的发现生成详情HTML"""
+    e = html.escape
+    parts = [f"<h3>{e(row.get('title', ''))}</h3>",
+             f"<p><b>位置：</b>{e(row.get('path', ''))} 第{row.get('start_line')}-{row.get('end_line')}行</p>",
+             f"<p><b>严重程度：</b>{e(SEVERITY_LABELS.get(row.get('severity'), row.get('severity', '')))}"]
+    if row.get('confidence') is not None:
+        parts.append(f"　<b>置信度：</b>{row['confidence']:.0%}")
+    parts.append('</p>')
+    if row.get('rule_ids'):
+        parts.append(f"<p><b>规则：</b>{e(', '.join(row['rule_ids']))}</p>")
+    if row.get('description'):
+        parts.append(f"<p>{e(row['description']).replace(chr(10), '<br>')}</p>")
+    for evidence in row.get('evidence', []):
+        source = SOURCE_LABELS.get(evidence.get('source'), evidence.get('source', ''))
+        parts.append(f"<p><b>{e(source)}</b> 第{evidence.get('line')}行：</p><pre>{e(evidence.get('text', ''))}</pre>")
+    return ''.join(parts)
+
+
+JOB_STATUS_LABELS = {'queued': '排队', 'running': '运行中', 'done': '完成', 'failed': '失败', 'cancelled': '已取消'}
+
+
+class JobTableModel(QAbstractTableModel):
+    """批量审计任务的表格模型，由定时器按任务队列的最新状态整体刷新"""
+
+    COLUMNS = [
+        ('id', '任务'),
+        ('status', '状态'),
+        ('priority', '优先级'),
+        ('model', '模型'),
+        ('target', '代码目录'),
+        ('progress', '进度'),
+        ('result', '结果')
+    ]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section][1]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        return self._display(self.rows[index.row()], self.COLUMNS[index.column()][0])
+
+    def set_rows(self, rows: List[Dict[str, Any]]):
+        """整体替换任务列表"""
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.endResetModel()
+
+    def row_data(self, row: int) -> Dict[str, Any]:
+        return self.rows[row]
+
+    @staticmethod
+    def _display(job: Dict[str, Any], column: str) -> str:
+        if column == 'status':
+            return JOB_STATUS_LABELS.get(job['status'], job['status'])
+        if column == 'model':
+            return job['model'] or '仅静态审计'
+        if column == 'progress':
+            progress = job.get('progress')
+            if job['status'] != 'running' or not progress:
+                return ''
+            text = f"{progress.get('files_audited', 0)}/{progress.get('files_scanned', 0)}个文件"
+            if progress.get('percent') is not None:
+                text += f" {progress['percent']:.0%}"
+            return text
+        if column == 'result':
+            if job.get('error'):
+                return job['error']
+            summary = job.get('summary')
+            return f"{job['files']}个文件，{summary.get('findings', 0)}条发现" if summary else ''
+        return str(job.get(column, ''))
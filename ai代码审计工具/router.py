@@ -0,0 +1,338 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable
+from tracing import NULL_TRACER
+
+# 自动路由的默认策略，可在config.json的auto字段中覆盖
+DEFAULT_ROUTING = {
+    'providers': ['deepseek', 'chatgpt'],
+    'prefer': 'order',
+    'hedge_quantile': 0.95,
+    'hedge_min_delay': 2.0,
+    'hedge_initial_delay': 30.0,
+    'max_hedge_ratio': 0.2,
+    'window': 100,
+    'min_samples': 10,
+    'max_error_rate': 0.5,
+    'failure_threshold': 3,
+    'cooldown': 30.0
+}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """已排序列表的分位数（最近秩法），空列表返回None"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class CircuitBreaker:
+    """
+    服务商熔断器：连续失败达到阈值后断开，冷却期内不再向该服务商发请求；
+    冷却结束后放行一个试探请求（半开），成功则恢复，失败则重新断开。非线程安全，由ProviderRouter加锁调用
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.trips = 0
+
+    def available(self) -> bool:
+        """当前是否可以向服务商发请求，不占用半开状态的试探名额"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self.trial
+
+    def acquire(self) -> bool:
+        """发请求前调用，半开状态下只放行一个试探请求"""
+        if not self.available():
+            return False
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self.trial = True
+        return True
+
+    def release(self):
+        """请求被取消（未得出成败）时归还试探名额"""
+        self.trial = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial = False
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回熔断器是否因此断开"""
+        self.failures += 1
+        self.trial = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            return True
+        return False
+
+
+class ProviderStats:
+    """单个服务商最近window次请求的耗时、首token时间和成败，用于计算延迟分位数和错误率"""
+
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.ttfts = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0
+
+    def record_success(self, metrics: Dict[str, float]):
+        self.requests += 1
+        self.latencies.append(metrics['latency'])
+        self.ttfts.append(metrics['ttft'])
+        self.outcomes.append(True)
+
+    def record_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.outcomes.append(False)
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def quantile(self, q: float, stream: bool = False) -> Optional[float]:
+        """流式请求取首token时间的分位数，非流式取完整耗时的分位数"""
+        return percentile(sorted(self.ttfts if stream else self.latencies), q)
+
+
+class ProviderRouter:
+    """
+    在多个AI服务商之间路由单次分析请求：
+    - 按配置顺序（或最近的延迟）选出健康的主服务商，错误率过高或已熔断的服务商排到后面或跳过；
+    - 主服务商超过其延迟分位数仍未返回时，向下一个服务商发出对冲请求，采用先返回的结果；
+    - 请求失败时立即转到下一个服务商，直到全部失败
+    """
+
+    def __init__(self, ai_models, providers: List[str], config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            ai_models: AIModels实例，用于实际调用各服务商
+            providers: 参与路由的服务商，按优先级排列（通常把便宜的模型放在前面）
+            config: 路由策略，未提供的字段使用DEFAULT_ROUTING
+        """
+        self.logger = logging.getLogger(__name__)
+        self.ai_models = ai_models
+        self.providers = list(providers)
+        self.policy = dict(DEFAULT_ROUTING)
+        self.policy.update(config or {})
+        self.tracer = NULL_TRACER
+        self.lock = threading.Lock()
+        self.stats = {p: ProviderStats(int(self.policy['window'])) for p in self.providers}
+        self.breakers = {p: CircuitBreaker(int(self.policy['failure_threshold']), float(self.policy['cooldown']))
+                         for p in self.providers}
+        # 各服务商自身的并发上限，对冲请求在目标服务商满载时放弃
+        self.slots = {p: threading.Semaphore(ai_models._get_limits(p)['max_concurrency']) for p in self.providers}
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def rank(self) -> List[str]:
+        """返回本次请求的候选服务商，第一个为主服务商"""
+        with self.lock:
+            available = [p for p in self.providers if self.breakers[p].available()]
+            healthy = [p for p in available
+                       if len(self.stats[p].outcomes) < self.policy['min_samples']
+                       or self.stats[p].error_rate() <= self.policy['max_error_rate']]
+            if self.policy['prefer'] == 'latency':
+                # 样本不足的服务商按配置顺序排在有样本的服务商之前，以便尽快积累统计
+                healthy.sort(key=lambda p: self.stats[p].quantile(0.5) or 0.0)
+            degraded = sorted((p for p in available if p not in healthy), key=lambda p: self.stats[p].error_rate())
+        return healthy + degraded
+
+    def hedge_delay(self, provider: str, stream: bool) -> Optional[float]:
+        """主服务商发出请求后，等待多久仍未返回（流式请求为首token）时发出对冲请求，None表示不对冲"""
+        with self.lock:
+            stats = self.stats[provider]
+            if len(stats.latencies) < self.policy['min_samples']:
+                return self.policy['hedge_initial_delay'] or None
+            return max(self.policy['hedge_min_delay'], stats.quantile(self.policy['hedge_quantile'], stream))
+
+    def request(self, code_data: str, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        通过路由发出一次分析请求
+        Args:
+            code_data: 需要分析的代码
+            on_token: 流式输出回调，只回传最先开始输出的那个请求的文本
+        Returns:
+            最先成功返回的分析结果，provider字段为实际提供结果的服务商
+        """
+        candidates = self.rank()
+        if not candidates:
+            raise Exception('所有AI服务商均已熔断，请稍后重试')
+
+        for provider in candidates:
+            cached = self.ai_models.cache.get(self.ai_models._cache_key(provider, code_data))
+            if cached is not None:
+                self.tracer.count('ai', cache_hits=1)
+                if on_token is not None:
+                    on_token(cached['analysis'])
+                return dict(cached, provider=provider)
+
+        with self.lock:
+            self.requests += 1
+        results = queue.Queue()
+        attempts = []
+        stream = {'owner': None}
+        stream_lock = threading.Lock()
+        remaining = list(candidates)
+
+        def launch(provider: str, hedge: bool) -> bool:
+            if hedge and not self.slots[provider].acquire(blocking=False):
+                return False
+            with self.lock:
+                allowed = self.breakers[provider].acquire()
+            if not allowed:
+                if hedge:
+                    self.slots[provider].release()
+                return False
+            if not hedge:
+                self.slots[provider].acquire()
+            attempt = {'provider': provider, 'hedge': hedge, 'cancelled': False}
+
+            def token(text):
+                if attempt['cancelled']:
+                    raise InterruptedError('已有其他服务商返回结果，取消该请求')
+                with stream_lock:
+                    if stream['owner'] is None:
+                        stream['owner'] = attempt
+                    owner = stream['owner'] is attempt
+                if owner:
+                    on_token(text)
+
+            thread = threading.Thread(target=self._attempt, name=f'route-{provider}',
+                                      args=(attempt, code_data, token if on_token else None, results), daemon=True)
+            attempts.append(attempt)
+            thread.start()
+            return True
+
+        def launch_next(hedge: bool) -> bool:
+            while remaining:
+                if launch(remaining.pop(0), hedge):
+                    return True
+            return False
+
+        errors = []
+        pending = int(launch_next(False))
+        deadline = None
+        if len(remaining) and pending:
+            delay = self.hedge_delay(attempts[0]['provider'], on_token is not None)
+            if delay is not None:
+                deadline = time.monotonic() + delay
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                attempt, result, error = results.get(timeout=timeout)
+            except queue.Empty:
+                deadline = None
+                # 流式请求已开始输出时不再对冲，避免两路输出交错
+                if stream['owner'] is None and self._allow_hedge() and launch_next(True):
+                    pending += 1
+                    with self.lock:
+                        self.hedges += 1
+                    self.tracer.count('router', hedges=1)
+                    self.logger.info(f'{attempts[0]["provider"]} exceeded its latency quantile, '
+                                     f'hedging with {attempts[-1]["provider"]}')
+                continue
+            pending -= 1
+            if error is None:
+                for other in attempts:
+                    if other is not attempt:
+                        other['cancelled'] = True
+                with self.lock:
+                    self.stats[attempt['provider']].wins += 1
+                    if attempt['hedge']:
+                        self.hedge_wins += 1
+                if attempt['hedge']:
+                    self.tracer.count('router', hedge_wins=1)
+                return dict(result, provider=attempt['provider'])
+            errors.append(f'{attempt["provider"]}: {error}')
+            with stream_lock:
+                if stream['owner'] is attempt:
+                    stream['owner'] = None
+            if launch_next(False):
+                pending += 1
+                with self.lock:
+                    self.failovers += 1
+                self.tracer.count('router', failovers=1)
+                self.logger.warning(f'{attempt["provider"]} failed ({error}), failing over to '
+                                    f'{attempts[-1]["provider"]}')
+        raise Exception('所有AI服务商均调用失败: ' + '; '.join(errors))
+
+    def _allow_hedge(self) -> bool:
+        """对冲请求数不超过总请求数的max_hedge_ratio，防止服务整体变慢时请求量翻倍"""
+        with self.lock:
+            return self.hedges < self.policy['max_hedge_ratio'] * self.requests
+
+    def _attempt(self, attempt: Dict[str, Any], code_data: str, on_token: Optional[Callable[[str], None]],
+                 results: queue.Queue):
+        """在独立线程中向单个服务商发出请求，结果（或异常）放入results"""
+        provider = attempt['provider']
+        try:
+            time.sleep(self.ai_models._reserve(provider, code_data))
+            result = self.ai_models._request(provider, code_data, self.ai_models._cache_key(provider, code_data),
+                                             on_token)
+        except Exception as e:
+            with self.lock:
+                if attempt['cancelled']:
+                    # 被取消的请求不计入错误率，也不影响熔断
+                    self.breakers[provider].release()
+                else:
+                    self.stats[provider].record_failure()
+                    if self.breakers[provider].record_failure():
+                        self.logger.warning(f'Circuit breaker for {provider} opened for '
+                                            f'{self.policy["cooldown"]}s')
+                        self.tracer.count('router', breaker_trips=1)
+            results.put((attempt, None, e))
+        else:
+            # 落后的请求完成后同样计入延迟样本，否则分位数会低估慢请求
+            with self.lock:
+                self.stats[provider].record_success(result['metrics'])
+                self.breakers[provider].record_success()
+            results.put((attempt, result, None))
+        finally:
+            self.slots[provider].release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回路由统计：对冲和故障转移次数，以及各服务商的状态、错误率和延迟分位数"""
+        with self.lock:
+            providers = {}
+            for p in self.providers:
+                stats = self.stats[p]
+                p50, p95 = stats.quantile(0.5), stats.quantile(0.95)
+                providers[p] = {
+                    'state': self.breakers[p].state,
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'wins': stats.wins,
+                    'error_rate': round(stats.error_rate(), 3),
+                    'latency_p50': None if p50 is None else round(p50, 3),
+                    'latency_p95': None if p95 is None else round(p95, 3),
+                    'breaker_trips': self.breakers[p].trips
+                }
+            return {'requests': self.requests, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins,
+                    'failovers': self.failovers, 'providers': providers}
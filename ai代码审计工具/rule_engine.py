@@ -0,0 +1,257 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, Any, List, Optional
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), 'rules.json')
+DEFAULT_RULES_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'rules.cache')
+
+# 编译缓存格式版本，缓存结构变化时递增
+CACHE_FORMAT = 3
+
+# 关键字命中点前后参与正则确认的字符数
+DEFAULT_WINDOW = 256
+
+# 结果中保留的匹配文本长度
+MAX_MATCH_LENGTH = 200
+
+_FLAG_MAP = {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL}
+
+
+def build_trie_regex(keywords: List[str]) -> str:
+    """
+    将关键字构造为按公共前缀嵌套的正则（等价于在正则引擎中展开的字典树），
+    每个位置只需比较一次首字符集合，避免逐个尝试上百个分支
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for c in keyword:
+            node = node.setdefault(c, {})
+        node[''] = {}
+
+    def walk(node):
+        if '' in node and len(node) == 1:
+            return ''
+        optional = '' in node
+        branches = []
+        singles = []
+        for c in sorted(k for k in node if k):
+            sub = walk(node[c])
+            if sub:
+                branches.append(re.escape(c) + sub)
+            else:
+                singles.append(re.escape(c))
+        if singles:
+            branches.append(singles[0] if len(singles) == 1 else '[' + ''.join(singles) + ']')
+        body = branches[0] if len(branches) == 1 and not optional else '(?:' + '|'.join(branches) + ')'
+        if optional:
+            body += '?'
+        return body
+
+    return walk(trie)
+
+
+class RuleSet:
+    """
+    webshell和危险函数签名规则集。所有规则的字面关键字合并为一个忽略大小写的预过滤正则，
+    每个文件只扫描一遍，仅在关键字命中点附近的候选区域执行代价较高的确认正则
+    """
+
+    def __init__(self, version: str, digest: str, rules: List[Dict[str, Any]], keyword_map: Dict[str, List[int]],
+                 match_map: Optional[Dict[str, List[int]]] = None, prefilter_source: Optional[str] = None):
+        """
+        Args:
+            version: 规则文件中的版本号
+            digest: 规则文件内容的哈希
+            rules: 校验后的规则列表
+            keyword_map: 关键字 -> 规则序号
+            match_map: 预过滤命中的关键字 -> 需要确认的规则序号，None时由keyword_map计算
+            prefilter_source: 预过滤正则的源码，None时由关键字构造；两者都来自编译缓存时省去加载阶段的计算
+        """
+        self.logger = logging.getLogger(__name__)
+        self.version = version
+        self.digest = digest
+        self.rules = rules
+        self.keyword_map = keyword_map
+        keywords = sorted(keyword_map, key=len, reverse=True)
+        if match_map is None:
+            # 预过滤正则的匹配互不重叠，较长关键字命中时也要触发其包含的较短关键字对应的规则
+            match_map = {}
+            for keyword in keywords:
+                indexes = []
+                for other in keywords:
+                    if other in keyword:
+                        indexes.extend(i for i in keyword_map[other] if i not in indexes)
+                match_map[keyword] = sorted(indexes)
+        self.match_map = match_map
+        if prefilter_source is None and keywords:
+            prefilter_source = build_trie_regex(keywords)
+        self.prefilter_source = prefilter_source
+        # 关键字均为小写，扫描前先将文件内容整体转为小写，比IGNORECASE匹配快数倍
+        self.prefilter = re.compile(prefilter_source) if prefilter_source else None
+        self.prefilter_ignorecase = re.compile(prefilter_source, re.IGNORECASE) if prefilter_source else None
+        self.patterns = {}
+
+    @property
+    def rules_version(self) -> str:
+        """规则集版本标识，规则文件内容变化时随之变化"""
+        return f'{self.version}:{self.digest[:12]}'
+
+    @classmethod
+    def load(cls, rules_path: str = DEFAULT_RULES_PATH,
+             cache_path: Optional[str] = DEFAULT_RULES_CACHE_PATH) -> 'RuleSet':
+        """
+        加载规则集，规则文件未变化时直接使用磁盘上的编译缓存
+        Args:
+            rules_path: 规则文件路径
+            cache_path: 编译缓存路径，None表示不使用缓存
+        Returns:
+            规则集
+        """
+        with open(rules_path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if cached.get('format') == CACHE_FORMAT and cached.get('digest') == digest:
+                    return cls(cached['version'], digest, cached['rules'], cached['keyword_map'],
+                               cached['match_map'], cached['prefilter'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+        data = json.loads(raw.decode('utf-8'))
+        rules, keyword_map = cls._compile(data['rules'])
+        rule_set = cls(str(data['version']), digest, rules, keyword_map)
+        if cache_path:
+            try:
+                with open(cache_path, 'w', encoding='utf-8') as f:
+                    json.dump({'format': CACHE_FORMAT, 'digest': digest, 'version': rule_set.version,
+                               'rules': rules, 'keyword_map': keyword_map, 'match_map': rule_set.match_map,
+                               'prefilter': rule_set.prefilter_source}, f, ensure_ascii=False)
+            except OSError as e:
+                rule_set.logger.warning(f'Cannot write rule cache {cache_path}: {e}')
+        return rule_set
+
+    @staticmethod
+    def _compile(raw_rules: List[Dict[str, Any]]):
+        """校验规则并建立关键字到规则序号的索引"""
+        rules = []
+        keyword_map = {}
+        seen_ids = set()
+        for raw in raw_rules:
+            rule_id = raw['id']
+            if rule_id in seen_ids:
+                raise ValueError(f'规则ID重复: {rule_id}')
+            seen_ids.add(rule_id)
+            keywords = [k.lower() for k in raw.get('keywords', []) if k]
+            if not keywords:
+                raise ValueError(f'规则 {rule_id} 缺少关键字')
+            flags = raw.get('flags', '')
+            if raw.get('pattern'):
+                # 提前编译一次以便在加载阶段暴露语法错误
+                re.compile(raw['pattern'], RuleSet._flags(flags))
+            rule = {
+                'id': rule_id,
+                'name': raw.get('name', rule_id),
+                'severity': raw.get('severity', 'medium'),
+                'category': raw.get('category', 'other'),
+                'description': raw.get('description', ''),
+                'extensions': [e.lower() for e in raw.get('extensions', [])],
+                'pattern': raw.get('pattern'),
+                'flags': flags,
+                'window': raw.get('window', DEFAULT_WINDOW)
+            }
+            index = len(rules)
+            rules.append(rule)
+            for keyword in keywords:
+                keyword_map.setdefault(keyword, [])
+                if index not in keyword_map[keyword]:
+                    keyword_map[keyword].append(index)
+        return rules, keyword_map
+
+    @staticmethod
+    def _flags(flags: str) -> int:
+        value = 0
+        for c in flags:
+            value |= _FLAG_MAP.get(c, 0)
+        return value
+
+    def _pattern(self, index: int):
+        """确认正则在首次命中候选区域时才编译"""
+        pattern = self.patterns.get(index)
+        if pattern is None:
+            rule = self.rules[index]
+            pattern = re.compile(rule['pattern'], self._flags(rule['flags']))
+            self.patterns[index] = pattern
+        return pattern
+
+    def scan(self, content: str, path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        扫描单个文件
+        Args:
+            content: 文件内容
+            path: 文件路径，用于按扩展名筛选规则
+        Returns:
+            命中的规则列表，按偏移排序
+        """
+        if self.prefilter is None or not content:
+            return []
+        ext = os.path.splitext(path)[1].lower() if path else ''
+
+        # 1. 单次扫描收集每条规则的候选区域，没有确认正则的规则以关键字本身作为命中
+        regions = {}
+        findings = []
+        lowered = content.lower()
+        if len(lowered) == len(content):
+            matches = self.prefilter.finditer(lowered)
+        else:
+            # 少数Unicode字符转小写后长度会变化，此时偏移无法对应，退回忽略大小写的匹配
+            matches = self.prefilter_ignorecase.finditer(content)
+        for m in matches:
+            for index in self.match_map[m.group().lower()]:
+                rule = self.rules[index]
+                if ext and rule['extensions'] and ext not in rule['extensions']:
+                    continue
+                if rule['pattern'] is None:
+                    findings.append((m.start(), m.end(), rule))
+                    continue
+                window = rule['window']
+                start, end = max(0, m.start() - window), min(len(content), m.end() + window)
+                spans = regions.setdefault(index, [])
+                if spans and start <= spans[-1][1]:
+                    spans[-1][1] = max(spans[-1][1], end)
+                else:
+                    spans.append([start, end])
+
+        # 2. 只在候选区域内执行确认正则
+        for index, spans in regions.items():
+            rule = self.rules[index]
+            hits = set()
+            for start, end in spans:
+                for m in self._pattern(index).finditer(content, start, end):
+                    hits.add((m.start(), m.end()))
+            for start, end in hits:
+                findings.append((start, end, rule))
+
+        results = []
+        line, position = 1, 0
+        for start, end, rule in sorted(findings, key=lambda f: (f[0], f[2]['id'])):
+            line += content.count('\n', position, start)
+            position = start
+            results.append({
+                'rule_id': rule['id'],
+                'name': rule['name'],
+                'severity': rule['severity'],
+                'category': rule['category'],
+                'description': rule['description'],
+                'line': line,
+                'offset': start,
+                'match': content[start:end][:MAX_MATCH_LENGTH]
+            })
+        return results
@@ -0,0 +1,377 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from job_queue import JobQueue, DEFAULT_QUEUE_PATH, JOB_STATUSES
+from manifest import DEFAULT_MANIFEST_PATH
+from response_cache import DEFAULT_CACHE_PATH
+from similarity import DEFAULT_INDEX_PATH
+from rate_limiter import SharedTokenBucket, SharedSlots
+
+# 共享限额的服务商，auto路由到的也是这些服务商
+PROVIDERS = ['chatgpt', 'deepseek', 'kimi', 'ollama']
+# 任务options中可以传给CoreEngine.run_audit的参数
+RUN_OPTIONS = ('max_requests', 'max_tokens', 'min_risk')
+
+
+def create_shared_limits(context, workers: int) -> Dict[str, Any]:
+    """按config.json中各服务商的limits创建跨进程共享的令牌桶和并发名额"""
+    from ai_models import AIModels
+    from response_cache import ResponseCache
+    ai_models = AIModels(cache=ResponseCache(None))
+    shared = {}
+    for provider in PROVIDERS:
+        limits = ai_models._get_limits(provider)
+        shared[provider] = (SharedTokenBucket(limits['requests_per_minute'], context=context),
+                            SharedTokenBucket(limits['tokens_per_minute'], context=context),
+                            SharedSlots(limits['max_concurrency'], workers, context=context))
+    ai_models.close()
+    return shared
+
+
+def run_job(engine, jobs: JobQueue, job: Dict[str, Any], stop_event, heartbeat_interval: float):
+    """
+    执行单个任务，后台线程定期写入心跳和进度，任务被请求取消或调度器停止时取消审计。
+    调度器停止导致的中断把任务放回队列，下次启动后由审计清单复用已完成的文件
+    """
+    from core_engine import AuditInterrupted
+    from git_diff import GitDiffSource, parse_revisions
+    logger = logging.getLogger(__name__)
+    cancel = threading.Event()
+    finished = threading.Event()
+    latest = {}
+
+    def beat():
+        while not finished.wait(heartbeat_interval):
+            if jobs.heartbeat(job['id'], latest.get('event')) or stop_event.is_set():
+                cancel.set()
+
+    heartbeat = threading.Thread(target=beat, name=f'job-{job["id"]}-heartbeat', daemon=True)
+    heartbeat.start()
+    logger.info(f'Job {job["id"]} started: {job["target"]} (model {job["model"] or "none"})')
+    try:
+        root, source = job['target'], None
+        if job['options'].get('diff'):
+            base, head, merge_base = parse_revisions(job['options']['diff'])
+            source = GitDiffSource(root, base, head, merge_base, web_crawler=engine.web_crawler)
+            root = source.root
+        report = engine.run_audit(root, job['model'], on_progress=lambda event: latest.update(event=event),
+                                  cancel_event=cancel, source=source,
+                                  **{k: v for k, v in job['options'].items() if k in RUN_OPTIONS})
+        jobs.finish(job['id'], report)
+        logger.info(f'Job {job["id"]} finished: {report["summary"].get("files", 0)} files')
+    except AuditInterrupted as e:
+        if e.cancelled and stop_event.is_set():
+            jobs.release(job['id'])
+        else:
+            jobs.finish(job['id'], e.partial_report, 'cancelled' if e.cancelled else 'failed',
+                        None if e.cancelled else str(e))
+    except Exception as e:
+        logger.error(f'Job {job["id"]} failed: {e}')
+        jobs.fail(job['id'], str(e))
+    finally:
+        finished.set()
+        heartbeat.join()
+
+
+def worker_main(name: str, owner: int, queue_path: str, settings: Dict[str, Any], shared_limits: Dict[str, Any],
+                stop_event):
+    """
+    工作进程入口：循环领取并执行任务。同一进程内的任务复用静态审计进程池、AI连接池和缓存，
+    审计清单、响应缓存和近似重复索引是多个进程共用的SQLite文件
+    """
+    # Ctrl+C由调度器统一处理，工作进程通过stop_event停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=settings['log_level'], stream=sys.stderr,
+                        format=f'%(asctime)s - {name} - %(name)s - %(levelname)s - %(message)s')
+    from core_engine import CoreEngine
+    from code_audit import CodeAudit
+    from manifest import AuditManifest
+    jobs = JobQueue(queue_path)
+    code_audit = CodeAudit(workers=settings['static_workers'])
+    # 清单和近似重复索引由多个工作进程共用，每次写入立即提交
+    manifest = AuditManifest(settings['manifest'], commit_interval=1)
+    ai_models = similarity_index = None
+    try:
+        while not stop_event.is_set():
+            job = jobs.claim(name)
+            if job is None:
+                if settings['drain']:
+                    return
+                stop_event.wait(settings['poll_interval'])
+                continue
+            if job['model'] and ai_models is None:
+                from ai_models import AIModels
+                from response_cache import ResponseCache
+                ai_models = AIModels(cache=ResponseCache(settings['cache']))
+                ai_models.share_limits(shared_limits, owner)
+                if settings['dedup']:
+                    from similarity import SimilarityIndex
+                    similarity_index = SimilarityIndex(settings['similarity_index'], autocommit=True)
+            engine = CoreEngine(ai_models=ai_models, code_audit=code_audit, manifest=manifest,
+                                similarity_index=similarity_index, dedup=settings['dedup'])
+            run_job(engine, jobs, job, stop_event, settings['heartbeat_interval'])
+    finally:
+        if ai_models is not None:
+            ai_models.close()
+        if similarity_index is not None:
+            similarity_index.close()
+        code_audit.close()
+        manifest.close()
+        jobs.close()
+
+
+class AuditScheduler:
+    """
+    批量审计调度器：启动多个工作进程从任务队列中领取任务，
+    各进程共享服务商的请求数/token数限额和并发上限，退出的工作进程自动重启并重新排队其任务
+    """
+
+    def __init__(self, queue_path: str = DEFAULT_QUEUE_PATH, workers: int = 2, static_workers: Optional[int] = None,
+                 manifest_path: str = DEFAULT_MANIFEST_PATH, cache_path: str = DEFAULT_CACHE_PATH,
+                 similarity_path: str = DEFAULT_INDEX_PATH, dedup: bool = True, drain: bool = False,
+                 stale_after: float = 60.0, heartbeat_interval: float = 5.0, poll_interval: float = 1.0):
+        """
+        Args:
+            queue_path: 任务队列文件路径
+            workers: 工作进程数，每个进程同时审计一个任务
+            static_workers: 每个工作进程的静态审计进程数，默认按CPU核数平均分配
+            manifest_path: 审计清单文件路径
+            cache_path: AI响应缓存文件路径
+            similarity_path: 近似重复索引文件路径
+            dedup: 是否做近似重复去重
+            drain: 为True时队列为空后工作进程退出，否则持续等待新任务
+            stale_after: 心跳超过该秒数的运行中任务视为中断，启动时重新排队
+            heartbeat_interval: 任务心跳间隔（秒）
+            poll_interval: 队列为空时的轮询间隔（秒）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.queue_path = queue_path
+        self.workers = max(1, workers)
+        self.stale_after = stale_after
+        self.settings = {
+            'static_workers': static_workers or max(1, (os.cpu_count() or 1) // self.workers),
+            'manifest': manifest_path,
+            'cache': cache_path,
+            'similarity_index': similarity_path,
+            'dedup': dedup,
+            'drain': drain,
+            'heartbeat_interval': heartbeat_interval,
+            'poll_interval': poll_interval,
+            'log_level': logging.getLogger().getEffectiveLevel()
+        }
+        # spawn在各平台行为一致，也避免在GUI进程中fork
+        self.context = multiprocessing.get_context('spawn')
+        self.jobs = JobQueue(queue_path)
+        self.stop_event = None
+        self.shared_limits = None
+        self.processes = {}
+        # 工作进程名 -> 在共享并发名额中的位置
+        self.owners = {}
+
+    @property
+    def running(self) -> bool:
+        return self.stop_event is not None and not self.stop_event.is_set()
+
+    def start(self):
+        """重新排队上次中断的任务并启动工作进程"""
+        self.jobs.recover(self.stale_after)
+        self.stop_event = self.context.Event()
+        self.shared_limits = create_shared_limits(self.context, self.workers)
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        for i in range(self.workers):
+            self.owners[f'{prefix}:{i}'] = i
+            self._spawn(f'{prefix}:{i}')
+        self.logger.info(f'Scheduler started with {self.workers} workers '
+                         f'({self.settings["static_workers"]} static processes each)')
+
+    def _spawn(self, name: str):
+        process = self.context.Process(target=worker_main, name=name, daemon=False,
+                                       args=(name, self.owners[name], self.queue_path, self.settings,
+                                             self.shared_limits, self.stop_event))
+        process.start()
+        self.processes[name] = process
+
+    def check(self) -> int:
+        """
+        检查工作进程，意外退出的进程的任务重新排队并重启该进程（drain模式下正常退出的进程不重启）
+        Returns:
+            存活的工作进程数
+        """
+        for name, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if process.exitcode != 0:
+                self.logger.warning(f'Worker {name} exited with code {process.exitcode}')
+                self.jobs.recover(worker=name)
+                self._reclaim(name)
+                if self.running:
+                    self._spawn(name)
+                    continue
+            del self.processes[name]
+        return len(self.processes)
+
+    def _reclaim(self, name: str):
+        """归还退出的工作进程未释放的并发名额"""
+        for provider, (_, _, slots) in self.shared_limits.items():
+            count = slots.reclaim(self.owners[name])
+            if count:
+                self.logger.warning(f'Reclaimed {count} {provider} request slots held by {name}')
+
+    def wait(self, interval: float = 1.0, on_stats=None, stats_interval: float = 10.0):
+        """
+        阻塞直到工作进程全部退出（drain模式）或调度器被停止
+        Args:
+            interval: 检查工作进程的间隔（秒）
+            on_stats: 定期调用的统计回调，参数为stats()的结果
+            stats_interval: 统计回调的间隔（秒）
+        """
+        last = time.monotonic()
+        while self.check():
+            time.sleep(interval)
+            if on_stats is not None and time.monotonic() - last >= stats_interval:
+                last = time.monotonic()
+                on_stats(self.stats())
+
+    def stop(self, timeout: float = 30.0):
+        """停止调度器，运行中的任务被取消并放回队列"""
+        if self.stop_event is None:
+            return
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for name, process in self.processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                self.logger.warning(f'Worker {name} did not stop in time, terminating')
+                process.terminate()
+                process.join()
+            self.jobs.recover(worker=name)
+        self.processes.clear()
+        self.logger.info('Scheduler stopped')
+
+    def stats(self, window: float = 300.0) -> Dict[str, Any]:
+        """队列统计，另外包含存活的工作进程数"""
+        stats = self.jobs.stats(window)
+        stats['workers'] = sum(1 for process in self.processes.values() if process.is_alive())
+        return stats
+
+    def close(self):
+        self.stop()
+        self.jobs.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='批量审计任务队列：提交任务、启动工作进程并查看队列状态')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help='任务队列文件路径')
+    parser.add_argument('-v', '--verbose', action='store_true', help='在标准错误输出中打印运行日志')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='提交审计任务')
+    submit.add_argument('paths', nargs='+', help='代码目录，每个目录一个任务')
+    submit.add_argument('-m', '--model', choices=PROVIDERS + ['auto'], help='使用的AI服务商，不指定时只做静态审计')
+    submit.add_argument('-p', '--priority', type=int, default=0, help='优先级，数值大的先审计（默认0）')
+    submit.add_argument('--diff', metavar='RANGE', help='只审计git版本之间的改动，格式同cli.py的--diff')
+    submit.add_argument('--max-requests', type=int, help='每个任务最多发起的AI请求数')
+    submit.add_argument('--max-tokens', type=int, help='每个任务最多送入AI的token数')
+    submit.add_argument('--min-risk', type=float, help='风险分数低于该值的文件不送入AI分析')
+
+    run = commands.add_parser('run', help='启动工作进程处理队列中的任务')
+    run.add_argument('-w', '--workers', type=int, default=2, help='工作进程数（默认2）')
+    run.add_argument('-j', '--static-workers', type=int, help='每个工作进程的静态审计进程数，默认按CPU核数平均分配')
+    run.add_argument('--drain', action='store_true', help='队列为空后退出，不再等待新任务')
+    run.add_argument('--no-dedup', action='store_true', help='不做近似重复去重')
+    run.add_argument('--stale-after', type=float, default=60.0, help='心跳超过该秒数的运行中任务视为中断并重新排队')
+
+    status = commands.add_parser('status', help='输出队列深度和吞吐量（JSON）')
+    status.add_argument('--window', type=float, default=300.0, help='吞吐量统计窗口（秒，默认300）')
+
+    listing = commands.add_parser('list', help='列出任务')
+    listing.add_argument('--status', choices=JOB_STATUSES, help='只列出该状态的任务')
+    listing.add_argument('-n', '--limit', type=int, default=50)
+
+    cancel = commands.add_parser('cancel', help='取消任务')
+    cancel.add_argument('ids', nargs='+', type=int)
+
+    report = commands.add_parser('report', help='导出任务的综合报告（JSON）')
+    report.add_argument('id', type=int)
+    report.add_argument('-o', '--output', help='输出文件，默认写到标准输出')
+    return parser
+
+
+def format_job(job: Dict[str, Any]) -> str:
+    """单行显示任务状态"""
+    text = f"#{job['id']:<5} {job['status']:<9} p={job['priority']:<3} {job['model'] or 'static':<8} {job['target']}"
+    progress = job.get('progress')
+    if job['status'] == 'running' and progress:
+        text += f" | 审计 {progress.get('files_audited', 0)}/{progress.get('files_scanned', 0)}"
+        if progress.get('percent') is not None:
+            text += f" {progress['percent']:.0%}"
+    elif job['status'] in ('done', 'cancelled', 'failed') and job.get('summary'):
+        text += f" | {job['files']}个文件，{job['summary'].get('findings', 0)}条发现"
+    if job.get('error'):
+        text += f" | {job['error']}"
+    return text
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'run':
+        scheduler = AuditScheduler(args.queue, args.workers, args.static_workers, dedup=not args.no_dedup,
+                                   drain=args.drain, stale_after=args.stale_after)
+        scheduler.start()
+        try:
+            scheduler.wait(on_stats=lambda stats: print(json.dumps(stats, ensure_ascii=False), file=sys.stderr))
+        except KeyboardInterrupt:
+            print('正在停止调度器，运行中的任务将放回队列', file=sys.stderr)
+        finally:
+            scheduler.close()
+        return 0
+
+    jobs = JobQueue(args.queue)
+    try:
+        if args.command == 'submit':
+            options = {k: v for k, v in (('diff', args.diff), ('max_requests', args.max_requests),
+                                         ('max_tokens', args.max_tokens), ('min_risk', args.min_risk))
+                       if v is not None}
+            for path in args.paths:
+                if not os.path.isdir(path):
+                    print(f'代码路径不存在: {path}', file=sys.stderr)
+                    return 2
+            for path in args.paths:
+                print(jobs.submit(path, args.model, args.priority, options))
+        elif args.command == 'status':
+            print(json.dumps(jobs.stats(args.window), ensure_ascii=False, indent=2))
+        elif args.command == 'list':
+            for job in jobs.list_jobs(args.status, args.limit):
+                print(format_job(job))
+        elif args.command == 'cancel':
+            for job_id in args.ids:
+                jobs.cancel(job_id)
+        elif args.command == 'report':
+            report = jobs.get_report(args.id)
+            if report is None:
+                print(f'任务{args.id}没有报告', file=sys.stderr)
+                return 1
+            text = json.dumps(report, indent=2, ensure_ascii=False)
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    f.write(text)
+            else:
+                print(text)
+    finally:
+        jobs.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import difflib
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, Any, List, Optional
+
+# numpy为可选依赖，缺失时用纯Python计算签名，结果相同；导入耗时较长，第一次计算签名时才导入
+np = None
+_numpy_checked = False
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'similarity_index.db')
+
+# MinHash签名长度，按BANDS个分段做LSH，每段NUM_PERM // BANDS个值；
+# Jaccard相似度0.9的文件几乎必然落入同一个桶，0.5的文件约有六成概率成为候选，再按签名精确比较
+NUM_PERM = 64
+BANDS = 16
+# 每个shingle包含的token数
+SHINGLE_SIZE = 5
+# shingle数少于该值的文件不参与近似去重，太短的文件签名不可靠，也节省不了多少请求
+MIN_SHINGLES = 50
+# 每次查询最多比较的候选数
+MAX_CANDIDATES = 50
+# 随结果保存的差异最多保留的行数
+MAX_DIFF_LINES = 200
+# 共用索引时未完成的代表文件超过该秒数视为所在进程已退出
+PENDING_TIMEOUT = 3600
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+# multiply-shift哈希族：h(x) = ((a*x + b) mod 2^64) >> 32，a为奇数，numpy的uint64乘法按2^64自然回绕
+_MASK = (1 << 64) - 1
+_A = [int.from_bytes(hashlib.blake2b(b'minhash-a%d' % i, digest_size=8).digest(), 'little') | 1
+      for i in range(NUM_PERM)]
+_B = [int.from_bytes(hashlib.blake2b(b'minhash-b%d' % i, digest_size=8).digest(), 'little') for i in range(NUM_PERM)]
+
+
+def shingle_hashes(content: str) -> List[int]:
+    """把代码切分为token，返回每个由SHINGLE_SIZE个相邻token组成的shingle的32位哈希（去重）"""
+    tokens = array('I', (zlib.crc32(t.encode('utf-8')) for t in TOKEN_PATTERN.findall(content)))
+    data = memoryview(tokens.tobytes())
+    width = tokens.itemsize * SHINGLE_SIZE
+    return list({zlib.crc32(data[i:i + width]) for i in range(0, len(data) - width + 1, tokens.itemsize)})
+
+
+def _import_numpy():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+
+
+def minhash(content: str) -> Optional[List[int]]:
+    """计算代码内容的MinHash签名，shingle过少时返回None"""
+    hashes = shingle_hashes(content)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    _import_numpy()
+    if np is not None:
+        x = np.array(hashes, dtype=np.uint64)
+        a = np.array(_A, dtype=np.uint64)[:, None]
+        b = np.array(_B, dtype=np.uint64)[:, None]
+        return [int(v) for v in ((a * x + b) >> np.uint64(32)).min(axis=1)]
+    return [min(((a * x + b) & _MASK) >> 32 for x in hashes) for a, b in zip(_A, _B)]
+
+
+def similarity(first: List[int], second: List[int]) -> float:
+    """两个签名估计的Jaccard相似度"""
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+def make_diff(old: str, new: str, old_name: str, new_name: str) -> str:
+    """生成两个文件之间的统一差异，超出MAX_DIFF_LINES行的部分截断"""
+    lines = []
+    for line in difflib.unified_diff(old.splitlines(), new.splitlines(), old_name, new_name, n=1, lineterm=''):
+        if len(lines) >= MAX_DIFF_LINES:
+            lines.append('... (diff truncated)')
+            break
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def carry_analysis(analysis: Dict[str, Any], path: str, line_count: int, duplicate_of: str,
+                   score: float, diff: str) -> Dict[str, Any]:
+    """
+    把代表文件的AI分析结果转换为近似重复文件的结果
+    Args:
+        analysis: 代表文件的分析结果
+        path: 近似重复文件的路径
+        line_count: 近似重复文件的行数，沿用的行区间不超过该行数
+        duplicate_of: 代表文件的路径
+        score: 相似度
+        diff: 代表文件与该文件之间的差异
+    """
+    chunks = []
+    for chunk in analysis.get('chunks', []):
+        if 'analysis' not in chunk:
+            continue
+        start_line = min(chunk['start_line'], line_count)
+        chunks.append(dict(chunk, chunk_id=f'{chunk["chunk_id"]}@{path}', start_line=start_line,
+                           end_line=max(start_line, min(chunk['end_line'], line_count))))
+    entry = {'chunks': chunks, 'duplicate_of': {'path': duplicate_of, 'similarity': round(score, 3), 'diff': diff}}
+    if 'model' in analysis:
+        entry['model'] = analysis['model']
+    return entry
+
+
+class SimilarityIndex:
+    """
+    基于SQLite的近似重复代码索引：保存每个聚类代表文件的MinHash签名、内容和AI分析结果，
+    签名按LSH分段写入带索引的桶表，查询只比较落入相同桶的候选，耗时与索引规模基本无关。
+    相似的文件（复制或稍作修改的第三方库、模板等）直接沿用代表文件的AI结果并附带差异
+    """
+
+    def __init__(self, db_path: str = DEFAULT_INDEX_PATH, threshold: float = 0.9, autocommit: bool = False):
+        """
+        Args:
+            db_path: 索引文件路径，':memory:'表示不持久化
+            threshold: 判定为近似重复的最低相似度
+            autocommit: 为True时每次写入立即提交，多个进程共用索引时使用，避免长时间占用写锁
+        """
+        self.logger = logging.getLogger(__name__)
+        self.threshold = threshold
+        self.autocommit = autocommit
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS representatives (
+                id INTEGER PRIMARY KEY,
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                risk REAL NOT NULL,
+                content BLOB NOT NULL,
+                analysis TEXT,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER NOT NULL, rep_id INTEGER NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_bucket ON buckets (bucket)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_bucket_rep ON buckets (rep_id)')
+        # 上次审计中途退出时留下的未完成代表文件；多个进程共用索引时其他进程可能正在分析，只清理较早的
+        stale_before = time.time() - (PENDING_TIMEOUT if autocommit else 0)
+        stale = [row[0] for row in self.conn.execute(
+            'SELECT id FROM representatives WHERE analysis IS NULL AND updated_at <= ?', (stale_before,))]
+        self._delete(stale)
+        self.conn.commit()
+
+    @staticmethod
+    def signature(content: str) -> Optional[List[int]]:
+        """计算签名，文件过短时返回None"""
+        return minhash(content)
+
+    @staticmethod
+    def _buckets(signature: List[int]) -> List[int]:
+        rows = NUM_PERM // BANDS
+        buckets = []
+        for band in range(BANDS):
+            values = array('Q', signature[band * rows:(band + 1) * rows])
+            digest = hashlib.blake2b(bytes([band]) + values.tobytes(), digest_size=8).digest()
+            buckets.append(int.from_bytes(digest, 'little', signed=True))
+        return buckets
+
+    def query(self, signature: List[int], model_version: str) -> Optional[Dict[str, Any]]:
+        """
+        查找与签名最相似的代表文件
+        Args:
+            signature: 待查文件的签名
+            model_version: 当前AI模型版本，只匹配同一版本分析过的代表文件
+        Returns:
+            相似度不低于阈值时返回id、root、path、risk、similarity和analysis（本次审计中尚未完成时为None），
+            否则返回None
+        """
+        buckets = self._buckets(signature)
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT r.id, r.root, r.path, r.signature, r.risk, r.analysis FROM representatives r JOIN '
+                f'(SELECT rep_id, COUNT(*) AS hits FROM buckets WHERE bucket IN ({",".join("?" * len(buckets))}) '
+                f'GROUP BY rep_id ORDER BY hits DESC LIMIT {MAX_CANDIDATES}) c ON r.id = c.rep_id '
+                f'WHERE r.model_version = ?',
+                buckets + [model_version]
+            ).fetchall()
+        best = None
+        for rep_id, root, path, blob, risk, analysis in rows:
+            score = similarity(signature, array('Q', blob).tolist())
+            if score >= self.threshold and (best is None or score > best['similarity']):
+                best = {'id': rep_id, 'root': root, 'path': path, 'risk': risk, 'similarity': score,
+                        'analysis': analysis}
+        if best is not None and best['analysis'] is not None:
+            best['analysis'] = json.loads(best['analysis'])
+        return best
+
+    def add(self, root: str, path: str, signature: List[int], content: str, risk: float,
+            model_version: str) -> int:
+        """登记正在进行AI分析的代表文件，返回其id，分析完成后调用complete"""
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT INTO representatives (root, path, model_version, signature, risk, content, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (root, path, model_version, array('Q', signature).tobytes(), risk,
+                 zlib.compress(content.encode('utf-8', errors='replace')), time.time())
+            )
+            rep_id = cursor.lastrowid
+            self.conn.executemany('INSERT INTO buckets (bucket, rep_id) VALUES (?, ?)',
+                                  [(bucket, rep_id) for bucket in self._buckets(signature)])
+            if self.autocommit:
+                self.conn.commit()
+        return rep_id
+
+    def complete(self, rep_id: int, analysis: Dict[str, Any]):
+        """保存代表文件的AI分析结果，之后的审计可直接沿用"""
+        with self.lock:
+            self.conn.execute('UPDATE representatives SET analysis = ?, updated_at = ? WHERE id = ?',
+                              (json.dumps(analysis, ensure_ascii=False), time.time(), rep_id))
+            if self.autocommit:
+                self.conn.commit()
+
+    def remove(self, rep_id: int):
+        """删除AI分析失败的代表文件"""
+        with self.lock:
+            self._delete([rep_id])
+            if self.autocommit:
+                self.conn.commit()
+
+    def get_content(self, rep_id: int) -> str:
+        """读取代表文件的内容，用于生成差异"""
+        with self.lock:
+            row = self.conn.execute('SELECT content FROM representatives WHERE id = ?', (rep_id,)).fetchone()
+        return zlib.decompress(row[0]).decode('utf-8') if row else ''
+
+    def _delete(self, rep_ids: List[int]):
+        self.conn.executemany('DELETE FROM buckets WHERE rep_id = ?', [(i,) for i in rep_ids])
+        self.conn.executemany('DELETE FROM representatives WHERE id = ?', [(i,) for i in rep_ids])
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,119 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+# 内存中默认最多保留的发现条数，每个文件至少按一条计
+DEFAULT_MAX_IN_MEMORY = 100000
+
+
+class SpillDict:
+    """
+    以文件路径为键保存审计结果的字典：内存中累计的发现条数超过上限后，之后写入的结果序列化到
+    SQLite临时库（随连接关闭自动删除），读取和遍历时对调用方透明。写入后不应再原地修改取出的值
+    """
+
+    def __init__(self, max_in_memory: int = DEFAULT_MAX_IN_MEMORY):
+        """
+        Args:
+            max_in_memory: 内存中最多保留的发现条数，超过后溢出到磁盘
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_in_memory = max_in_memory
+        self.memory = {}
+        self.weight = 0
+        self.conn = None
+        self.spilled = 0
+        self.lock = threading.Lock()
+
+    def __setitem__(self, key: str, value: Dict[str, Any]):
+        weight = 1 + len(value.get('findings', ()))
+        with self.lock:
+            if self.conn is None and self.weight + weight <= self.max_in_memory:
+                self.memory[key] = value
+                self.weight += weight
+                return
+            if key in self.memory:
+                del self.memory[key]
+            if self.conn is None:
+                # 空文件名表示私有临时库，页面缓存满后写入临时文件，关闭连接时删除
+                self.conn = sqlite3.connect('', check_same_thread=False)
+                self.conn.execute('CREATE TABLE items (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                self.logger.info(f'In-memory result cap of {self.max_in_memory} findings reached, '
+                                 f'spilling further results to disk')
+            cursor = self.conn.execute('INSERT OR REPLACE INTO items (key, value) VALUES (?, ?)',
+                                       (key, json.dumps(value, ensure_ascii=False)))
+            self.spilled += cursor.rowcount
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                return value
+            row = None
+            if self.conn is not None:
+                row = self.conn.execute('SELECT value FROM items WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        with self.lock:
+            if key in self.memory:
+                return True
+            return self.conn is not None and \
+                self.conn.execute('SELECT 1 FROM items WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            spilled = self.conn.execute('SELECT COUNT(*) FROM items').fetchone()[0] if self.conn else 0
+            return len(self.memory) + spilled
+
+    def __iter__(self) -> Iterator[str]:
+        for key, _ in self._iter_rows(keys_only=True):
+            yield key
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        return self._iter_rows()
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        for _, value in self._iter_rows():
+            yield value
+
+    def _iter_rows(self, keys_only: bool = False) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        with self.lock:
+            in_memory = list(self.memory.items())
+        yield from in_memory
+        if self.conn is None:
+            return
+        # 分页读取，遍历期间不长时间持有锁，也不把溢出的结果一次性读回内存
+        column = 'NULL' if keys_only else 'value'
+        last = ''
+        while True:
+            with self.lock:
+                rows = self.conn.execute(f'SELECT key, {column} FROM items WHERE key > ? ORDER BY key LIMIT 1000',
+                                         (last,)).fetchall()
+            if not rows:
+                return
+            for key, value in rows:
+                yield key, None if keys_only else json.loads(value)
+            last = rows[-1][0]
+
+    def close(self):
+        """删除溢出到磁盘的结果"""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            self.memory.clear()
+            self.weight = 0
@@ -0,0 +1,767 @@
+import ast
+import builtins
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Set, Tuple
+from rule_engine import MAX_MATCH_LENGTH
+
+DEFAULT_SUMMARY_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'taint_summaries.db')
+
+# 分析逻辑变化时递增，使缓存的函数摘要和审计清单中的旧结果失效
+TAINT_VERSION = 2
+# 循环体分析的遍数，使循环中靠后的赋值能影响下一轮迭代中靠前的使用
+LOOP_PASSES = 2
+# 相互递归的函数迭代计算摘要的最多轮数
+MAX_FIXPOINT_ROUNDS = 3
+# 内存中最多保留的函数摘要数
+MAX_MEMORY_SUMMARIES = 20000
+
+MODULE = '<module>'
+
+# 外部输入来源
+SOURCE_LABELS = {'request': '请求参数', 'user_input': '用户输入', 'argv': '命令行参数', 'env': '环境变量',
+                 'file': '文件内容'}
+# 来源可被远程攻击者直接控制时为高危
+SOURCE_SEVERITY = {'request': 'high', 'user_input': 'high', 'argv': 'medium', 'env': 'medium', 'file': 'medium'}
+SOURCE_CALLS = {
+    'input': 'user_input', 'raw_input': 'user_input', 'sys.stdin.read': 'user_input',
+    'sys.stdin.readline': 'user_input', 'sys.stdin.readlines': 'user_input',
+    'os.getenv': 'env', 'os.environ.get': 'env', 'os.getenvb': 'env',
+    'open': 'file', 'io.open': 'file', 'codecs.open': 'file'
+}
+SOURCE_ATTRIBUTES = {'os.environ': 'env', 'os.environb': 'env', 'sys.argv': 'argv', 'sys.stdin': 'user_input'}
+# 任意对象上的这些方法返回文件内容
+SOURCE_METHODS = {'read_text': 'file', 'read_bytes': 'file'}
+# Flask/Django/DRF等框架的请求对象属性，如request.args、self.request.GET
+REQUEST_PATTERN = re.compile(
+    r'(?:^|\.)request\.(?:args|form|values|json|data|files|cookies|headers|get_json|get_data|'
+    r'GET|POST|COOKIES|META|FILES|body|query_params|query_string|path_params)$')
+
+# 危险函数（sink）
+SINK_LABELS = {'code_exec': '动态代码执行', 'command_exec': '命令执行', 'sql_injection': 'SQL执行',
+               'deserialization': '反序列化'}
+SINK_CALLS = {
+    'eval': 'code_exec', 'exec': 'code_exec', 'compile': 'code_exec',
+    'builtins.eval': 'code_exec', 'builtins.exec': 'code_exec',
+    'os.system': 'command_exec', 'os.popen': 'command_exec', 'subprocess.getoutput': 'command_exec',
+    'subprocess.getstatusoutput': 'command_exec', 'commands.getoutput': 'command_exec',
+    'subprocess.call': 'command_exec', 'subprocess.run': 'command_exec', 'subprocess.Popen': 'command_exec',
+    'subprocess.check_call': 'command_exec', 'subprocess.check_output': 'command_exec',
+    'pickle.loads': 'deserialization', 'pickle.load': 'deserialization', 'cPickle.loads': 'deserialization',
+    'marshal.loads': 'deserialization', 'dill.loads': 'deserialization', 'jsonpickle.decode': 'deserialization',
+    'yaml.load': 'deserialization', 'yaml.unsafe_load': 'deserialization', 'yaml.load_all': 'deserialization',
+    'sqlalchemy.text': 'sql_injection'
+}
+# os.exec*/os.spawn*的每个参数都是命令的一部分
+SINK_PREFIXES = {'os.exec': 'command_exec', 'os.spawn': 'command_exec'}
+# 数据库游标/连接上执行SQL的方法，只检查第一个参数（SQL语句），参数化查询的参数是安全的
+SQL_METHODS = {'execute', 'executemany', 'executescript', 'raw'}
+# 不带shell=True时参数不经过shell解析，只能注入参数，降低一级
+SHELL_OPTIONAL = {'subprocess.call', 'subprocess.run', 'subprocess.Popen', 'subprocess.check_call',
+                  'subprocess.check_output'}
+# 按关键字传入时被检查的参数名
+SINK_KEYWORDS = {'args', 'cmd', 'command', 'source', 'code', 'data', 's', 'sql', 'query', 'statement', 'operation',
+                 'stream', 'file', 'expression', 'object', 'string'}
+
+# 返回值不再携带污点的函数（类型转换、转义和哈希）
+SANITIZERS = {'int', 'float', 'bool', 'len', 'abs', 'round', 'hash', 'id', 'isinstance', 'issubclass', 'callable',
+              'hasattr', 'type', 'ord', 'shlex.quote', 'pipes.quote', 'html.escape', 'markupsafe.escape',
+              're.escape', 'os.path.exists', 'os.path.isfile', 'os.path.isdir', 'uuid.UUID'}
+
+# 解码或解压得到的内容（如藏在常量中的载荷）无法确认安全，结果带有OPAQUE标签
+DECODER_PATTERN = re.compile(r'(?:decode|decompress|unhexlify|fromhex|^a2b_\w+)', re.IGNORECASE)
+
+BUILTIN_NAMES = set(dir(builtins))
+DOWNGRADE = {'high': 'medium', 'medium': 'low', 'low': 'low'}
+
+# 污点标签：('src', 来源类别, 所在函数, 相对行号)、('param', 参数序号)、('global', 模块变量名)、('unknown',)
+UNKNOWN = ('unknown',)
+OPAQUE = ('opaque',)
+
+
+def _freeze(value):
+    """把从JSON读出的列表还原为元组，使摘要中的标签可以放入集合"""
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _freeze(v) for k, v in value.items()}
+    return value
+
+
+class _Function:
+    """模块中的一个函数或方法"""
+
+    def __init__(self, qualname: str, node, class_name: Optional[str]):
+        self.qualname = qualname
+        self.node = node
+        self.class_name = class_name
+        args = node.args
+        positional = args.posonlyargs + args.args
+        self.params = [a.arg for a in positional]
+        self.positional = len(self.params)
+        self.vararg = self.kwarg = None
+        if args.vararg is not None:
+            self.vararg = len(self.params)
+            self.params.append(args.vararg.arg)
+        self.params.extend(a.arg for a in args.kwonlyargs)
+        if args.kwarg is not None:
+            self.kwarg = len(self.params)
+            self.params.append(args.kwarg.arg)
+        decorators = {d.id for d in node.decorator_list if isinstance(d, ast.Name)}
+        # 通过实例或类调用时第一个参数绑定为接收者
+        self.bound = class_name is not None and 'staticmethod' not in decorators and self.positional > 0
+        # 由_Module._scan填充，不含嵌套函数中的名字和调用
+        self.stored = set()
+        self.loaded = set()
+        self.calls = []
+
+
+class _Module:
+    """一个Python文件的导入别名、模块变量和函数表，用于解析名字和同一文件内的调用"""
+
+    def __init__(self, tree, source: str):
+        self.lines = source.splitlines()
+        self.imports = {}
+        self.functions = {}
+        self.by_name = {}
+        self.classes = set()
+        self.globals = set()
+        # 在函数中用global声明后重新赋值的模块变量，顶层代码的分析结果不能代表其取值
+        self.rebound = set()
+        self.defined = set()
+        self.body = []
+        # 函数和类定义节点到其所属范围的映射，类体中的名字不属于任何函数
+        self.owners = {}
+        self._collect(tree.body, '', None, top=True)
+        self._scan(tree)
+
+    def _collect(self, body, prefix: str, class_name: Optional[str], top: bool = False):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = prefix + node.name
+                self.functions[qualname] = _Function(qualname, node, class_name)
+                self.owners[id(node)] = qualname
+                self.by_name.setdefault(node.name, []).append(qualname)
+                if top:
+                    self.defined.add(node.name)
+                self._collect(node.body, qualname + '.', None)
+            elif isinstance(node, ast.ClassDef):
+                self.owners[id(node)] = ''
+                if top:
+                    self.defined.add(node.name)
+                    self.classes.add(node.name)
+                self._collect(node.body, prefix + node.name + '.', node.name if not prefix or class_name else None)
+            elif top:
+                self.body.append(node)
+
+    def _scan(self, tree):
+        """遍历一次语法树，收集导入别名、模块变量，以及每个函数中赋值和引用的名字、调用的函数"""
+        stack = [(tree, None)]
+        while stack:
+            node, owner = stack.pop()
+            if isinstance(node, ast.Name):
+                if owner:
+                    function = self.functions[owner]
+                    (function.stored if isinstance(node.ctx, ast.Store) else function.loaded).add(node.id)
+                elif owner is None and isinstance(node.ctx, ast.Store):
+                    self.globals.add(node.id)
+                continue
+            if isinstance(node, ast.Call) and owner:
+                self.functions[owner].calls.append(node.func)
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.asname:
+                        self.imports[alias.asname] = alias.name
+                    else:
+                        self.imports[alias.name.split('.')[0]] = alias.name.split('.')[0]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                for alias in node.names:
+                    self.imports[alias.asname or alias.name] = f'{node.module}.{alias.name}'
+            elif isinstance(node, ast.Global) and owner:
+                self.rebound.update(node.names)
+            for child in ast.iter_child_nodes(node):
+                stack.append((child, self.owners.get(id(child), owner)))
+
+    def segment(self, node) -> str:
+        """节点所在行的源码，ast.get_source_segment每次调用都会重新切分整个文件"""
+        return '\n'.join(self.lines[node.lineno - 1:node.end_lineno])
+
+    def dotted(self, node) -> Optional[str]:
+        """把Name/Attribute链还原为带导入路径的名字，如sp.run -> subprocess.run"""
+        if isinstance(node, ast.Name):
+            return self.imports.get(node.id, node.id)
+        if isinstance(node, ast.Attribute):
+            base = self.dotted(node.value)
+            return f'{base}.{node.attr}' if base else None
+        return None
+
+    def classify(self, name: str) -> str:
+        """函数中引用的非局部名字的类别，决定其污点标签"""
+        if name in self.globals:
+            return 'global'
+        if name in self.imports or name in self.defined or name in BUILTIN_NAMES:
+            return 'known'
+        return 'unknown'
+
+    def resolve(self, func, class_name: Optional[str]) -> Optional[Tuple[str, bool]]:
+        """
+        解析同一文件内的被调函数
+        Returns:
+            (函数限定名, 是否把接收者绑定为第一个参数)，无法解析时返回None
+        """
+        if isinstance(func, ast.Name):
+            return (func.id, False) if func.id in self.functions and func.id not in self.imports else None
+        if not isinstance(func, ast.Attribute):
+            return None
+        value = func.value
+        if isinstance(value, ast.Name):
+            if value.id in ('self', 'cls') and class_name:
+                qualname = f'{class_name}.{func.attr}'
+                if qualname in self.functions:
+                    return qualname, self.functions[qualname].bound
+            if value.id in self.classes:
+                qualname = f'{value.id}.{func.attr}'
+                if qualname in self.functions:
+                    return qualname, False
+            if value.id in self.imports:
+                return None
+        # 其他对象上的方法调用：同名方法在文件中唯一时才解析
+        methods = [q for q in self.by_name.get(func.attr, []) if self.functions[q].class_name]
+        if len(methods) == 1:
+            return methods[0], self.functions[methods[0]].bound
+        return None
+
+
+class _FunctionAnalyzer:
+    """对单个函数（或模块顶层代码）做流敏感的污点传播，得到函数摘要"""
+
+    def __init__(self, module: _Module, function: Optional[_Function], summaries: Dict[str, Dict[str, Any]]):
+        self.module = module
+        self.function = function
+        self.summaries = summaries
+        self.qualname = function.qualname if function else MODULE
+        self.start = function.node.lineno if function else 0
+        self.class_name = function.class_name if function else None
+        self.returns = set()
+        self.sinks = set()
+        self.findings = set()
+        self.clean = {}
+        self.dirty = set()
+        self.env = {}
+        if function is not None:
+            self.env = {name: {('param', i)} for i, name in enumerate(function.params)}
+            self.locals = set(function.params) | function.stored
+        else:
+            self.locals = set(module.globals)
+
+    def run(self) -> Dict[str, Any]:
+        body = self.function.node.body if self.function else self.module.body
+        self.env = self.block(body, self.env)
+        return {
+            'returns': sorted(self.returns),
+            'sinks': sorted(self.sinks),
+            'findings': sorted(self.findings),
+            'clean': sorted((line, tuple(sorted(names))) for line, names in self.clean.items()
+                            if line not in self.dirty)
+        }
+
+    def rel(self, node) -> int:
+        return node.lineno - self.start
+
+    # ---- 语句 ----
+
+    def block(self, statements, env):
+        for statement in statements:
+            env = self.statement(statement, env)
+        return env
+
+    @staticmethod
+    def merge(first, second):
+        merged = dict(first)
+        for name, labels in second.items():
+            merged[name] = merged[name] | labels if name in merged else labels
+        return merged
+
+    def statement(self, node, env):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            # 嵌套的函数和类单独分析
+            env[node.name] = set()
+        elif isinstance(node, ast.Assign):
+            labels = self.expr(node.value, env)
+            for target in node.targets:
+                self.assign(target, labels, env)
+        elif isinstance(node, ast.AnnAssign):
+            if node.value is not None:
+                self.assign(node.target, self.expr(node.value, env), env)
+        elif isinstance(node, ast.AugAssign):
+            self.assign(node.target, self.expr(node.value, env) | self.expr(node.target, env), env)
+        elif isinstance(node, ast.Return):
+            self.returns |= self.expr(node.value, env)
+        elif isinstance(node, ast.If):
+            self.expr(node.test, env)
+            env = self.merge(self.block(node.body, dict(env)), self.block(node.orelse, dict(env)))
+        elif isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            iterated = self.expr(node.iter if not isinstance(node, ast.While) else node.test, env)
+            loop_env = dict(env)
+            for _ in range(LOOP_PASSES):
+                if not isinstance(node, ast.While):
+                    self.assign(node.target, iterated, loop_env)
+                loop_env = self.merge(loop_env, self.block(node.body, dict(loop_env)))
+            env = self.block(node.orelse, self.merge(env, loop_env))
+        elif isinstance(node, (ast.With, ast.AsyncWith)):
+            for item in node.items:
+                labels = self.expr(item.context_expr, env)
+                if item.optional_vars is not None:
+                    self.assign(item.optional_vars, labels, env)
+            env = self.block(node.body, env)
+        elif isinstance(node, (ast.Try, getattr(ast, 'TryStar', ast.Try))):
+            merged = self.merge(env, self.block(node.body, dict(env)))
+            for handler in node.handlers:
+                handler_env = dict(merged)
+                if handler.name:
+                    handler_env[handler.name] = set()
+                merged = self.merge(merged, self.block(handler.body, handler_env))
+            env = self.block(node.finalbody, self.block(node.orelse, merged))
+        elif hasattr(ast, 'Match') and isinstance(node, ast.Match):
+            subject = self.expr(node.subject, env)
+            merged = dict(env)
+            for case in node.cases:
+                case_env = dict(env)
+                for capture in ast.walk(case.pattern):
+                    name = getattr(capture, 'name', None)
+                    if isinstance(name, str):
+                        case_env[name] = set(subject)
+                merged = self.merge(merged, self.block(case.body, case_env))
+            env = merged
+        else:
+            # 表达式语句、raise、assert、del等：只需检查其中的调用
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, ast.expr):
+                    self.expr(child, env)
+        return env
+
+    def assign(self, target, labels, env):
+        if isinstance(target, ast.Name):
+            env[target.id] = set(labels)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self.assign(element, labels, env)
+        elif isinstance(target, ast.Starred):
+            self.assign(target.value, labels, env)
+        elif isinstance(target, ast.Attribute):
+            key = self._key(target)
+            if key is not None:
+                env[key] = set(labels)
+        elif isinstance(target, ast.Subscript):
+            # 容器的某个元素被赋值，按弱更新合并到整个容器
+            key = self._key(target.value)
+            if key is not None:
+                env[key] = env.get(key, set()) | labels
+
+    @staticmethod
+    def _key(node) -> Optional[str]:
+        """局部变量和self.x这类属性在环境中的键"""
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Attribute):
+            base = _FunctionAnalyzer._key(node.value)
+            return f'{base}.{node.attr}' if base else None
+        return None
+
+    # ---- 表达式 ----
+
+    def expr(self, node, env) -> Set[tuple]:
+        if node is None or isinstance(node, ast.Constant):
+            return set()
+        if isinstance(node, ast.Name):
+            return self.name(node.id, env)
+        if isinstance(node, ast.Attribute):
+            dotted = self.module.dotted(node)
+            kind = self._attribute_source(dotted)
+            if kind:
+                return {('src', kind, self.qualname, self.rel(node))}
+            key = self._key(node)
+            if key is not None and key in env:
+                return set(env[key])
+            return self.expr(node.value, env)
+        if isinstance(node, ast.Subscript):
+            self.expr(node.slice, env)
+            return self.expr(node.value, env)
+        if isinstance(node, ast.Call):
+            return self.call(node, env)
+        if isinstance(node, ast.Lambda):
+            return set()
+        if isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+            inner = dict(env)
+            for generator in node.generators:
+                self.assign(generator.target, self.expr(generator.iter, inner), inner)
+                for condition in generator.ifs:
+                    self.expr(condition, inner)
+            if isinstance(node, ast.DictComp):
+                return self.expr(node.key, inner) | self.expr(node.value, inner)
+            return self.expr(node.elt, inner)
+        if isinstance(node, ast.NamedExpr):
+            labels = self.expr(node.value, env)
+            self.assign(node.target, labels, env)
+            return labels
+        labels = set()
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.expr):
+                labels |= self.expr(child, env)
+        # 比较和布尔判断的结果不携带输入内容
+        return set() if isinstance(node, ast.Compare) else labels
+
+    def name(self, name: str, env) -> Set[tuple]:
+        if name in env:
+            return set(env[name])
+        if name in self.locals:
+            return set()
+        if self.function is None:
+            return set() if self.module.classify(name) != 'unknown' else {UNKNOWN}
+        category = self.module.classify(name)
+        if category == 'global':
+            return {('global', name)}
+        return set() if category == 'known' else {UNKNOWN}
+
+    @staticmethod
+    def _attribute_source(dotted: Optional[str]) -> Optional[str]:
+        if not dotted:
+            return None
+        if dotted in SOURCE_ATTRIBUTES:
+            return SOURCE_ATTRIBUTES[dotted]
+        return 'request' if REQUEST_PATTERN.search(dotted) else None
+
+    def call(self, node, env) -> Set[tuple]:
+        name = self.module.dotted(node.func)
+        method = node.func.attr if isinstance(node.func, ast.Attribute) else None
+        receiver = self.expr(node.func.value, env) if method else set()
+        args = [self.expr(a.value if isinstance(a, ast.Starred) else a, env) for a in node.args]
+        keywords = [(k.arg, self.expr(k.value, env)) for k in node.keywords]
+        self._check_sink(node, name, method, args, keywords)
+
+        kind = SOURCE_CALLS.get(name) or (SOURCE_METHODS.get(method) if method else None)
+        if kind:
+            return {('src', kind, self.qualname, self.rel(node))}
+        if name in SANITIZERS or (name or '').startswith('hashlib.'):
+            return set()
+        target = self.module.resolve(node.func, self.class_name)
+        if target is not None:
+            labels = self.apply(target, args, keywords, receiver)
+        else:
+            # 未知函数：返回值按参数和接收者的污点传播
+            labels = set(receiver)
+            for value in args:
+                labels |= value
+            for _, value in keywords:
+                labels |= value
+        if DECODER_PATTERN.search(method or (name or '').rsplit('.', 1)[-1]):
+            labels.add(OPAQUE)
+        return labels
+
+    def _check_sink(self, node, name: Optional[str], method: Optional[str], args, keywords):
+        kind = SINK_CALLS.get(name) if name else None
+        if kind is None and name:
+            kind = next((k for prefix, k in SINK_PREFIXES.items() if name.startswith(prefix)), None)
+        if kind is None and method in SQL_METHODS and name not in SINK_CALLS:
+            kind, name = 'sql_injection', f'.{method}()'
+        if kind is None:
+            return
+        keyword_values = dict(keywords)
+        if name.startswith('yaml.load') and any(
+                k.arg == 'Loader' and (self.module.dotted(k.value) or '').endswith('SafeLoader')
+                for k in node.keywords):
+            return
+        if name.startswith(tuple(SINK_PREFIXES)):
+            labels = set().union(*args) if args else set()
+            checked = node.args
+        elif args:
+            labels = args[0]
+            checked = node.args[:1]
+        else:
+            labels = set().union(*(v for k, v in keyword_values.items() if k in SINK_KEYWORDS))
+            checked = [k.value for k in node.keywords if k.arg in SINK_KEYWORDS]
+        shell = keyword_values.get('shell') is not None and any(
+            k.arg == 'shell' and not (isinstance(k.value, ast.Constant) and not k.value.value) for k in node.keywords)
+        downgrade = name in SHELL_OPTIONAL and not shell
+        location = (self.qualname, self.rel(node))
+        self.sink(labels, kind, location, name, downgrade)
+        # 动态代码执行即使参数是常量也可能是解码后的载荷，不做安全确认
+        if kind != 'code_exec' and checked and all(self._plain(n) for n in checked) and \
+                all(label[0] == 'global' for label in labels):
+            names = self.clean.setdefault(location[1], set())
+            names.update(label[1] for label in labels)
+        else:
+            self.dirty.add(location[1])
+
+    def _plain(self, node) -> bool:
+        """参数是字面量，或直接引用的模块变量（其取值在模块分析后确认不带污点）"""
+        if isinstance(node, ast.Constant):
+            return True
+        if isinstance(node, (ast.Tuple, ast.List)):
+            return all(self._plain(element) for element in node.elts)
+        if isinstance(node, ast.Name):
+            return node.id in self.module.globals and node.id not in self.module.rebound and \
+                (self.function is None or node.id not in self.locals)
+        return False
+
+    def sink(self, labels, kind: str, location, sink_name: str, downgrade: bool):
+        """污点到达危险函数：来自外部输入时记为发现，来自参数或模块变量时记入摘要留待调用方或模块解析"""
+        for label in labels:
+            if label[0] == 'src':
+                self.findings.add((label, kind, location, sink_name, downgrade))
+            elif label[0] in ('param', 'global'):
+                self.sinks.add((label, kind, location, sink_name, downgrade))
+
+    def apply(self, target: Tuple[str, bool], args, keywords, receiver) -> Set[tuple]:
+        """在调用点套用被调函数的摘要"""
+        qualname, bind = target
+        callee = self.module.functions[qualname]
+        summary = self.summaries.get(qualname)
+        positional = ([receiver] if bind else []) + args
+        mapping = {}
+        for i, labels in enumerate(positional):
+            index = i if i < callee.positional else callee.vararg
+            if index is not None:
+                mapping[index] = mapping.get(index, set()) | labels
+        for keyword, labels in keywords:
+            index = callee.params.index(keyword) if keyword in callee.params else callee.kwarg
+            if index is not None:
+                mapping[index] = mapping.get(index, set()) | labels
+        if summary is None:
+            # 递归调用的摘要尚未算出，按未知函数处理
+            return set().union(*mapping.values()) if mapping else set()
+        result = set()
+        for label in summary['returns']:
+            result |= mapping.get(label[1], set()) if label[0] == 'param' else {label}
+        for label, kind, location, sink_name, downgrade in summary['sinks']:
+            if label[0] == 'param':
+                self.sink(mapping.get(label[1], set()), kind, location, sink_name, downgrade)
+        return result
+
+
+class SummaryCache:
+    """函数摘要的SQLite持久缓存，键为函数代码、所在上下文和被调函数摘要键的哈希"""
+
+    def __init__(self, db_path: str = DEFAULT_SUMMARY_CACHE_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL, '
+                          'created_at REAL NOT NULL)')
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute('SELECT summary FROM summaries WHERE key = ?', (key,)).fetchone()
+        return _freeze(json.loads(row[0])) if row else None
+
+    def put_many(self, items: List[Tuple[str, Dict[str, Any]]]):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany('INSERT OR IGNORE INTO summaries VALUES (?, ?, ?)',
+                                  [(key, json.dumps(summary), now) for key, summary in items])
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class TaintAnalyzer:
+    """
+    Python源码的污点分析：跟踪请求参数、环境变量、命令行参数和文件内容等外部输入，
+    经赋值、容器、字符串拼接和同一文件内的函数调用传播到eval/exec、命令执行、SQL执行和反序列化时报告。
+    每个函数计算一份摘要（哪些参数流向返回值和危险函数），按函数代码的哈希缓存，
+    代码未变化的函数不再重新分析，调用方直接套用摘要
+    """
+
+    def __init__(self, cache_path: Optional[str] = DEFAULT_SUMMARY_CACHE_PATH):
+        """
+        Args:
+            cache_path: 函数摘要缓存文件路径，None表示只在内存中缓存
+        """
+        self.logger = logging.getLogger(__name__)
+        self.cache = SummaryCache(cache_path) if cache_path else None
+        self.memory = {}
+        self.stats = {'functions': 0, 'cached': 0}
+
+    def analyze(self, content: str, path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        分析单个Python文件
+        Returns:
+            findings为与规则命中格式相同的污点发现；clean_lines为危险函数调用中参数可确认不来自外部输入的行号；
+            parsed表示文件是否成功解析
+        """
+        try:
+            tree = ast.parse(content)
+            module = _Module(tree, content)
+            summaries, cached = self._summarize(module)
+            top = _FunctionAnalyzer(module, None, summaries)
+            summaries[MODULE] = top.run()
+            findings, clean_lines = self._resolve(module, summaries, top.env, content)
+        except (SyntaxError, ValueError, RecursionError) as e:
+            self.logger.debug(f'Taint analysis skipped for {path or "<code>"}: {e}')
+            return {'findings': [], 'clean_lines': [], 'parsed': False}
+        self.stats['functions'] += len(module.functions)
+        self.stats['cached'] += cached
+        return {'findings': findings, 'clean_lines': clean_lines, 'parsed': True}
+
+    def _summarize(self, module: _Module) -> Tuple[Dict[str, Dict[str, Any]], int]:
+        """按调用图自底向上计算各函数的摘要，相互递归的函数迭代到摘要不再变化"""
+        callees, free_names = {}, {}
+        for qualname, function in module.functions.items():
+            callees[qualname], free_names[qualname] = self._references(module, function)
+        context = hashlib.sha256(json.dumps(sorted(module.imports.items())).encode('utf-8')).hexdigest()
+        summaries, keys, cached, pending = {}, {}, 0, []
+        for component in self._components(callees):
+            members = set(component)
+            shared = [module.segment(module.functions[q].node) for q in sorted(members)] if len(component) > 1 else []
+            for qualname in component:
+                function = module.functions[qualname]
+                outside = sorted((c, keys[c]) for c in callees[qualname] if c not in members)
+                raw = json.dumps([TAINT_VERSION, context, qualname, function.bound, module.segment(function.node),
+                                  outside, free_names[qualname], shared])
+                keys[qualname] = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+            found = {q: self._lookup(keys[q]) for q in component}
+            if all(summary is not None for summary in found.values()):
+                summaries.update(found)
+                cached += len(component)
+                continue
+            recursive = len(component) > 1 or component[0] in callees[component[0]]
+            for _ in range(MAX_FIXPOINT_ROUNDS if recursive else 1):
+                computed = {q: _FunctionAnalyzer(module, module.functions[q], summaries).run() for q in component}
+                stable = all(summaries.get(q) == computed[q] for q in component)
+                summaries.update(computed)
+                if stable:
+                    break
+            for qualname in component:
+                summary = _freeze(json.loads(json.dumps(summaries[qualname])))
+                summaries[qualname] = summary
+                self._remember(keys[qualname], summary)
+                pending.append((keys[qualname], summary))
+        if pending and self.cache is not None:
+            self.cache.put_many(pending)
+        return summaries, cached
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        summary = self.memory.get(key)
+        if summary is None and self.cache is not None:
+            summary = self.cache.get(key)
+            if summary is not None:
+                self._remember(key, summary)
+        return summary
+
+    def _remember(self, key: str, summary: Dict[str, Any]):
+        if len(self.memory) >= MAX_MEMORY_SUMMARIES:
+            self.memory.clear()
+        self.memory[key] = summary
+
+    @staticmethod
+    def _references(module: _Module, function: _Function) -> Tuple[Set[str], List[Tuple[str, str]]]:
+        """
+        Returns:
+            同一文件内的被调函数，以及函数引用的非局部名字及其类别（类别变化时摘要随之失效，如新增同名模块变量）
+        """
+        callees = set()
+        for func in function.calls:
+            target = module.resolve(func, function.class_name)
+            if target is not None:
+                callees.add(target[0])
+        free = function.loaded - function.stored - set(function.params)
+        return callees, sorted((name, module.classify(name)) for name in free)
+
+    @staticmethod
+    def _components(graph: Dict[str, Set[str]]) -> List[List[str]]:
+        """Tarjan强连通分量，按被调函数在前的顺序返回"""
+        index, low, stack, on_stack, result = {}, {}, [], set(), []
+        counter = [0]
+
+        def visit(node):
+            index[node] = low[node] = counter[0]
+            counter[0] += 1
+            stack.append(node)
+            on_stack.add(node)
+            for successor in sorted(graph[node]):
+                if successor not in index:
+                    visit(successor)
+                    low[node] = min(low[node], low[successor])
+                elif successor in on_stack:
+                    low[node] = min(low[node], index[successor])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                result.append(sorted(component))
+
+        for node in sorted(graph):
+            if node not in index:
+                visit(node)
+        return result
+
+    @staticmethod
+    def _resolve(module: _Module, summaries: Dict[str, Dict[str, Any]], module_env: Dict[str, Set[tuple]],
+                 content: str) -> Tuple[List[Dict[str, Any]], List[int]]:
+        """把各函数摘要中的流转换为发现，模块变量按顶层代码分析结果解析"""
+        def line_of(qualname, rel):
+            return rel if qualname == MODULE else module.functions[qualname].node.lineno + rel
+
+        flows = []
+        for summary in summaries.values():
+            flows.extend(summary['findings'])
+            for label, kind, location, sink_name, downgrade in summary['sinks']:
+                if label[0] == 'global':
+                    flows.extend((source, kind, location, sink_name, downgrade)
+                                 for source in module_env.get(label[1], ()) if source[0] == 'src')
+        best = {}
+        for source, kind, location, sink_name, downgrade in flows:
+            sink_line = line_of(*location)
+            source_line = line_of(source[2], source[3])
+            key = (sink_line, kind, source[1])
+            if key not in best or source_line < best[key][0]:
+                best[key] = (source_line, sink_name, downgrade)
+
+        lines = content.split('\n')
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line) + 1)
+        findings = []
+        for (sink_line, kind, source_kind), (source_line, sink_name, downgrade) in sorted(best.items()):
+            severity = SOURCE_SEVERITY[source_kind]
+            if downgrade:
+                severity = DOWNGRADE[severity]
+            text = lines[sink_line - 1] if 0 < sink_line <= len(lines) else ''
+            findings.append({
+                'rule_id': f'taint-{kind.replace("_", "-")}',
+                'name': f'Python污点：{SOURCE_LABELS[source_kind]}流入{SINK_LABELS[kind]}',
+                'severity': severity,
+                'category': kind,
+                'description': f'{SOURCE_LABELS[source_kind]}（第{source_line}行）未经过滤传入{sink_name}'
+                               f'（第{sink_line}行）' + ('，未使用shell=True时只能注入参数' if downgrade else ''),
+                'line': sink_line,
+                'offset': offsets[sink_line - 1] + len(text) - len(text.lstrip()) if sink_line <= len(lines) else 0,
+                'match': text.strip()[:MAX_MATCH_LENGTH],
+                'source_line': source_line
+            })
+        tainted = {f['line'] for f in findings}
+        clean_lines = set()
+        for qualname, summary in summaries.items():
+            for rel, names in summary['clean']:
+                line = line_of(qualname, rel)
+                if line not in tainted and all(not module_env.get(name) for name in names):
+                    clean_lines.add(line)
+        return findings, sorted(clean_lines)
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,206 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+class Span:
+    """一段被计时的操作，记录墙钟时间、所在线程的CPU时间和附加的计数参数"""
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start', 'cpu_start', 'profiler')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.profiler = None
+
+    def __enter__(self) -> 'Span':
+        if self.name == self.tracer.profile_stage:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu_start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.tracer._save_profile(self.name, self.profiler)
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._finish(self.name, self.category, self.start, wall, cpu, self.args)
+        return False
+
+    def set(self, **args):
+        """设置参数，已有的值被覆盖"""
+        self.args.update(args)
+
+    def add(self, **values):
+        """累加计数参数，如bytes、files"""
+        for key, value in values.items():
+            self.args[key] = self.args.get(key, 0) + value
+
+
+class _NullSpan:
+    """未启用追踪时使用的空操作span，所有实例共享"""
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def add(self, **values):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    审计各阶段的追踪器：收集span、计数器和各服务商的请求/token/费用统计，
+    可导出为Chrome Trace Event格式（chrome://tracing、Perfetto均可打开）。
+    未启用时span()返回共享的空操作对象，count()等直接返回，对审计性能几乎没有影响
+    """
+
+    def __init__(self, enabled: bool = True, profile_stage: Optional[str] = None,
+                 profile_path: Optional[str] = None):
+        """
+        Args:
+            enabled: 是否记录span和计数
+            profile_stage: 需要用cProfile剖析的span名称（如static），只剖析执行该span的线程
+            profile_path: 剖析结果的保存路径（pstats格式），None时只在日志中输出耗时最多的函数
+        """
+        self.logger = logging.getLogger(__name__)
+        self.enabled = enabled
+        self.profile_stage = profile_stage if enabled else None
+        self.profile_path = profile_path
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = {}
+        self.stages = {}
+        self.counters = {}
+        self.providers = {}
+
+    def span(self, name: str, category: str = 'audit', **args):
+        """
+        创建span，配合with语句使用
+        Args:
+            name: span名称，同名span在汇总中合并统计
+            category: 类别，用于在追踪查看器中过滤
+            args: 附加参数
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def record(self, name: str, category: str, start: float, wall: float, cpu: float,
+               pid: Optional[int] = None, **args):
+        """
+        记录在其他进程中完成的span（如静态审计工作进程），时间为time.perf_counter()的值，
+        Linux和Windows上该时钟在进程间可比
+        """
+        if not self.enabled:
+            return
+        self._finish(name, category, start, wall, cpu, args, pid=pid)
+
+    def count(self, name: str, **values):
+        """累加计数器，如count('crawl', files=1, bytes=1024)"""
+        if not self.enabled:
+            return
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            for key, value in values.items():
+                counter[key] = counter.get(key, 0) + value
+
+    def record_request(self, provider: str, prompt_tokens: int, completion_tokens: int,
+                       cost: float, error: bool = False):
+        """累加服务商的请求数、token用量和估算费用"""
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.providers.setdefault(provider, {'requests': 0, 'errors': 0, 'prompt_tokens': 0,
+                                                         'completion_tokens': 0, 'cost': 0.0})
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+            stats['cost'] += cost
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        返回汇总统计
+        Returns:
+            stages为各span名称的次数、墙钟时间和CPU时间（秒），counters为计数器，providers为各服务商用量
+        """
+        with self.lock:
+            stages = {name: {key: round(value, 4) if isinstance(value, float) else value
+                             for key, value in stats.items()}
+                      for name, stats in self.stages.items()}
+            providers = {name: dict(stats, cost=round(stats['cost'], 6)) for name, stats in self.providers.items()}
+            return {'stages': stages, 'counters': {k: dict(v) for k, v in self.counters.items()},
+                    'providers': providers}
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """转换为Chrome Trace Event格式"""
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'audit'}}]
+        for (event_pid, tid), name in threads.items():
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': event_pid, 'tid': tid, 'args': {'name': name}})
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms', 'otherData': self.summary()}
+
+    def export(self, path: str):
+        """把追踪结果写入JSON文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        self.logger.info(f'Trace with {len(self.events)} spans written to {path}')
+
+    def _finish(self, name: str, category: str, start: float, wall: float, cpu: float,
+                args: Dict[str, Any], pid: Optional[int] = None):
+        if pid is None:
+            pid, tid, thread_name = os.getpid(), threading.get_ident(), threading.current_thread().name
+        else:
+            tid, thread_name = pid, f'worker-{pid}'
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                 'ts': round((start - self.origin) * 1e6, 1), 'dur': round(wall * 1e6, 1),
+                 'args': dict(args, cpu_ms=round(cpu * 1000, 3))}
+        with self.lock:
+            self.events.append(event)
+            self.threads.setdefault((pid, tid), thread_name)
+            stats = self.stages.setdefault(name, {'count': 0, 'wall': 0.0, 'cpu': 0.0})
+            stats['count'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            for key, value in args.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats[key] = stats.get(key, 0) + value
+
+    def _save_profile(self, name: str, profiler: cProfile.Profile):
+        if self.profile_path:
+            profiler.dump_stats(self.profile_path)
+            self.logger.info(f'Profile of stage {name} written to {self.profile_path}')
+            return
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+        self.logger.info(f'Profile of stage {name}:\n{output.getvalue()}')
+
+
+# 未启用追踪时各模块共用的追踪器
+NULL_TRACER = Tracer(enabled=False)
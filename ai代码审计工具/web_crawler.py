@@ -1,9 +1,177 @@
+import hashlib
 import logging
-from typing import Dict, Any
+import mmap
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional
+from tracing import NULL_TRACER
+
+# 默认只收集这些扩展名的源码文件
+DEFAULT_EXTENSIONS = {
+    '.py', '.php', '.php3', '.php4', '.php5', '.phtml', '.inc',
+    '.js', '.jsx', '.ts', '.tsx', '.vue', '.mjs', '.cjs',
+    '.java', '.jsp', '.jspx', '.kt', '.scala', '.groovy',
+    '.asp', '.aspx', '.ashx', '.asmx', '.cs', '.vb',
+    '.go', '.rs', '.c', '.h', '.cc', '.cpp', '.hpp', '.m', '.swift',
+    '.rb', '.pl', '.pm', '.lua', '.sh', '.bash', '.ps1', '.bat', '.cmd',
+    '.sql', '.html', '.htm', '.xml', '.yml', '.yaml',
+}
+
+# 默认排除的目录和文件（.gitignore语法）
+DEFAULT_EXCLUDES = [
+    '.git/', '.svn/', '.hg/', '.idea/', '.vscode/',
+    'node_modules/', 'bower_components/', '__pycache__/', '.venv/', 'venv/',
+    '.tox/', '.mypy_cache/', '.pytest_cache/', 'dist/', 'build/', 'target/',
+]
+
+# 单文件大小上限，超过的文件通常是构建产物或数据文件
+DEFAULT_MAX_FILE_SIZE = 2 * 1024 * 1024
+
+# 二进制检测读取的文件头长度
+BINARY_SNIFF_SIZE = 8192
+
+# 惰性模式下计算哈希时每次读取的字节数
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+
+_DONE = object()
+
+
+def is_binary(head: bytes) -> bool:
+    """根据文件头判断是否为二进制文件"""
+    if not head:
+        return False
+    if b'\x00' in head:
+        return True
+    non_text = head.translate(None, _TEXT_BYTES)
+    return len(non_text) / len(head) > 0.3
+
+
+def read_text(abs_path: str) -> str:
+    """通过mmap读取文件并按UTF-8解码，不产生中间的bytes副本"""
+    with open(abs_path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return str(mm, 'utf-8', errors='replace')
+        except ValueError:
+            # 空文件无法映射
+            return ''
+
+
+def load_content(record: Dict[str, Any]) -> str:
+    """返回文件记录的内容，惰性记录（不含content）在需要时从磁盘读取，读取结果不保存在记录中"""
+    content = record.get('content')
+    return content if content is not None else read_text(record['abs_path'])
+
+
+def _translate_pattern(pattern: str) -> str:
+    """将单条.gitignore模式转换为正则表达式"""
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += f'[{body}]'
+                i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return f'^{regex}(?:/.*)?$'
+
+
+class IgnoreRules:
+    """.gitignore风格的排除规则"""
+
+    def __init__(self, patterns: Optional[List[str]] = None):
+        self.rules = []
+        for pattern in patterns or []:
+            self.add(pattern)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'IgnoreRules':
+        """从.gitignore文件加载规则"""
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return cls(f.read().splitlines())
+
+    def add(self, pattern: str):
+        """添加一条规则，语法与.gitignore一致"""
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith('#'):
+            return
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if not pattern:
+            return
+        self.rules.append((re.compile(_translate_pattern(pattern)), negate, dir_only))
+
+    def extend(self, other: 'IgnoreRules'):
+        self.rules.extend(other.rules)
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        """判断相对路径是否被排除，后出现的规则优先"""
+        ignored = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                ignored = not negate
+        return ignored
+
 
 class WebCrawler:
-    def __init__(self):
+    def __init__(self, excludes: Optional[List[str]] = None, extensions=None,
+                 max_file_size: int = DEFAULT_MAX_FILE_SIZE, workers: int = 8,
+                 batch_size: int = 64, use_gitignore: bool = True, lazy: bool = False):
+        """
+        Args:
+            excludes: 额外的.gitignore风格排除规则
+            extensions: 允许的扩展名，None使用默认列表，空集合表示不限制
+            max_file_size: 单文件大小上限（字节）
+            workers: 遍历和读取文件的线程数
+            batch_size: 每个读取任务处理的文件数
+            use_gitignore: 是否应用代码根目录下的.gitignore
+            lazy: 为True时只产出不含content的轻量文件句柄，内容由各阶段通过load_content按需读取
+        """
         self.logger = logging.getLogger(__name__)
+        self.ignore_rules = IgnoreRules(DEFAULT_EXCLUDES + list(excludes or []))
+        self.extensions = DEFAULT_EXTENSIONS if extensions is None else {e.lower() for e in extensions}
+        self.max_file_size = max_file_size
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.use_gitignore = use_gitignore
+        self.lazy = lazy
+        self.stats = {}
+        self.tracer = NULL_TRACER
 
     def crawl(self, code_path: str) -> Dict[str, Any]:
         """
@@ -11,9 +179,187 @@ class WebCrawler:
         Args:
             code_path: 需要爬取的代码路径
         Returns:
-            爬取到的代码数据
+            爬取到的代码数据，键为相对路径，值为文件内容（惰性模式下同样读取全部内容）
+        """
+        return {record['path']: load_content(record) for record in self.iter_files(code_path)}
+
+    def iter_files(self, code_path: str,
+                   cancel_event: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """
+        并行遍历代码目录，边遍历边产出文件记录
+        Args:
+            code_path: 需要爬取的代码路径
+            cancel_event: 取消事件，被设置后尽快停止遍历并结束迭代
+        Returns:
+            文件记录迭代器，每条记录包含path、abs_path、size、mtime、hash和content（惰性模式下没有content）
         """
         self.logger.info('Starting code crawling...')
-        # TODO: 实现代码爬取逻辑
-        code_data = {}
-        return code_data
\ No newline at end of file
+        root = os.path.abspath(code_path)
+        if not os.path.exists(root):
+            raise FileNotFoundError(f'代码路径不存在: {code_path}')
+
+        self.stats = {'files': 0, 'bytes': 0, 'ignored': 0, 'extension': 0,
+                      'too_large': 0, 'binary': 0, 'errors': 0}
+
+        if os.path.isfile(root):
+            st = os.stat(root)
+            record = self._read_file(root, os.path.basename(root), st.st_size, st.st_mtime)
+            if record is not None:
+                self.stats['files'] += 1
+                self.stats['bytes'] += record['size']
+                self.tracer.count('crawl', files=1, bytes=record['size'])
+                yield record
+            return
+
+        rules = IgnoreRules()
+        rules.extend(self.ignore_rules)
+        gitignore = os.path.join(root, '.gitignore')
+        if self.use_gitignore and os.path.isfile(gitignore):
+            rules.extend(IgnoreRules.from_file(gitignore))
+
+        results = queue.Queue(maxsize=self.workers * self.batch_size * 2)
+        stop = threading.Event()
+        lock = threading.Lock()
+        pending = [0]
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def count(key, n=1):
+            with lock:
+                self.stats[key] += n
+
+        def submit(fn, *args):
+            with lock:
+                pending[0] += 1
+            pool.submit(run, fn, *args)
+
+        def run(fn, *args):
+            try:
+                if not stop.is_set():
+                    fn(*args)
+            except BaseException as e:
+                put(e)
+            finally:
+                with lock:
+                    pending[0] -= 1
+                    done = pending[0] == 0
+                if done:
+                    put(_DONE)
+
+        def scan_dir(path, rel_dir):
+            batch = []
+            try:
+                entries = os.scandir(path)
+            except OSError as e:
+                self.logger.warning(f'Cannot scan directory {path}: {e}')
+                count('errors')
+                return
+            with entries:
+                for entry in entries:
+                    if stop.is_set():
+                        return
+                    rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if rules.is_ignored(rel_path, is_dir=True):
+                                count('ignored')
+                            else:
+                                submit(scan_dir, entry.path, rel_path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        if rules.is_ignored(rel_path):
+                            count('ignored')
+                            continue
+                        if self.extensions and os.path.splitext(entry.name)[1].lower() not in self.extensions:
+                            count('extension')
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError as e:
+                        self.logger.warning(f'Cannot stat {entry.path}: {e}')
+                        count('errors')
+                        continue
+                    if self.max_file_size and st.st_size > self.max_file_size:
+                        count('too_large')
+                        continue
+                    batch.append((entry.path, rel_path, st.st_size, st.st_mtime))
+                    if len(batch) >= self.batch_size:
+                        submit(read_batch, batch)
+                        batch = []
+            if batch:
+                submit(read_batch, batch)
+
+        def read_batch(batch):
+            with self.tracer.span('crawl.read', 'crawl', files=len(batch)) as span:
+                for abs_path, rel_path, size, mtime in batch:
+                    if stop.is_set():
+                        return
+                    try:
+                        record = self._read_file(abs_path, rel_path, size, mtime)
+                    except OSError as e:
+                        self.logger.warning(f'Cannot read {abs_path}: {e}')
+                        count('errors')
+                        continue
+                    if record is None:
+                        count('binary')
+                        continue
+                    with lock:
+                        self.stats['files'] += 1
+                        self.stats['bytes'] += record['size']
+                    span.add(bytes=record['size'])
+                    put(record)
+
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crawler')
+        try:
+            submit(scan_dir, root, '')
+            # 队列一直有结果时也要检查取消，不能只依赖消费方停止读取
+            while cancel_event is None or not cancel_event.is_set():
+                try:
+                    item = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # 消费方提前结束时通知工作线程退出，避免阻塞在队列上
+            stop.set()
+            pool.shutdown(wait=True)
+            self.tracer.count('crawl', **self.stats)
+            self.logger.info(f'Crawling finished: {self.stats}')
+
+    def _read_file(self, abs_path: str, rel_path: str, size: int, mtime: float) -> Optional[Dict[str, Any]]:
+        """读取单个文件，二进制文件返回None"""
+        with open(abs_path, 'rb') as f:
+            head = f.read(BINARY_SNIFF_SIZE)
+            if is_binary(head):
+                return None
+            if self.lazy:
+                # 只计算哈希，不保留内容
+                digest = hashlib.sha256(head)
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+                return {
+                    'path': rel_path.replace(os.sep, '/'),
+                    'abs_path': abs_path,
+                    'size': f.tell(),
+                    'mtime': mtime,
+                    'hash': digest.hexdigest(),
+                }
+            data = head + f.read()
+        return {
+            'path': rel_path.replace(os.sep, '/'),
+            'abs_path': abs_path,
+            'size': len(data),
+            'mtime': mtime,
+            'hash': hashlib.sha256(data).hexdigest(),
+            'content': data.decode('utf-8', errors='replace'),
+        }